@@ -15,6 +15,10 @@ from .game_handler.middlewares import AuthMiddleware
 from channels.routing import ProtocolTypeRouter, ChannelNameRouter, URLRouter
 from .game_handler.consumers import GameEngineConsumer
 from .game_handler import routing
+from .game_handler.sharding import get_shards_count, get_shard_channel, \
+    get_all_channels
+from .game_handler.layers import InProcessWorkers
+from django.conf import settings
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
@@ -23,7 +27,13 @@ application = ProtocolTypeRouter({
         URLRouter(routing.websocket_urlpatterns)
     ),
 
+    # One game_engine worker per shard (see ENGINE_SHARDS)
     "channel": ChannelNameRouter({
-        "game_engine": GameEngineConsumer.as_asgi()
+        get_shard_channel(shard): GameEngineConsumer.as_asgi(shard=shard)
+        for shard in range(get_shards_count())
     })
 })
+
+# game_engine workers run in this process (no runworker)
+if settings.ENGINE_IN_PROCESS:
+    application = InProcessWorkers(application, channels=get_all_channels())
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GameHandlerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'server.game_handler'
+
+    def ready(self):
+        # invalidation of the authentication cache
+        from . import signals  # noqa: F401
@@ -0,0 +1,525 @@
+import logging
+import math
+import multiprocessing
+import pickle
+import random
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+
+import django
+
+from server.game_handler.data import Board, Player
+from server.game_handler.data.packets import PlayerPacket, ActionEnd, \
+    ActionBuyProperty, ActionBuyHouse, ActionMortgageProperty, AuctionBid, \
+    ActionExchangeAccept, ActionExchangeDecline
+from server.game_handler.data.squares import OwnableSquare, PropertySquare, \
+    GoToJailSquare, TaxSquare
+from server.game_handler.data.state import BoardState
+
+log = logging.getLogger(__name__)
+
+# Money kept by the simulated players before buying a property
+ROLLOUT_BUY_RESERVE = 200
+
+# Candidate action applied to a copy of the board (board, bot)
+Action = Callable[[Board, Player], None]
+
+
+class Decision(Enum):
+    # Mortgage (debts), buy and build during the bot tour, then ActionEnd
+    TOUR_ACTIONS = 0
+
+    # Bid on the current auction
+    AUCTION_BID = 1
+
+    # Accept or decline the current exchange
+    EXCHANGE_RESPONSE = 2
+
+
+class MonteCarlo:
+    """
+    Compares candidate actions of a bot by simulating the next rounds
+    of the game (rollouts) after each of them.
+
+    Rollouts only move players, pay rents/taxes and buy free properties
+    (cards, auctions and exchanges are ignored): this is an estimation,
+    not a replay of the game rules.
+    """
+
+    def __init__(self, player_token: str, level: Dict, seed: int):
+        """
+        :param player_token: Bot deciding
+        :param level: Bot level settings (see ENGINE_CONFIG['BOT_LEVELS'])
+        :param seed: Seed of the rollouts dices
+        """
+        self.player_token = player_token
+        self.rollouts = level['rollouts']
+        self.rounds = level['rounds']
+        self.seed = seed
+        # CPU time of the calling thread, shared by every choice
+        self.deadline = time.thread_time() + level['budget']
+
+    def budget_expired(self) -> bool:
+        return time.thread_time() >= self.deadline
+
+    def evaluate(self, board: Board,
+                 candidates: List[Action]) -> List[Optional[float]]:
+        """
+        :param board: Current board (not modified)
+        :param candidates: Actions to compare
+        :return: Mean outcome of each candidate
+                 (None if the budget expired before its first rollout)
+        """
+        # Rollouts are played on board, restored after each of them
+        state = BoardState.from_board(board)
+        player = board.get_player(self.player_token)
+        totals = [0.0] * len(candidates)
+        counts = [0] * len(candidates)
+
+        for i in range(self.rollouts * len(candidates)):
+            if self.budget_expired():
+                break
+
+            # Candidates are evaluated in turn, with the same dices
+            # (common random numbers)
+            rollout, c = divmod(i, len(candidates))
+            candidates[c](board, player)
+
+            totals[c] += simulate(board, player, self.rounds,
+                                  random.Random(self.seed + rollout))
+            counts[c] += 1
+            state.apply_to_board(board)
+
+        return [totals[c] / counts[c] if counts[c] > 0 else None
+                for c in range(len(candidates))]
+
+    def choose(self, board: Board, candidates: List[Action],
+               default: int = 0) -> int:
+        """
+        :param board: Current board (not modified)
+        :param candidates: Actions to compare
+        :param default: Chosen if no candidate could be evaluated
+        :return: Index of the best candidate
+        """
+        if len(candidates) == 1:
+            return 0
+
+        means = self.evaluate(board, candidates)
+        best = default
+
+        for c, mean in enumerate(means):
+            if mean is None:
+                continue
+            if means[best] is None or mean > means[best]:
+                best = c
+
+        return best
+
+
+def simulate(board: Board, player: Player, rounds: int,
+             rng: random.Random) -> float:
+    """
+    Play rounds with a simple policy (modifies board)
+
+    :param board: Board copy
+    :param player: Evaluated player (in board)
+    :param rounds: Rounds to play
+    :param rng: Dices generator
+    :return: Score of player minus mean score of its opponents
+    """
+    money_go = board.CONFIG.get('MONEY_GO')
+    max_jail_turns = board.CONFIG.get('MAX_JAIL_TURNS')
+    jail_price = board.CONFIG.get('JAIL_LEAVE_PRICE')
+    squares = board.squares
+    size = len(squares)
+    players = [p for p in board.players if not p.bankrupt]
+
+    for _ in range(rounds):
+        for current in players:
+            if current.bankrupt:
+                continue
+
+            a, b = rng.randint(1, 6), rng.randint(1, 6)
+
+            if current.in_jail:
+                if a != b and current.jail_turns + 1 < max_jail_turns:
+                    current.jail_turns += 1
+                    continue
+                if a != b:
+                    current.money -= jail_price
+                current.exit_prison()
+
+            position = current.position + a + b
+            if position >= size:
+                current.money += money_go
+            current.position = position % size
+
+            square = squares[current.position]
+
+            if isinstance(square, GoToJailSquare):
+                current.enter_prison()
+                current.position = board.prison_square_index
+            elif isinstance(square, TaxSquare):
+                current.money -= square.tax_price
+            elif isinstance(square, OwnableSquare):
+                owner = square.owner
+                if owner is None:
+                    if current.money - square.buy_price >= \
+                            ROLLOUT_BUY_RESERVE:
+                        square.owner = current
+                        current.money -= square.buy_price
+                elif owner is not current and not square.mortgaged:
+                    rent = board.get_rent(square, (a, b))
+                    current.money -= rent
+                    owner.money += rent
+
+            if current.money < 0:
+                current.bankrupt = True
+                for owned in board.get_owned_squares(current):
+                    owned.owner = None
+
+    worths = get_net_worths(board)
+    opponents = [worths[p.get_id()] for p in players
+                 if p is not player and not p.bankrupt]
+    worth = worths[player.get_id()]
+
+    if len(opponents) == 0:
+        return worth
+
+    return worth - sum(opponents) / len(opponents)
+
+
+def get_net_worths(board: Board) -> Dict[str, float]:
+    """
+    Net worth of the players: money minus debts, plus what the bank would
+    give for their squares and buildings (unlike Board.get_score(), buying
+    a square at its price does not change the net worth)
+
+    :return: player id => net worth
+    """
+    worths = {player.get_id(): player.money - player.get_total_debts()
+              for player in board.players}
+    squares = board.squares
+
+    for i in board.topology.ownable_indexes:
+        square = squares[i]
+
+        if square.owner is None:
+            continue
+
+        worth = square.buy_price / 2 if square.mortgaged else \
+            square.buy_price
+
+        if isinstance(square, PropertySquare):
+            worth += square.nb_house * square.house_price
+
+        worths[square.owner.get_id()] += worth
+
+    return worths
+
+
+def receive(player: Player, amount: int):
+    """
+    Player receives money, debts are paid first (like the game does)
+    """
+    while amount > 0 and len(player.debts) > 0:
+        debt = player.debts[0]
+        paid = min(debt.amount, amount)
+        debt.amount -= paid
+        amount -= paid
+        if debt.amount == 0:
+            player.debts.popleft()
+
+    player.money += amount
+
+
+def get_mortgage_options(board: Board,
+                         player: Player) -> List[OwnableSquare]:
+    """
+    :return: Squares player can mortgage (no houses in the group)
+    """
+    return [
+        square for square in board.get_owned_squares(player)
+        if not square.mortgaged and not (
+                isinstance(square, PropertySquare)
+                and board.get_house_count_by_owned_group(
+                    square.color, player=player) > 0)
+    ]
+
+
+def get_build_options(board: Board,
+                      player: Player) -> List[PropertySquare]:
+    """
+    :return: Properties where player can buy a house/hotel now
+             (same checks as Game.proceed_tour_actions())
+    """
+    options = []
+
+    for color, total in board.total_properties_color_squares.items():
+        if not board.has_property_group(color, player=player):
+            continue
+
+        group = board.get_color_group(color, player)
+
+        if any(square.mortgaged for square in group):
+            continue
+
+        # Houses are distributed equally: build on the least built one
+        square = min(group, key=lambda s: s.nb_house)
+
+        if square.nb_house >= 5 or \
+                not player.has_enough_money(square.house_price):
+            continue
+
+        if square.nb_house == 4 and not board.bank.has_hotels():
+            continue
+
+        if square.nb_house < 4 and not board.bank.has_houses():
+            continue
+
+        options.append(square)
+
+    return options
+
+
+def nothing(board: Board, player: Player):
+    pass
+
+
+def mortgage(square_id: int) -> Action:
+    def action(board: Board, player: Player):
+        square = board.squares[square_id]
+        square.mortgaged = True
+        receive(player, math.floor(0.5 * square.buy_price))
+
+    return action
+
+
+def buy(square_id: int) -> Action:
+    def action(board: Board, player: Player):
+        square = board.squares[square_id]
+        square.owner = player
+        player.money -= square.buy_price
+
+    return action
+
+
+def build(square_id: int) -> Action:
+    def action(board: Board, player: Player):
+        square = board.squares[square_id]
+        square.nb_house += 1
+        player.money -= square.house_price
+
+    return action
+
+
+def give(square_id: int, owner: Optional[Player]) -> Action:
+    def action(board: Board, player: Player):
+        board.squares[square_id].owner = None if owner is None else \
+            board.get_player(owner.get_id())
+
+    return action
+
+
+def apply_exchange(board: Board, player: Player):
+    """
+    Apply the transfers of the current exchange (see
+    Game.process_exchange_transfers())
+    """
+    current = board.current_exchange
+    first = current.player
+    second = current.selected_player
+
+    money = current.player_money - current.selected_player_money
+    if money > 0 and first.has_enough_money(money):
+        first.money -= money
+        second.money += money
+    elif money < 0 and second.has_enough_money(-money):
+        second.money += money
+        first.money -= money
+
+    for squares, new_owner in ((current.player_squares, second),
+                               (current.selected_player_squares, first)):
+        for square in squares:
+            if not square.mortgaged:
+                square.owner = new_owner
+
+
+def decide_tour(board: Board, player: Player,
+                search: MonteCarlo) -> List[PlayerPacket]:
+    token = player.get_id()
+    packets = []
+
+    # Debts: mortgage until they are paid (bankrupt at tour end otherwise)
+    while player.has_debts():
+        options = get_mortgage_options(board, player)
+
+        if len(options) == 0:
+            break
+
+        # Cheapest property first if the budget is expired
+        options.sort(key=lambda s: s.buy_price)
+        best = search.choose(board, [mortgage(s.id_) for s in options])
+        mortgage(options[best].id_)(board, player)
+        packets.append(ActionMortgageProperty(
+            player_token=token, property_id=options[best].id_))
+
+    can_buy = board.option_first_round_buy or board.current_round != 0
+
+    if not can_buy or player.has_debts():
+        packets.append(ActionEnd(player_token=token))
+        return packets
+
+    square = board.squares[player.position]
+
+    if isinstance(square, OwnableSquare) and square.owner is None \
+            and player.has_enough_money(square.buy_price):
+        if search.choose(board, [nothing, buy(square.id_)]) == 1:
+            buy(square.id_)(board, player)
+            packets.append(ActionBuyProperty(
+                player_token=token, property_id=square.id_))
+
+    # One house at a time, while building is better than nothing
+    while True:
+        options = get_build_options(board, player)
+
+        if len(options) == 0 or search.budget_expired():
+            break
+
+        best = search.choose(board, [nothing] + [
+            build(s.id_) for s in options])
+
+        if best == 0:
+            break
+
+        build(options[best - 1].id_)(board, player)
+        packets.append(ActionBuyHouse(
+            player_token=token, property_id=options[best - 1].id_))
+
+    packets.append(ActionEnd(player_token=token))
+    return packets
+
+
+def decide_auction_bid(board: Board, player: Player,
+                       search: MonteCarlo) -> List[PlayerPacket]:
+    auction = board.current_auction
+
+    if auction is None or auction.highest_bidder == player:
+        return []
+
+    square_id = auction.square.id_
+    winner = auction.highest_bidder if auction.highest_bid > 0 else None
+    means = search.evaluate(board, [give(square_id, winner),
+                                    give(square_id, player)])
+
+    if None in means:
+        return []
+
+    # Highest price where owning the square is still better
+    bid = min(int(means[1] - means[0]), player.money)
+
+    if bid <= auction.highest_bid:
+        return []
+
+    return [AuctionBid(player_token=player.get_id(), bid=bid)]
+
+
+def decide_exchange_response(board: Board, player: Player,
+                             search: MonteCarlo) -> List[PlayerPacket]:
+    if board.current_exchange is None:
+        return []
+
+    token = player.get_id()
+
+    if search.choose(board, [nothing, apply_exchange]) == 1:
+        return [ActionExchangeAccept(player_token=token)]
+
+    return [ActionExchangeDecline(player_token=token)]
+
+
+DECISIONS = {
+    Decision.TOUR_ACTIONS: decide_tour,
+    Decision.AUCTION_BID: decide_auction_bid,
+    Decision.EXCHANGE_RESPONSE: decide_exchange_response,
+}
+
+
+def decide(decision: Decision, player_token: str, snapshot: bytes,
+           level: Dict, seed: int) -> List[PlayerPacket]:
+    """
+    Compute a bot decision (executed by the pool workers)
+
+    :param decision: Decision to take
+    :param player_token: Bot
+    :param snapshot: Pickled board
+    :param level: Bot level settings
+    :param seed: Seed of the rollouts
+    :return: Packets sent by the bot
+    """
+    board = pickle.loads(snapshot)
+    player = board.get_player(player_token)
+
+    if player is None or player.bankrupt:
+        return []
+
+    search = MonteCarlo(player_token, level, seed)
+    return DECISIONS[decision](board, player, search)
+
+
+class BotEngine:
+    """
+    Computes the decisions of the bots of an engine.
+
+    With workers > 0, decisions are computed by a process pool (the game
+    thread only pickles the board), otherwise in the calling thread.
+    """
+    executor: Optional[ProcessPoolExecutor]
+
+    def __init__(self, workers: int, levels: List[Dict]):
+        """
+        :param workers: Processes of the pool (0: no pool)
+        :param levels: Settings of each bot level
+        """
+        self.workers = workers
+        self.levels = levels
+        self.executor = None
+
+    def get_level(self, bot_level: int) -> Dict:
+        return self.levels[max(0, min(bot_level, len(self.levels) - 1))]
+
+    def submit(self, decision: Decision, player: Player,
+               board: Board) -> Future:
+        """
+        :param decision: Decision to take
+        :param player: Bot
+        :param board: Current board (copied before returning)
+        :return: Future of the packets of the bot
+        """
+        args = (decision, player.get_id(),
+                pickle.dumps(board, pickle.HIGHEST_PROTOCOL),
+                self.get_level(player.bot_level), random.getrandbits(32))
+
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(decide(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        if self.executor is None:
+            log.info("Starting bots pool (%d workers)", self.workers)
+            # spawn: the engine process has threads (scheduler, channels)
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup)
+
+        return self.executor.submit(decide, *args)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,60 @@
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Dates are computed from a monotonic counter: changes of the system date
+# (NTP, daylight saving) do not move the timeouts of the games
+ORIGIN = datetime.now()
+ORIGIN_MONOTONIC = time.monotonic()
+
+
+class Clock:
+    """
+    Dates of the games and of their scheduler (timeouts, heartbeat,
+    durations). The date is frozen during a tick: every date of a tick is
+    the same.
+    """
+    frozen: Optional[datetime] = None
+
+    def now(self) -> datetime:
+        if self.frozen is not None:
+            return self.frozen
+
+        return ORIGIN + timedelta(seconds=time.monotonic() - ORIGIN_MONOTONIC)
+
+    def freeze(self):
+        """
+        now() returns the current date until unfreeze()
+        """
+        self.frozen = None
+        self.frozen = self.now()
+
+    def unfreeze(self):
+        self.frozen = None
+
+
+class ManualClock(Clock):
+    """
+    Clock only moved by its owner (replay of a journal, tests)
+    """
+    date: datetime
+
+    def __init__(self, date: datetime = None):
+        self.date = datetime.now() if date is None else date
+
+    def now(self) -> datetime:
+        return self.date
+
+    def set(self, date: datetime):
+        self.date = date
+
+
+class SimulatedClock(ManualClock):
+    """
+    Simulated time: the scheduler jumps straight to the next deadline
+    instead of waiting (see GameScheduler.run_simulation())
+    """
+
+    def advance(self, seconds: float):
+        if seconds > 0:
+            self.date += timedelta(seconds=seconds)
@@ -1,29 +1,127 @@
+import asyncio
 import json
 import logging
+from typing import List
 
-from asgiref.sync import async_to_sync
-from channels.consumer import SyncConsumer
+import msgpack
+from asgiref.sync import sync_to_async
+from channels.consumer import AsyncConsumer, get_handler_name
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
 
 from .data.exceptions import PacketException, GameNotExistsException
 from .data.packets import PacketUtils, PlayerPacket, \
     ExceptionPacket, InternalCheckPlayerValidity, PlayerValid, \
     PlayerDisconnect, InternalPacket, InternalPlayerDisconnect, \
     CreateGame, InternalLobbyConnect, LobbyPacket, LeaveRoom, \
-    InternalLobbyDisconnect, CreateGameSucceed, EnterRoom, EnterRoomSucceed, \
-    LaunchGame, PlayerLobbyPacket
+    InternalLobbyDisconnect, EnterRoom, LaunchGame, PlayerLobbyPacket, \
+    Packet
 from .engine import Engine
+from .logs import Lazy
+from .ratelimit import TokenBucket
+from .sharding import get_game_channel, get_all_channels, \
+    get_shard_channel, get_least_loaded_shard
 
 log = logging.getLogger(__name__)
 
+# Packets read by consumers, every other packet is forwarded without decoding
+PLAYER_CONTROL_PACKETS = {
+    "Exception",
+    "InternalCheckPlayerValidity",
+    "PlayerDisconnect"
+}
 
-class PlayerConsumer(AsyncJsonWebsocketConsumer):
+LOBBY_CONTROL_PACKETS = {
+    "CreateGameSucceed",
+    "EnterRoomSucceed"
+}
+
+
+def get_player_bucket() -> TokenBucket:
+    config = settings.ENGINE_CONFIG
+    return TokenBucket(rate=config.get('PLAYER_PACKETS_RATE'),
+                       burst=config.get('PLAYER_PACKETS_BURST'))
+
+
+class BundleConsumerMixin:
+    """
+    Game engine sends the packets of a tick as a single "send.bundle" message
+    """
+
+    async def send_bundle(self, content):
+        """
+        Dispatch every message of a bundle, in order
+        GameEngine -> Consumer -> WebGL
+        """
+        for message in content.get('messages', []):
+            handler = getattr(self, get_handler_name(message), None)
+
+            # message type not handled by this consumer
+            if handler is None:
+                continue
+
+            await handler(message)
+
+
+class WireFormatMixin:
+    """
+    Format negotiated with ?format= (see AuthMiddleware)
+    json: text frames, packets as JSON objects (default)
+    msgpack: binary frames, compact packets [packet id, *values]
+    """
+    wire_format: str = "json"
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is None or self.wire_format != "msgpack":
+            return await super().receive(text_data=text_data,
+                                         bytes_data=bytes_data, **kwargs)
+
+        try:
+            content = PacketUtils.from_compact(msgpack.unpackb(bytes_data))
+        except (ValueError, PacketException):
+            # send error packet (or ignore)
+            return
+
+        await self.receive_json(content, **kwargs)
+
+    async def send_payload(self, packet: str):
+        """
+        Send a serialized packet in the negotiated format, the compact frame
+        is only built for msgpack sockets
+        :param packet: Packet serialized as JSON
+        """
+        if self.wire_format != "msgpack":
+            return await self.send(text_data=packet)
+
+        try:
+            frame = PacketUtils.to_compact(json.loads(packet))
+        except PacketException:
+            return
+
+        await self.send(bytes_data=msgpack.packb(frame))
+
+    async def send_packet_payload(self, packet: Packet):
+        """
+        send_payload() of a packet built by the consumer (encoded once, in
+        the negotiated format)
+        :param packet: Packet to send
+        """
+        if self.wire_format != "msgpack":
+            return await self.send(text_data=packet.serialize())
+
+        await self.send(bytes_data=msgpack.packb(PacketUtils.to_frame(packet)))
+
+
+class PlayerConsumer(BundleConsumerMixin, WireFormatMixin,
+                     AsyncJsonWebsocketConsumer):
     """
     Consumer between Client and Server
     """
     player_token: str = None
     game_token: str = None
     valid: bool = False
+    # packets received from the client (see PLAYER_PACKETS_RATE)
+    bucket: TokenBucket = None
 
     async def connect(self):
         # User is anonymous
@@ -49,16 +147,17 @@ class PlayerConsumer(AsyncJsonWebsocketConsumer):
         """
 
         self.player_token = str(self.scope['user'].id)
+        self.wire_format = self.scope.get('format', 'json')
 
         packet = InternalCheckPlayerValidity(
             player_token=self.player_token)
 
-        # send to game engine worker
+        # send to game engine worker owning the game
         await self.channel_layer.send(
-            'game_engine',
+            get_game_channel(self.game_token),
             {
                 'type': 'process.packets',
-                'content': packet.serialize(),
+                'content': vars(packet),
                 'game_token': self.game_token,
                 'channel_name': self.channel_name
             }
@@ -73,40 +172,54 @@ class PlayerConsumer(AsyncJsonWebsocketConsumer):
 
     async def receive_json(self, content, **kwargs):
         """
-        1. Deserializing packet
-        2. Check packet validity
-        3. Process local player packets
-        4. Reserialize to send only relevant variables
-        5. Send to game_engine consumer
+        1. Check packet validity (name only)
+        2. Process local player packets
+        3. Send content to game_engine consumer (deserialized once, there)
         """
 
         # Refuse if connection is not valid
         if not self.valid:
             return
 
-        print("Received: %s" % content)
+        if self.bucket is None:
+            self.bucket = get_player_bucket()
+
+        # Over the rate limit: packet dropped, client in debt of more than
+        # a burst is disconnected
+        tokens = self.bucket.consume()
+        if tokens < 0:
+            if tokens < -self.bucket.burst:
+                log.warning("Player %s disconnected, too many packets",
+                            self.player_token)
+                self.valid = False
+                packet = ExceptionPacket(code=4002)
+                await self.send_packet_payload(packet)
+                return await self.close(code=4002)
+            return
+
+        log.debug("Received: %s", content)
 
         try:
-            packet = PacketUtils.deserialize_packet(content)
+            packet_class = PacketUtils.get_packet_class(content)
         except PacketException:
             # send error packet (or ignore)
-            print("packet %s could not be deserialized" % content)
+            log.debug("packet %s could not be deserialized", content)
             return
 
         # Internal packets are not accepted
-        if isinstance(packet, InternalPacket):
+        if issubclass(packet_class, InternalPacket):
             return
 
         # process packets here
-        if isinstance(packet, PlayerPacket):
-            packet.player_token = self.player_token
+        if issubclass(packet_class, PlayerPacket):
+            content['player_token'] = self.player_token
 
-        # send to game engine worker
+        # send to game engine worker owning the game
         await self.channel_layer.send(
-            'game_engine',
+            get_game_channel(self.game_token),
             {
                 'type': 'process.packets',
-                'content': packet.serialize(),
+                'content': content,
                 'game_token': self.game_token,
                 'channel_name': self.channel_name
             }
@@ -130,10 +243,10 @@ class PlayerConsumer(AsyncJsonWebsocketConsumer):
         )
 
         await self.channel_layer.send(
-            'game_engine',
+            get_game_channel(self.game_token),
             {
                 'type': 'process.packets',
-                'content': packet.serialize(),
+                'content': vars(packet),
                 'game_token': self.game_token,
                 'channel_name': self.channel_name
             }
@@ -149,10 +262,12 @@ class PlayerConsumer(AsyncJsonWebsocketConsumer):
         if packet is None:
             return
 
-        packet_content = json.loads(packet)
+        # Only control packets are deserialized, others are sent as is
+        if content.get('name') not in PLAYER_CONTROL_PACKETS:
+            return await self.send_payload(packet)
 
         try:
-            packet = PacketUtils.deserialize_packet(packet_content)
+            packet = PacketUtils.deserialize_packet(json.loads(packet))
         except PacketException:
             # send error packet (or ignore)
             return
@@ -183,7 +298,7 @@ class PlayerConsumer(AsyncJsonWebsocketConsumer):
                 return await self.close(code=4101)
 
         # Send packet to front/cli
-        await self.send(packet.serialize())
+        await self.send_packet_payload(packet)
 
     async def send_packet(self, content):
         """
@@ -195,10 +310,11 @@ class PlayerConsumer(AsyncJsonWebsocketConsumer):
         if packet is None:
             return
 
-        await self.send(packet)
+        await self.send_payload(packet)
 
 
-class LobbyConsumer(AsyncJsonWebsocketConsumer):
+class LobbyConsumer(BundleConsumerMixin, WireFormatMixin,
+                    AsyncJsonWebsocketConsumer):
     player_token: str = None
     game_token: str = None
 
@@ -209,6 +325,7 @@ class LobbyConsumer(AsyncJsonWebsocketConsumer):
             return await self.close(code=4000)
 
         self.player_token = str(self.scope['user'].id)
+        self.wire_format = self.scope.get('format', 'json')
 
         # sending the internal packet to the EngineConsumer
         packet = InternalLobbyConnect(
@@ -217,16 +334,17 @@ class LobbyConsumer(AsyncJsonWebsocketConsumer):
         # adding player to the lobby group
         await self.channel_layer.group_add("lobby", self.channel_name)
 
-        # send to game engine worker
-        await self.channel_layer.send(
-            'game_engine',
-            {
-                'type': 'process.lobby.packets',
-                'content': packet.serialize(),
-                'channel_name': self.channel_name,
-                'game_token': self.game_token
-            }
-        )
+        # send to every game engine worker (each one owns some rooms)
+        for channel in get_all_channels():
+            await self.channel_layer.send(
+                channel,
+                {
+                    'type': 'process.lobby.packets',
+                    'content': vars(packet),
+                    'channel_name': self.channel_name,
+                    'game_token': self.game_token
+                }
+            )
 
         # Don't forget to accept connection
         await self.accept()
@@ -234,30 +352,38 @@ class LobbyConsumer(AsyncJsonWebsocketConsumer):
     async def receive_json(self, content, **kwargs):
 
         try:
-            packet = PacketUtils.deserialize_packet(content)
+            packet_class = PacketUtils.get_packet_class(content)
         except PacketException:
             # send error packet (or ignore)
             return
 
-        print("[ CONSUMER : RECEIVED ] : " + packet.serialize())
+        log.debug("[ CONSUMER : RECEIVED ] : %s", content)
 
-        if isinstance(packet, InternalPacket):
+        if issubclass(packet_class, InternalPacket):
             return
 
-        if isinstance(packet, PlayerLobbyPacket) or \
-                isinstance(packet, CreateGame) or \
-                isinstance(packet, LeaveRoom):
-            packet.player_token = self.player_token
+        if issubclass(packet_class, (PlayerLobbyPacket, CreateGame,
+                                     LeaveRoom)):
+            content['player_token'] = self.player_token
 
         # send to game engine consumer
-        print("[consumer.LobbyConsumer.receive_json] sending to "
-              "game engine (%s)" % packet.name)
+        log.debug("[consumer.LobbyConsumer.receive_json] sending to "
+                  "game engine (%s)", packet_class.__name__)
+
+        if packet_class is CreateGame:
+            # New rooms are created by the least loaded worker
+            shard = await sync_to_async(get_least_loaded_shard)()
+            channel = get_shard_channel(shard)
+        elif packet_class is EnterRoom:
+            channel = get_game_channel(str(content.get('game_token', '')))
+        else:
+            channel = get_game_channel(self.game_token)
 
         await self.channel_layer.send(
-            'game_engine',
+            channel,
             {
                 'type': 'process.lobby.packets',
-                'content': packet.serialize(),
+                'content': content,
                 'channel_name': self.channel_name,
                 'game_token': "" if self.game_token is None else
                 self.game_token
@@ -274,15 +400,16 @@ class LobbyConsumer(AsyncJsonWebsocketConsumer):
         # which is handled in the EngineConsumer
         packet = InternalLobbyDisconnect(self.player_token)
 
-        await self.channel_layer.send(
-            'game_engine',
-            {
-                'type': 'process.lobby.packets',
-                'content': packet.serialize(),
-                'channel_name': self.channel_name,
-                'game_token': self.game_token
-            }
-        )
+        for channel in get_all_channels():
+            await self.channel_layer.send(
+                channel,
+                {
+                    'type': 'process.lobby.packets',
+                    'content': vars(packet),
+                    'channel_name': self.channel_name,
+                    'game_token': self.game_token
+                }
+            )
 
     async def lobby_callback(self, content):
         """
@@ -294,22 +421,20 @@ class LobbyConsumer(AsyncJsonWebsocketConsumer):
         if packet is None:
             return
 
-        packet_content = json.loads(packet)
-
-        try:
-            packet = PacketUtils.deserialize_packet(packet_content)
-        except PacketException:
-            # send error packet (or ignore)
-            return
-
-        if isinstance(packet, CreateGameSucceed) or \
-                isinstance(packet, EnterRoomSucceed):
-            self.game_token = packet.game_token
+        # Only control packets are deserialized, others are sent as is
+        if content.get('name') in LOBBY_CONTROL_PACKETS:
+            try:
+                packet_content = json.loads(packet)
+                self.game_token = PacketUtils.deserialize_packet(
+                    packet_content).game_token
+            except PacketException:
+                # send error packet (or ignore)
+                return
 
         # Send packet to front/cli
-        await self.send(packet.serialize())
+        await self.send_payload(packet)
 
-        print("[ CONSUMER : SENT ] : " + packet.serialize())
+        log.debug("[ CONSUMER : SENT ] : %s", packet)
 
     async def send_lobby_packet(self, content):
         packet = content.get('packet', None)
@@ -317,22 +442,40 @@ class LobbyConsumer(AsyncJsonWebsocketConsumer):
         if packet is None:
             return
 
-        await self.send(packet)
+        await self.send_payload(packet)
 
 
-class GameEngineConsumer(SyncConsumer):
+class GameEngineConsumer(AsyncConsumer):
     """
     Consumer between Game Engine Worker and PlayerConsumer
-    starts consumer when first request is made to game consumer
+    starts consumer when first request is made to game consumer.
+
+    Games are ticked by a task of the event loop of the worker, blocking
+    work (database) is executed by a bounded thread pool (engine.database)
     """
     engine: Engine
+    # lobby packets are handled one at a time, in the order of reception
+    lobby_lock: asyncio.Lock
+    # presence of the players is notified in order
+    presence_lock: asyncio.Lock
 
-    def __init__(self):
-        self.engine = Engine()
+    def __init__(self, shard: int = 0):
+        """
+        :param shard: Index of the shard owned by this worker
+        """
+        self.engine = Engine(shard=shard)
+        self.lobby_lock = asyncio.Lock()
+        self.presence_lock = asyncio.Lock()
+        # games of a previous run of this worker
+        self.engine.restore_games()
         self.connect_debugger()
-        log.info("Starting engine thread")
 
-    def process_packets(self, content):
+    async def __call__(self, scope, receive, send):
+        self.engine.start_async()
+        log.info("Starting engine task")
+        await super().__call__(scope, receive, send)
+
+    async def process_packets(self, content):
         """
         Only packets for existing games are processed here
         :param content: JSON received from PlayerConsumer
@@ -340,12 +483,9 @@ class GameEngineConsumer(SyncConsumer):
         if 'content' not in content:
             return
 
-        log.info("process_packets_info")
-
-        packet_content = json.loads(content['content'])
-
+        # content was validated by consumer, only deserialized here
         try:
-            packet = PacketUtils.deserialize_packet(packet_content)
+            packet = PacketUtils.deserialize_packet(content['content'])
         except PacketException:
             # send error packet (or ignore)
             return
@@ -369,15 +509,15 @@ class GameEngineConsumer(SyncConsumer):
             # if game not exists send error packet
             packet = ExceptionPacket(code=4102)
 
-            async_to_sync(self.channel_layer.send)(
-                channel_name, {
-                    'type': 'player.callback',
-                    'packet': packet.serialize()
-                })
+            await self.channel_layer.send(
+                channel_name,
+                PacketUtils.to_message('player.callback', packet))
 
-    def process_lobby_packets(self, content):
+    async def process_lobby_packets(self, content):
         """
-        lobby packets are handled here
+        lobby packets are handled here, by tasks of the event loop: the
+        other messages of the worker do not wait for the database queries
+        (executed by the thread pool)
         """
         if 'content' not in content:
             return
@@ -391,12 +531,9 @@ class GameEngineConsumer(SyncConsumer):
         channel_name = content['channel_name']
         game_token = content['game_token']
 
-        log.info("process_packets_info")
-
-        packet_content = json.loads(content['content'])
-
+        # content was validated by consumer, only deserialized here
         try:
-            packet = PacketUtils.deserialize_packet(packet_content)
+            packet = PacketUtils.deserialize_packet(content['content'])
         except PacketException:
             # send error packet (or ignore)
             return
@@ -404,29 +541,66 @@ class GameEngineConsumer(SyncConsumer):
         # Check if packet was successfully deserialized
         if packet is None:
             return
+
         # if internal packet:
         if isinstance(packet, InternalLobbyConnect):
             self.engine.connected_players[packet.player_token] = channel_name
             # sending infos about all the lobbies
-            self.engine.send_friend_notification(channel_name=channel_name,
-                                                 player_token=packet.
-                                                 player_token)
             self.engine.send_all_lobby_status(channel_name=channel_name)
+            self.engine.create_task(self.send_presence(
+                player_token=packet.player_token, channel_name=channel_name,
+                online=True))
             return
 
         if isinstance(packet, InternalLobbyDisconnect):
             if packet.player_token in self.engine.connected_players:
                 self.engine.connected_players.pop(packet.player_token)
-            self.engine.disconnect_player(player_token=packet.player_token,
-                                          channel_name=channel_name)
+            self.engine.create_task(self.send_presence(
+                player_token=packet.player_token, channel_name=channel_name,
+                online=False))
+            self.engine.create_task(self.disconnect_player(
+                player_token=packet.player_token, channel_name=channel_name))
             return
 
+        self.engine.create_task(self.handle_lobby_packet(
+            packet, game_token, channel_name))
+
+    async def send_presence(self, player_token: str, channel_name: str,
+                            online: bool):
+        async with self.presence_lock:
+            await self.engine.send_presence(player_token=player_token,
+                                            channel_name=channel_name,
+                                            online=online)
+
+    async def disconnect_player(self, player_token: str, channel_name: str):
+        # after the lobby packets received before the disconnection
+        async with self.lobby_lock:
+            self.engine.disconnect_player(player_token=player_token,
+                                          channel_name=channel_name)
+
+    async def handle_lobby_packet(self, packet: Packet, game_token: str,
+                                  channel_name: str):
+        async with self.lobby_lock:
+            await self.apply_lobby_packet(packet, game_token, channel_name)
+
+    async def apply_lobby_packet(self, packet: Packet, game_token: str,
+                                 channel_name: str):
+        """
+        lobby packets sent by players, users are loaded by the thread pool
+        """
         if not isinstance(packet, LobbyPacket):
             # not supposed to happen
             return
 
+        database = self.engine.database
+
         if isinstance(packet, CreateGame):
-            self.engine.create_game(packet, channel_name)
+            user = await database.run(self.engine.load_creator,
+                                      packet.player_token)
+            if user is None:
+                return
+
+            self.engine.create_game(packet, channel_name, user)
             return
 
         if isinstance(packet, EnterRoom):
@@ -434,7 +608,7 @@ class GameEngineConsumer(SyncConsumer):
 
         # All actions after this condition require a game_token
         if game_token == "":
-            print("[%s] game_token is empty" % packet.name)
+            log.debug("[%s] game_token is empty", packet.name)
             return
 
         if isinstance(packet, LeaveRoom):
@@ -445,13 +619,22 @@ class GameEngineConsumer(SyncConsumer):
             )
             return
 
-        print("Processing packet=%s => (%s)" %
-              (packet.name, packet.serialize()))
+        log.debug("Processing packet=%s => (%s)", packet.name,
+                  Lazy(packet.serialize))
+
+        user = None
+
+        # The user is loaded here: the tick does not query the database
+        if isinstance(packet, EnterRoom):
+            user = await database.run(self.engine.load_user,
+                                      packet.player_token)
+            if user is None:
+                return
 
         try:
             # Send packet to game thread
             self.engine.send_packet(game_uid=game_token, packet=packet,
-                                    channel_name=channel_name)
+                                    channel_name=channel_name, user=user)
         except GameNotExistsException:
             # TODO: Maybe send error?
             return
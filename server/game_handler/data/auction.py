@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
+from server.game_handler.clock import Clock
 from server.game_handler.data import Player
 from server.game_handler.data.squares import OwnableSquare
 
@@ -14,21 +15,25 @@ class Auction:
     timeout: datetime
     tour_duration: int
     tour_remaining_seconds: int
+    # clock of the game
+    clock: Clock
 
     def __init__(self, player: Player, tour_duration: int = 0,
-                 highest_bet: int = 0, square: Optional[OwnableSquare] = None):
+                 highest_bet: int = 0, square: Optional[OwnableSquare] = None,
+                 clock: Optional[Clock] = None):
         self.highest_bid = highest_bet
         self.highest_bidder = player
         self.tour_duration = tour_duration
         self.tour_remaining_seconds = 0
         self.highest_bid = 0
         self.square = square
+        self.clock = Clock() if clock is None else clock
 
     def set_timeout(self, seconds: int):
-        self.timeout = datetime.now() + timedelta(seconds=seconds)
+        self.timeout = self.clock.now() + timedelta(seconds=seconds)
 
     def timeout_expired(self) -> bool:
-        return self.timeout < datetime.now()
+        return self.timeout <= self.clock.now()
 
     def bid(self, player: Player, bid: int) -> bool:
         """
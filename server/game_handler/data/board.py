@@ -1,5 +1,6 @@
+import logging
 import random
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import names
 
@@ -9,19 +10,31 @@ from .cards import ChanceCard, CommunityCard, CardActionType, Card
 from django.conf import settings
 
 from .exchange import Exchange
-from .squares import Square, JailSquare, StationSquare, CompanySquare, \
+from .squares import Square, StationSquare, CompanySquare, \
     OwnableSquare, PropertySquare
+from .ownership import OwnershipIndex
+from .topology import BoardTopology, get_topology
 
+from server.game_handler.logs import Lazy
 from server.game_handler.models import User
 
+log = logging.getLogger(__name__)
+
 
 class Board:
-    squares: List[Square]
+    # squares is a property (topology is refreshed when squares are set)
+    topology: BoardTopology
+    # ownership counters of the ownable squares
+    ownership: OwnershipIndex
     community_deck: List[CommunityCard]
     chance_deck: List[ChanceCard]
     bank: Bank
     board_money: int
     players: List[Player]
+    # player id => player (get_id() of a player never changes in a game)
+    players_by_id: Dict[str, Player]
+    # player id => index in players
+    players_idx: Dict[str, int]
     players_nb: int
     bots_nb: int
     bot_names: []
@@ -33,6 +46,8 @@ class Board:
     current_exchange: Optional[Exchange]
     current_auction: Optional[Auction]
     round_auction_done: bool
+    # every random draw of the game (saved with the board, see journal.py)
+    random: random.Random
 
     # Options
     option_go_case_double_money: bool
@@ -66,6 +81,8 @@ class Board:
         self.chance_deck = []
         self.board_money = 0
         self.players = []
+        self.players_by_id = {}
+        self.players_idx = {}
         self.players_nb = 0
         self.bots_nb = 0
         self.current_player_index = 0
@@ -95,19 +112,46 @@ class Board:
         )
         self.round_auction_done = False
         self.property_list = []
+        self.random = random.Random()
         self.search_square_indexes()
         self.search_card_indexes()
 
     def load_data(self, squares: List[Square],
                   community_deck: List[CommunityCard],
                   chance_deck: List[ChanceCard]):
+        # topology and square indexes are set by squares setter
         self.squares = squares
         self.community_deck = community_deck
         self.chance_deck = chance_deck
 
-        self.search_square_indexes()
         self.search_card_indexes()
 
+    @property
+    def squares(self) -> List[Square]:
+        return self._squares
+
+    @squares.setter
+    def squares(self, squares: List[Square]):
+        self._squares = squares
+        self.topology = get_topology(squares)
+        self.search_square_indexes()
+
+        # squares update the index when they change
+        self.ownership = OwnershipIndex()
+        for i in self.topology.ownable_indexes:
+            squares[i].ownership = self.ownership
+            self.ownership.add(squares[i])
+
+    def __getstate__(self):
+        # topology is shared by boards (and not picklable), see __setstate__
+        state = self.__dict__.copy()
+        del state['topology']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.topology = get_topology(self._squares)
+
     def set_nb_players(self, nb_players):
         """
         this function set the nb of player if the nb_players is within the
@@ -217,27 +261,18 @@ class Board:
 
     def search_square_indexes(self):
         """
-        Search special square indexes
+        Search special square indexes (from board topology)
         """
-        self.total_company_squares = 0
-        self.total_squares = len(self.squares)
-        self.total_properties_color_squares = {}
-
-        for i in range(len(self.squares)):
-            square = self.squares[i]
-            if isinstance(square, JailSquare):
-                self.prison_square_index = i
-                continue
-
-            if isinstance(square, CompanySquare):
-                self.total_company_squares += 1
-                continue
+        topology = self.topology
+        self.total_squares = topology.size
+        self.total_company_squares = len(topology.company_indexes)
+        self.total_properties_color_squares = {
+            color: len(indexes)
+            for color, indexes in topology.color_groups.items()
+        }
 
-            if isinstance(square, PropertySquare):
-                if square.color in self.total_properties_color_squares:
-                    self.total_properties_color_squares[square.color] += 1
-                else:
-                    self.total_properties_color_squares[square.color] = 1
+        if topology.prison_square_index != -1:
+            self.prison_square_index = topology.prison_square_index
 
     def search_card_indexes(self):
         """
@@ -279,10 +314,7 @@ class Board:
         return self.players[self.current_player_index]
 
     def get_player_idx(self, player: Player) -> int:
-        for i in range(len(self.players)):
-            if self.players[i] == player:
-                return i
-        return -1
+        return self.players_idx.get(player.get_id(), -1)
 
     def set_current_player(self, player: Player) -> int:
         """
@@ -300,22 +332,30 @@ class Board:
         return self.players[self.current_player_index]
 
     def get_player(self, uid: str) -> Optional[Player]:
-        for player in self.players:
-            if player.get_id() == uid:
-                return player
-        return None
+        return self.players_by_id.get(uid)
 
     def player_exists(self, uid: str) -> bool:
-        return self.get_player(uid) is not None
+        return uid in self.players_by_id
 
     def add_player(self, player: Player):
-        if self.player_exists(player.get_id()):
+        uid = player.get_id()
+
+        if uid in self.players_by_id:
             return
 
+        self.players_idx[uid] = len(self.players)
+        self.players_by_id[uid] = player
         self.players.append(player)
 
     def remove_player(self, player: Player):
-        self.players.remove(player)
+        uid = player.get_id()
+        idx = self.players_idx.pop(uid)
+        del self.players_by_id[uid]
+        del self.players[idx]
+
+        # following players are shifted
+        for i in range(idx, len(self.players)):
+            self.players_idx[self.players[i].get_id()] = i
 
     def get_online_players_count(self) -> int:
         """
@@ -359,7 +399,7 @@ class Board:
                 return 'Bot %s' % name
             i -= 1
         # If above code fails, then we generate a name like: Bot #<random>
-        return 'Bot #%d' % random.randint(1, 9)
+        return 'Bot #%d' % self.random.randint(1, 9)
 
     def set_bot_names(self):
         """
@@ -427,9 +467,9 @@ class Board:
         temp_position = player.position
         player.position = (player.position
                            + cases) % self.total_squares
-        print("move_player(%s) from %d to %d (dices: %d, cases: %d)"
-              % (player.get_name(), temp_position, player.position,
-                 player.dices_value(), cases))
+        log.debug("move_player(%s) from %d to %d (dices: %d, cases: %d)",
+                  Lazy(player.get_name), temp_position, player.position,
+                  player.dices_value(), cases)
         return player.position < temp_position
 
     def draw_random_card(self, deck: List[Card]) -> Optional[Card]:
@@ -438,7 +478,7 @@ class Board:
         if len(available_deck) == 0:
             return None
 
-        return random.choice(available_deck)
+        return self.random.choice(available_deck)
 
     def draw_random_chance_card(self) -> Optional[ChanceCard]:
         """
@@ -484,44 +524,30 @@ class Board:
         :param player: Player (get player position)
         :return: Index of closest station, or -1 if not found
         """
-        position = player.position
-        squares_len = len(self.squares)
-
-        for i in range(squares_len):
-            position = (position + 1) % squares_len
-
-            if isinstance(self.squares[position], StationSquare):
-                return position
-
-        return -1
+        table = self.topology.next_station
+        return table[player.position] if player.position < len(table) \
+            else -1
 
     def find_closest_company_index(self, player: Player) -> int:
         """
         :param player: Player (get player position)
         :return: Index of closest company, or -1 if not found
         """
-        position = player.position
-        squares_len = len(self.squares)
-
-        for i in range(squares_len):
-            position = (position + 1) % squares_len
-
-            if isinstance(self.squares[position], CompanySquare):
-                return position
-
-        return -1
+        table = self.topology.next_company
+        return table[player.position] if player.position < len(table) \
+            else -1
 
     def get_ownable_squares(self) -> List[OwnableSquare]:
         """
         :return: List of ownable squares
         """
-        return [a for a in self.squares if isinstance(a, OwnableSquare)]
+        return [self.squares[i] for i in self.topology.ownable_indexes]
 
     def get_property_squares(self) -> List[PropertySquare]:
         """
         :return: List of property squares
         """
-        return [a for a in self.squares if isinstance(a, PropertySquare)]
+        return [self.squares[i] for i in self.topology.property_indexes]
 
     def get_player_buildings_count(self, player: Player) -> (int, int):
         """
@@ -529,19 +555,8 @@ class Board:
         :param player: Player (owner)
         :return: (houses, hotels) Total houses and hotels count
         """
-        houses = 0
-        hotels = 0
-
-        for square in self.get_property_squares():
-            if square.owner != player:
-                continue
-
-            if square.has_hotel():
-                hotels += 1
-            else:
-                houses += square.nb_house
-
-        return houses, hotels
+        ownership = self.ownership.get(player)
+        return ownership.houses, ownership.hotels
 
     def compute_current_round(self) -> int:
         """
@@ -559,9 +574,9 @@ class Board:
         :param player: Owner
         :return: List of owned squares
         """
-        return [square for square in self.squares if
-                isinstance(square, OwnableSquare)
-                and square.owner == player]
+        squares = self.squares
+        return [squares[i] for i in self.topology.ownable_indexes
+                if squares[i].owner == player]
 
     def get_rent(self, case: OwnableSquare, dices: (int, int) = (0, 0)) -> int:
         """
@@ -574,20 +589,16 @@ class Board:
         :param dices: Company squares need last dices of player
         :return: Computed rent
         """
-        owned_squares = self.get_owned_squares(player=case.owner)
+        ownership = self.ownership.get(case.owner)
 
         if isinstance(case, StationSquare):
-            stations_count = len(
-                [a for a in owned_squares if
-                 isinstance(a, StationSquare) and not a.mortgaged])
+            stations_count = ownership.unmortgaged_stations
             # 0 stations => 0
             # 1 station: x1 ; 2 stations: x2 ; 3 stations: x4 ; 4 stations: x8
             return 0 if stations_count == 0 else 2 ** (
                     stations_count - 1) * case.get_rent()
         elif isinstance(case, CompanySquare):
-            company_count = len(
-                [a for a in owned_squares if
-                 isinstance(a, CompanySquare) and not a.mortgaged])
+            company_count = ownership.unmortgaged_companies
             # if player has all companies, dices are multiplied by 10
             # else dices are multiplied by 4
             multiplier = 10 if company_count == self.total_company_squares \
@@ -596,8 +607,8 @@ class Board:
         elif isinstance(case, PropertySquare) and case.nb_house == 0:
             # Count all properties owned by the player and which have the same
             # color
-            if self.has_property_group(color=case.color,
-                                       owned_squares=owned_squares):
+            if ownership.colors.get(case.color, 0) == \
+                    self.total_properties_color_squares[case.color]:
                 # If player has all properties of group, multiply rent by 2
                 return case.get_rent() * 2
 
@@ -632,7 +643,8 @@ class Board:
         if owned_squares is None:
             if player is None:
                 return False
-            owned_squares = self.get_owned_squares(player)
+            return self.ownership.get(player).colors.get(color, 0) == \
+                self.total_properties_color_squares[color]
 
         property_count = len([a for a in owned_squares
                               if isinstance(a, PropertySquare)
@@ -656,11 +668,22 @@ class Board:
         if owned_squares is None:
             if player is None:
                 return -1
-            owned_squares = self.get_owned_squares(player)
+            return self.ownership.get(player).color_houses.get(color, 0)
 
         return sum([a.nb_house for a in owned_squares if
                     isinstance(a, PropertySquare) and a.color == color])
 
+    def get_color_group(self, color: str,
+                        player: Player) -> List[PropertySquare]:
+        """
+        :param color: Group color
+        :param player: Owner
+        :return: Properties of a group owned by player
+        """
+        squares = self.squares
+        return [squares[i] for i in self.topology.color_groups.get(color, ())
+                if squares[i].owner == player]
+
     def get_group_property_squares(self, color: str,
                                    player: Optional[Player] = None,
                                    owned_squares: List[OwnableSquare]
@@ -678,7 +701,7 @@ class Board:
         if owned_squares is None:
             if player is None:
                 return []
-            owned_squares = self.get_owned_squares(player)
+            return self.get_color_group(color, player)
 
         return [a for a in owned_squares if
                 isinstance(a, PropertySquare) and a.color == color]
@@ -689,15 +712,7 @@ class Board:
         :param player: Player's score
         :return:
         """
-        score = player.get_score()
-
-        for square in self.get_owned_squares(player):
-            score += square.rent_base
-
-            if isinstance(square, PropertySquare):
-                score += square.nb_house * square.house_price
-
-        return score
+        return player.get_score() + self.ownership.get(player).value
 
     def get_highest_scorer(self) -> Optional[Player]:
         """
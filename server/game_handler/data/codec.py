@@ -0,0 +1,246 @@
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Callable, Dict, Iterable, List, Tuple, Type
+
+# Same output as json.dumps(o, default=lambda o: o.__dict__, sort_keys=True)
+ENCODER = json.JSONEncoder(default=lambda o: o.__dict__, sort_keys=True)
+
+# packet class => (encode function, decode function)
+CODECS: Dict[Type, Tuple[Callable, Callable]] = {}
+
+# packet class => sorted field names (without name), compact format order
+FIELDS: Dict[Type, Tuple[str, ...]] = {}
+
+
+def legacy_serialize(packet) -> str:
+    """
+    Reflective serialization (reference implementation)
+    """
+    return json.dumps(packet, default=lambda o: o.__dict__, sort_keys=True)
+
+
+def get_field_type(annotation, default) -> type:
+    """
+    :param annotation: Class annotation (None if not annotated)
+    :param default: Value of the field in a default instance
+    :return: str, int, bool, list, dict or object (unknown)
+    """
+    for field_type in (bool, int, str, list, dict):
+        if annotation is field_type or isinstance(annotation, field_type):
+            return field_type
+
+    origin = getattr(annotation, '__origin__', None)
+
+    if origin in (list, dict):
+        return origin
+
+    # bool is a subclass of int
+    for field_type in (bool, int, str, list, dict):
+        if isinstance(default, field_type):
+            return field_type
+
+    return object
+
+
+def get_schema(cls: Type) -> List[Tuple[str, type]]:
+    """
+    Fields of a packet class, derived from a default instance and
+    from the annotations of the class (and its parents)
+
+    :param cls: Packet class
+    :return: List of (field name, field type) sorted by name
+    """
+    annotations = {}
+
+    for parent in reversed(cls.__mro__):
+        annotations.update(getattr(parent, '__annotations__', {}))
+
+    try:
+        instance = cls()
+    except TypeError:
+        # Constructor requires arguments (base classes), annotations only
+        return [
+            (name, get_field_type(annotation, None))
+            for name, annotation in sorted(annotations.items())
+        ]
+
+    return [
+        (name, get_field_type(annotations.get(name), value))
+        for name, value in sorted(vars(instance).items())
+    ]
+
+
+def value_expression(var: str, field_type: type) -> str:
+    """
+    :return: Python expression encoding a value like ENCODER does
+    """
+    checks = {
+        str: "ESCAPE(%s) if %s.__class__ is str" % (var, var),
+        int: "INT(%s) if %s.__class__ is int" % (var, var),
+        bool: "('true' if %s else 'false') if %s.__class__ is bool" % (
+            var, var),
+    }
+
+    # Expected type first, values are not always the annotated type
+    order = [field_type] if field_type in checks else []
+    order += [t for t in (str, int, bool) if t not in order]
+
+    return "(%s else ENCODE(%s))" % (
+        " else ".join(checks[t] for t in order), var)
+
+
+def compile_encoder(cls: Type, schema: List[Tuple[str, type]]) -> Callable:
+    names = [name for name, _ in schema]
+    lines = [
+        "def encode(packet):",
+        "    d = packet.__dict__",
+        # Attributes were added/removed on this instance
+        "    if len(d) != %d:" % len(names),
+        "        return ENCODE(d)",
+        "    try:",
+    ]
+
+    for i, name in enumerate(names):
+        lines.append("        v%d = d[%r]" % (i, name))
+
+    lines += [
+        "    except KeyError:",
+        "        return ENCODE(d)",
+    ]
+
+    parts = []
+    for i, (name, field_type) in enumerate(schema):
+        parts.append("%r + %s" % (json.dumps(name) + ": ",
+                                  value_expression("v%d" % i, field_type)))
+
+    if len(parts) == 0:
+        lines.append("    return '{}'")
+    else:
+        lines.append("    return '{' + %s + '}'" % " + ', ' + ".join(parts))
+
+    namespace = {
+        'ESCAPE': encode_basestring_ascii,
+        'INT': int.__repr__,
+        'ENCODE': ENCODER.encode,
+    }
+    exec("\n".join(lines), namespace)
+    encode = namespace['encode']
+    encode.__qualname__ = "encode_%s" % cls.__name__
+
+    return encode
+
+
+def compile_decoder(cls: Type, schema: List[Tuple[str, type]]) -> Callable:
+    lines = [
+        "def decode(packet, obj):",
+    ]
+
+    for name, field_type in schema:
+        # name is never read from the client
+        if name == 'name':
+            continue
+
+        if field_type in (int, bool):
+            default = "0" if field_type is int else "False"
+            lines += [
+                "    if %r in obj:" % name,
+                "        try:",
+                "            packet.%s = %s(obj[%r])" % (
+                    name, field_type.__name__, name),
+                "        except ValueError:",
+                "            packet.%s = %s" % (name, default),
+                "    else:",
+                "        packet.%s = %s" % (name, default),
+            ]
+            continue
+
+        default = {str: '""', list: "[]", dict: "{}"}.get(field_type, "None")
+        lines.append("    packet.%s = obj[%r] if %r in obj else %s" % (
+            name, name, name, default))
+
+    lines.append("    return packet")
+
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    decode = namespace['decode']
+    decode.__qualname__ = "decode_%s" % cls.__name__
+
+    return decode
+
+
+def compile_codec(cls: Type) -> Tuple[Callable, Callable]:
+    """
+    Generate specialized encode/decode functions of a packet class
+
+    :param cls: Packet class
+    :return: (encode, decode)
+    """
+    schema = get_schema(cls)
+    codec = (compile_encoder(cls, schema), compile_decoder(cls, schema))
+
+    CODECS[cls] = codec
+    FIELDS[cls] = tuple(name for name, _ in schema if name != 'name')
+    return codec
+
+
+def compile_codecs(classes: Iterable[Type]):
+    """
+    Compile codecs at import time (instead of on first use)
+    """
+    for cls in classes:
+        if cls not in CODECS:
+            compile_codec(cls)
+
+
+def get_fields(cls: Type) -> Tuple[str, ...]:
+    """
+    :param cls: Packet class
+    :return: Field names sorted by name (name field excluded)
+    """
+    if cls not in FIELDS:
+        compile_codec(cls)
+
+    return FIELDS[cls]
+
+
+def encode(packet) -> str:
+    """
+    :param packet: Packet to encode
+    :return: JSON, byte-identical to legacy_serialize()
+    """
+    codec = CODECS.get(packet.__class__)
+
+    if codec is None:
+        codec = compile_codec(packet.__class__)
+
+    return codec[0](packet)
+
+
+def to_plain(value):
+    """
+    :return: Value with objects replaced by their fields (like ENCODER),
+             only made of msgpack types
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+
+    if isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+
+    return to_plain(vars(value))
+
+
+def decode(packet, obj: Dict):
+    """
+    Set packet fields from a JSON deserialized object
+    Missing or invalid values are replaced by defaults ("", 0, False, ...)
+    """
+    codec = CODECS.get(packet.__class__)
+
+    if codec is None:
+        codec = compile_codec(packet.__class__)
+
+    return codec[1](packet, obj)
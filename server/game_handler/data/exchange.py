@@ -2,6 +2,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional, List
 
+from server.game_handler.clock import Clock
 from server.game_handler.data import Player, Card
 from server.game_handler.data.squares import OwnableSquare
 
@@ -37,9 +38,12 @@ class Exchange:
 
     state: ExchangeState
     timeout: datetime
+    # clock of the game
+    clock: Clock
 
     def __init__(self, player: Player,
-                 selected_player: Optional[Player] = None):
+                 selected_player: Optional[Player] = None,
+                 clock: Optional[Clock] = None):
         self.player = player
         self.selected_player = selected_player
         self.player_squares = []
@@ -49,9 +53,10 @@ class Exchange:
         self.selected_player_cards = []
         self.selected_player_money = 0
         self.state = ExchangeState.STARTED
+        self.clock = Clock() if clock is None else clock
 
     def timeout_expired(self) -> bool:
-        return self.timeout < datetime.now()
+        return self.timeout <= self.clock.now()
 
     def player_has_changes(self) -> bool:
         return self.player_money != 0 \
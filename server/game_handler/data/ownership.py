@@ -0,0 +1,112 @@
+from typing import Dict, Optional
+
+from server.game_handler.data import Player
+from .squares import OwnableSquare, StationSquare, CompanySquare, \
+    PropertySquare
+
+
+class PlayerOwnership:
+    """
+    Counters of the squares owned by one player
+    """
+    squares: int
+    stations: int
+    companies: int
+    unmortgaged_stations: int
+    unmortgaged_companies: int
+    # color => owned properties of the group
+    colors: Dict[str, int]
+    # color => houses on the owned properties of the group
+    color_houses: Dict[str, int]
+    # houses of properties without hotel
+    houses: int
+    hotels: int
+    # sum of rent_base and of buildings price (score without money)
+    value: int
+
+    def __init__(self):
+        self.squares = 0
+        self.stations = 0
+        self.companies = 0
+        self.unmortgaged_stations = 0
+        self.unmortgaged_companies = 0
+        self.colors = {}
+        self.color_houses = {}
+        self.houses = 0
+        self.hotels = 0
+        self.value = 0
+
+
+# Counters of a player without squares (never modified)
+NO_OWNERSHIP = PlayerOwnership()
+
+
+class OwnershipIndex:
+    """
+    Per-player ownership counters of a board.
+
+    Squares call remove() before changing owner, mortgaged or nb_house
+    and add() after (see OwnableSquare setters), counters are always up to
+    date without scanning the board.
+    """
+    # player id => counters
+    players: Dict[str, PlayerOwnership]
+
+    def __init__(self):
+        self.players = {}
+
+    def get(self, player: Optional[Player]) -> PlayerOwnership:
+        """
+        :param player: Owner
+        :return: Counters of player (do not modify)
+        """
+        if player is None:
+            return NO_OWNERSHIP
+
+        return self.players.get(player.get_id(), NO_OWNERSHIP)
+
+    def add(self, square: OwnableSquare):
+        self.update(square, 1)
+
+    def remove(self, square: OwnableSquare):
+        self.update(square, -1)
+
+    def update(self, square: OwnableSquare, sign: int):
+        """
+        Add (sign=1) or remove (sign=-1) the contribution of a square
+        """
+        if square.owner is None:
+            return
+
+        uid = square.owner.get_id()
+        ownership = self.players.get(uid)
+
+        if ownership is None:
+            ownership = PlayerOwnership()
+            self.players[uid] = ownership
+
+        ownership.squares += sign
+        ownership.value += sign * square.rent_base
+
+        if isinstance(square, StationSquare):
+            ownership.stations += sign
+            if not square.mortgaged:
+                ownership.unmortgaged_stations += sign
+        elif isinstance(square, CompanySquare):
+            ownership.companies += sign
+            if not square.mortgaged:
+                ownership.unmortgaged_companies += sign
+        elif isinstance(square, PropertySquare):
+            color = square.color
+            ownership.colors[color] = ownership.colors.get(color, 0) + sign
+            ownership.color_houses[color] = \
+                ownership.color_houses.get(color, 0) + sign * square.nb_house
+            ownership.value += sign * square.nb_house * square.house_price
+
+            if square.has_hotel():
+                ownership.hotels += sign
+            else:
+                ownership.houses += sign * square.nb_house
+
+        if ownership.squares == 0:
+            del self.players[uid]
@@ -1,8 +1,8 @@
 import enum
-import json
 from enum import Enum
-from typing import Dict, List
+from typing import Dict, List, Type
 
+from . import codec
 from .exceptions import PacketException
 
 
@@ -12,38 +12,18 @@ class Packet:
         self.name = name
 
     def serialize(self) -> str:
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
+        """
+        Encoded by a function generated from the packet fields (codec.py)
+        :return: JSON, keys are sorted
+        """
+        return codec.encode(self)
 
     def deserialize(self, obj: object):
-        pass
-
-
-def convert_to_int(obj, key) -> int:
-    """
-    static function used in deserialization
-    :param key: Key to get bool from
-    :param obj: JSON deserialized object
-    """
-    if key not in obj:
-        return 0
-    try:
-        return int(obj[key])
-    except ValueError:
-        return 0
-
-
-def convert_to_bool(obj, key) -> bool:
-    """
-    static function used in deserialization
-    :param key: Key to get bool from
-    :param obj: JSON deserialized object
-    """
-    if key not in obj:
-        return False
-    try:
-        return bool(obj[key])
-    except ValueError:
-        return False
+        """
+        Missing or invalid values are replaced by default values
+        :param obj: JSON deserialized object
+        """
+        codec.decode(self, obj)
 
 
 class LobbyPacket(Packet):
@@ -67,10 +47,6 @@ class PlayerPacket(Packet):
         super().__init__(name)
         self.player_token = player_token
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] \
-            if "player_token" in obj else ""
-
 
 class ChatPacket(PlayerPacket):
     """
@@ -82,10 +58,6 @@ class ChatPacket(PlayerPacket):
         super().__init__("Chat", player_token)
         self.message = message
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.message = obj["message"] if "message" in obj else ""
-
 
 class InternalPacket(Packet):
     """
@@ -105,10 +77,6 @@ class PlayerPropertyPacket(PlayerPacket):
         super().__init__(name, player_token)
         self.property_id = property_id
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.property_id = convert_to_int(obj, "property_id")
-
 
 class InternalCheckPlayerValidity(InternalPacket):
     player_token: str
@@ -119,11 +87,6 @@ class InternalCheckPlayerValidity(InternalPacket):
         self.player_token = player_token
         self.valid = valid
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] \
-            if "player_token" in obj else ""
-        self.valid = convert_to_bool(obj, "valid")
-
 
 class InternalPlayerDisconnect(InternalPacket):
     player_token: str
@@ -134,11 +97,6 @@ class InternalPlayerDisconnect(InternalPacket):
         self.player_token = player_token
         self.reason = reason
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] \
-            if "player_token" in obj else ""
-        self.reason = obj["reason"] if "reason" in obj else ""
-
 
 class PlayerValid(Packet):
     def __init__(self):
@@ -161,12 +119,6 @@ class EnterRoom(PlayerLobbyPacket):
         self.password = password
         self.username = username
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-        self.password = obj["password"] if "password" in obj else ""
-        self.username = obj["username"] if "username" in obj else ""
-
 
 class LaunchGame(PlayerLobbyPacket):
 
@@ -182,9 +134,6 @@ class ExceptionPacket(Packet):
         super().__init__("Exception")
         self.code = code
 
-    def deserialize(self, obj: object):
-        self.code = convert_to_int(obj, "code")
-
 
 class EnterRoomSucceed(LobbyPacket):
     piece: int
@@ -203,13 +152,6 @@ class EnterRoomSucceed(LobbyPacket):
         self.username = username
         self.host_token = host_token
 
-    def deserialize(self, obj: object):
-        self.piece = convert_to_int(obj, "piece")
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-        self.avatar_url = obj["avatar_url"] if "avatar_url" in obj else ""
-        self.username = obj["username"] if "username" in obj else ""
-        self.host_token = obj["host_token"] if "host_token" in obj else ""
-
 
 class LeaveRoom(LobbyPacket):
     player_token: str
@@ -220,11 +162,6 @@ class LeaveRoom(LobbyPacket):
         self.player_token = player_token
         self.game_token = game_token
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] if "player_token" in \
-                                                   obj else ""
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-
 
 class LeaveRoomSucceed(LobbyPacket):
     def __init__(self):
@@ -282,22 +219,6 @@ class StatusRoom(LobbyPacket):
         self.option_first_round_buy = option_first_round_buy
         self.starting_balance = starting_balance
 
-    def deserialize(self, obj: object):
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-        self.game_name = obj["game_name"] if "game_name" in obj else ""
-        self.nb_players = convert_to_int(obj, "nb_players")
-        self.max_nb_players = convert_to_int(obj, "max_nb_players")
-        self.players_data = obj["players_data"] if "players_data" in obj \
-            else []
-        self.option_auction = convert_to_bool(obj, "option_auction")
-        self.option_double_on_start = convert_to_bool(obj,
-                                                      "option_double_on_start")
-        self.option_max_time = convert_to_int(obj, "option_max_time")
-        self.option_max_rounds = convert_to_int(obj, "option_max_rounds")
-        self.option_first_round_buy = \
-            convert_to_bool(obj, "option_first_round_buy")
-        self.starting_balance = convert_to_int(obj, "starting_balance")
-
 
 class BroadcastNewRoomToLobby(LobbyPacket):
     game_token: str
@@ -306,10 +227,15 @@ class BroadcastNewRoomToLobby(LobbyPacket):
     max_nb_players: int
     is_private: bool
     has_password: bool
+    # version of the lobby index of the shard (see lobby.py)
+    version: int
+    # game_engine worker of the room (versions are per shard)
+    shard: int
 
     def __init__(self, game_token: str = "", game_name: str = "",
                  nb_players: int = 0, max_nb_players: int = 0,
-                 is_private: bool = False, has_password: bool = False):
+                 is_private: bool = False, has_password: bool = False,
+                 version: int = 0, shard: int = 0):
         super().__init__(self.__class__.__name__)
         self.game_token = game_token
         self.game_name = game_name
@@ -317,14 +243,43 @@ class BroadcastNewRoomToLobby(LobbyPacket):
         self.max_nb_players = max_nb_players
         self.is_private = is_private
         self.has_password = has_password
+        self.version = version
+        self.shard = shard
 
-    def deserialize(self, obj: object):
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-        self.game_name = obj["game_name"] if "game_name" in obj else ""
-        self.nb_players = convert_to_int(obj, "nb_players")
-        self.max_nb_players = convert_to_int(obj, "max_nb_players")
-        self.is_private = convert_to_bool(obj, "is_private")
-        self.has_password = convert_to_bool(obj, "has_password")
+
+class LobbySnapshot(LobbyPacket):
+    # version of the lobby index of the shard (see lobby.py)
+    version: int
+    # game_engine worker of the rooms (versions are per shard)
+    shard: int
+    # fields of BroadcastNewRoomToLobby
+    rooms: List[dict]
+
+    def __init__(self, version: int = 0, rooms: List[dict] = None,
+                 shard: int = 0):
+        super().__init__(self.__class__.__name__)
+        self.version = version
+        self.shard = shard
+        self.rooms = [] if rooms is None else rooms
+
+
+class BroadcastLobbyChanges(LobbyPacket):
+    # version of the lobby index of the shard (see lobby.py)
+    version: int
+    # game_engine worker of the rooms (versions are per shard)
+    shard: int
+    # rooms created or changed, fields of BroadcastNewRoomToLobby
+    rooms: List[dict]
+    # game tokens of the rooms deleted or launched
+    removed: List[str]
+
+    def __init__(self, version: int = 0, rooms: List[dict] = None,
+                 removed: List[str] = None, shard: int = 0):
+        super().__init__(self.__class__.__name__)
+        self.version = version
+        self.shard = shard
+        self.rooms = [] if rooms is None else rooms
+        self.removed = [] if removed is None else removed
 
 
 class FriendDisconnected(LobbyPacket):
@@ -339,12 +294,6 @@ class FriendDisconnected(LobbyPacket):
         self.username = username
         self.avatar_url = avatar_url
 
-    def deserialize(self, obj: object):
-        self.friend_token = obj["friend_token"] if "friend_token" in obj \
-            else ""
-        self.username = obj["username"] if "username" in obj else ""
-        self.avatar_url = obj["avatar_url"] if "avatar_url" in obj else ""
-
 
 class FriendConnected(LobbyPacket):
     friend_token: str
@@ -358,29 +307,25 @@ class FriendConnected(LobbyPacket):
         self.username = username
         self.avatar_url = avatar_url
 
-    def deserialize(self, obj: object):
-        self.friend_token = obj["friend_token"] if "friend_token" in obj \
-            else ""
-        self.username = obj["username"] if "username" in obj else ""
-        self.avatar_url = obj["avatar_url"] if "avatar_url" in obj else ""
-
 
 class BroadcastUpdateLobby(LobbyPacket):
     game_token: str
     reason: int
     value: str
+    # version of the lobby index of the shard (see lobby.py)
+    version: int
+    # game_engine worker of the room (versions are per shard)
+    shard: int
 
     def __init__(self, game_token: str = "",
-                 reason: int = 0, value: str = ""):
+                 reason: int = 0, value: str = "", version: int = 0,
+                 shard: int = 0):
         super().__init__(self.__class__.__name__)
         self.game_token = game_token
         self.reason = reason
         self.value = value
-
-    def deserialize(self, obj: object):
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-        self.reason = convert_to_int(obj, "reason")
-        self.value = obj["value"] if "value" in obj else ""
+        self.version = version
+        self.shard = shard
 
 
 class BroadcastUpdateRoom(LobbyPacket):
@@ -404,15 +349,6 @@ class BroadcastUpdateRoom(LobbyPacket):
         self.username = username
         self.piece = piece
 
-    def deserialize(self, obj: object):
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-        self.nb_players = convert_to_int(obj, "nb_players")
-        self.player = obj["player"] if "player" in obj else ""
-        self.reason = convert_to_int(obj, "reason")
-        self.avatar_url = obj["avatar_url"] if "avatar_url" in obj else ""
-        self.username = obj["username"] if "username" in obj else ""
-        self.piece = convert_to_int(obj, "piece")
-
 
 class NewHost(LobbyPacket):
     player_token: str
@@ -421,10 +357,6 @@ class NewHost(LobbyPacket):
         super().__init__(self.__class__.__name__)
         self.player_token = player_token
 
-    def deserialize(self, obj: object):
-        self.player_token = obj[
-            "player_token"] if "player_token" in obj else ""
-
 
 class PingPacket(PlayerPacket):
     def __init__(self, player_token: str = ""):
@@ -459,12 +391,6 @@ class GameStart(Packet):
         self.players = [] if players is None else players
         self.timeouts = {} if timeouts is None else timeouts
 
-    def deserialize(self, obj: object):
-        self.game_name = obj["game_name"] if "game_name" in obj else ""
-        self.options = obj["options"] if "options" in obj else {}
-        self.players = obj["players"] if "players" in obj else []
-        self.timeouts = obj["timeouts"] if "timeouts" in obj else {}
-
 
 class PlayerDisconnect(PlayerPacket):
     reason: str
@@ -474,10 +400,6 @@ class PlayerDisconnect(PlayerPacket):
                          player_token=player_token)
         self.reason = reason
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.reason = obj["reason"] if "reason" in obj else ""
-
 
 class PlayerDefeat(PlayerPacket):
     def __init__(self, player_token: str = ""):
@@ -547,11 +469,6 @@ class RoundStart(Packet):
         self.current_player = current_player
         self.can_buy_property = can_buy_property
 
-    def deserialize(self, obj: object):
-        self.current_player = obj["current_player"] \
-            if "current_player" in obj else ""
-        self.can_buy_property = convert_to_bool(obj, "can_buy_property")
-
 
 class RoundDiceChoiceResult(Enum):
     ROLL_DICES = 0
@@ -573,10 +490,6 @@ class RoundDiceChoice(PlayerPacket):
                          player_token=player_token)
         self.choice = choice.value
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.choice = convert_to_int(obj, "choice")
-
 
 class RoundDiceResults(PlayerPacket):
     result: int
@@ -593,13 +506,6 @@ class RoundDiceResults(PlayerPacket):
         self.dice1 = dice1
         self.dice2 = dice2
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        # TODO check enum validity
-        self.result = convert_to_int(obj, "result")
-        self.dice1 = convert_to_int(obj, "dice1")
-        self.dice2 = convert_to_int(obj, "dice2")
-
 
 class PlayerMove(PlayerPacket):
     destination: int
@@ -612,11 +518,6 @@ class PlayerMove(PlayerPacket):
         self.destination = destination
         self.instant = instant
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.destination = convert_to_int(obj, "destination")
-        self.instant = convert_to_bool(obj, "instant")
-
 
 class RoundRandomCard(PlayerPacket):
     card_id: int
@@ -629,11 +530,6 @@ class RoundRandomCard(PlayerPacket):
         self.card_id = card_id
         self.is_community = is_community
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.card_id = convert_to_int(obj, "card_id")
-        self.is_community = convert_to_bool(obj, "is_community")
-
 
 class PlayerUpdateBalance(PlayerPacket):
     old_balance: int
@@ -651,12 +547,6 @@ class PlayerUpdateBalance(PlayerPacket):
         self.new_balance = new_balance
         self.reason = reason
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.old_balance = convert_to_int(obj, "old_balance")
-        self.new_balance = convert_to_int(obj, "new_balance")
-        self.reason = obj["reason"] if "reason" in obj else ""
-
 
 class PlayerPayDebt(PlayerPacket):
     player_to: str
@@ -671,12 +561,6 @@ class PlayerPayDebt(PlayerPacket):
         self.amount = amount
         self.reason = reason
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.player_to = obj["player_to"] if "player_to" in obj else ""
-        self.amount = convert_to_int(obj, "amount")
-        self.reason = obj["reason"] if "reason" in obj else ""
-
 
 class PlayerEnterPrison(PlayerPacket):
     def __init__(self, player_token: str = ""):
@@ -727,11 +611,6 @@ class ActionExchangePlayerSelect(PlayerPacket):
                          player_token=player_token)
         self.selected_player_token = selected_player_token
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.selected_player_token = obj[
-            "selected_player_token"] if "selected_player_token" in obj else ""
-
 
 class ExchangeTradeSelectType(Enum):
     PROPERTY = 0
@@ -761,11 +640,6 @@ class ActionExchangeTradeSelect(PlayerPacket):
 
     def deserialize(self, obj: object):
         super().deserialize(obj)
-        self.value = convert_to_int(obj, "value")
-        self.update_affects_recipient = convert_to_bool(
-            obj, "update_affects_recipient")
-
-        self.exchange_type = convert_to_int(obj, "exchange_type")
 
         if not ExchangeTradeSelectType.has_value(self.exchange_type):
             self.exchange_type = 0
@@ -815,10 +689,7 @@ class ActionExchangeTransfer(PlayerPacket):
         self.transfer_type = transfer_type.value
 
     def deserialize(self, obj: object):
-        self.player_to = obj["player_to"] if "player_to" in obj else ""
-        self.value = convert_to_int(obj, "value")
-
-        self.transfer_type = convert_to_int(obj, "transfer_type")
+        super().deserialize(obj)
 
         if self.transfer_type != 0 and self.transfer_type != 1:
             self.transfer_type = 0
@@ -834,10 +705,6 @@ class ActionAuctionProperty(PlayerPropertyPacket):
                          property_id=property_id)
         self.min_bid = min_bid
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.min_bid = convert_to_int(obj, "min_bid")
-
 
 class AuctionBid(PlayerPacket):
     bid: int
@@ -847,10 +714,6 @@ class AuctionBid(PlayerPacket):
                          player_token=player_token)
         self.bid = bid
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.bid = convert_to_int(obj, "bid")
-
 
 class AuctionEnd(PlayerPacket):
     highest_bid: int
@@ -992,22 +855,6 @@ class CreateGame(LobbyPacket):
         self.option_first_round_buy = option_first_round_buy
         self.username = username
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] if "player_token" in \
-                                                   obj else ""
-        self.password = obj["password"] if "password" in obj else ""
-        self.max_nb_players = convert_to_int(obj, "max_nb_players")
-        self.is_private = convert_to_bool(obj, "is_private")
-        self.game_name = obj["game_name"] if "game_name" in obj else ""
-        self.option_auction = convert_to_bool(obj, "option_auction")
-        self.option_double_on_start = \
-            convert_to_bool(obj, "option_double_on_start")
-        self.option_max_time = convert_to_bool(obj, "option_max_time")
-        self.option_max_rounds = convert_to_int(obj, "option_max_rounds")
-        self.option_first_round_buy = \
-            convert_to_bool(obj, "option_first_round_buy")
-        self.username = obj["username"] if "username" in obj else ""
-
 
 class CreateGameSucceed(LobbyPacket):
     player_token: str
@@ -1025,14 +872,6 @@ class CreateGameSucceed(LobbyPacket):
         self.avatar_url = avatar_url
         self.username = username
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] \
-            if "player_token" in obj else ""
-        self.piece = convert_to_int(obj, "piece")
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-        self.avatar_url = obj["avatar_url"] if "avatar_url" in obj else ""
-        self.username = obj["username"] if "username" in obj else ""
-
 
 class AddBot(PlayerLobbyPacket):
     game_token: str
@@ -1044,11 +883,6 @@ class AddBot(PlayerLobbyPacket):
         self.game_token = game_token
         self.bot_difficulty = bot_difficulty
 
-    def deserialize(self, obj: object):
-        super().deserialize(obj)
-        self.bot_difficulty = convert_to_int(obj, "bot_difficulty")
-        self.game_token = obj["game_token"] if "game_token" in obj else ""
-
 
 class AddBotSucceed(LobbyPacket):
     bot_token: str
@@ -1057,9 +891,6 @@ class AddBotSucceed(LobbyPacket):
         super().__init__("AddBotSucceed")
         self.bot_token = bot_token
 
-    def deserialize(self, obj: object):
-        self.bot_token = obj["bot_token"] if "bot_token" in obj else ""
-
 
 class DeleteBotSucceed(LobbyPacket):
     bot_token: str
@@ -1068,9 +899,6 @@ class DeleteBotSucceed(LobbyPacket):
         super().__init__("DeleteBotSucceed")
         self.bot_token = bot_token
 
-    def deserialize(self, obj: object):
-        self.bot_token = obj["bot_token"] if "bot_token" in obj else ""
-
 
 class InternalLobbyConnect(InternalPacket):
     player_token: str
@@ -1079,10 +907,6 @@ class InternalLobbyConnect(InternalPacket):
         super().__init__("InternalLobbyConnect")
         self.player_token = player_token
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] \
-            if "player_token" in obj else ""
-
 
 class InternalLobbyDisconnect(InternalPacket):
     player_token: str
@@ -1091,10 +915,6 @@ class InternalLobbyDisconnect(InternalPacket):
         super().__init__("InternalLobbyDisconnect")
         self.player_token = player_token
 
-    def deserialize(self, obj: object):
-        self.player_token = obj["player_token"] \
-            if "player_token" in obj else ""
-
 
 class DeleteBot(LobbyPacket):
     bot_token: str
@@ -1103,11 +923,10 @@ class DeleteBot(LobbyPacket):
         super().__init__("DeleteBot")
         self.bot_token = bot_token
 
-    def deserialize(self, obj: object):
-        self.bot_token = obj["bot_token"] if "bot_token" in obj else ""
-
 
 class PacketUtils:
+    # Compact format ids are the positions in this dict:
+    # new packets must be added at the end
     packets = {
         # Utility packets
         "Exception": ExceptionPacket,
@@ -1182,16 +1001,92 @@ class PacketUtils:
         "InternalCheckPlayerValidity": InternalCheckPlayerValidity,
         "InternalPlayerDisconnect": InternalPlayerDisconnect,
         "InternalLobbyConnect": InternalLobbyConnect,
-        "InternalLobbyDisconnect": InternalLobbyDisconnect
+        "InternalLobbyDisconnect": InternalLobbyDisconnect,
+        # Lobby packets (added after the internal packets)
+        "LobbySnapshot": LobbySnapshot,
+        "BroadcastLobbyChanges": BroadcastLobbyChanges
     }
 
+    # name => compact format id (see compile at the end of this file)
+    packet_ids: Dict[str, int] = {}
+    packet_names: List[str] = []
+
+    @staticmethod
+    def to_compact(obj: Dict) -> List:
+        """
+        Compact format: [packet id, *values sorted by field name]
+        :param obj: JSON deserialized packet
+        :return: Compact packet
+        """
+        packet_class = PacketUtils.get_packet_class(obj)
+
+        return [PacketUtils.packet_ids[obj["name"]]] + [
+            obj.get(field) for field in codec.get_fields(packet_class)
+        ]
+
+    @staticmethod
+    def to_frame(packet: Packet) -> List:
+        """
+        to_compact() without the JSON round trip
+        :param packet: Packet to encode
+        :return: Compact packet
+        """
+        packet_class = packet.__class__
+        return [PacketUtils.packet_ids[packet.name]] + [
+            codec.to_plain(getattr(packet, field, None))
+            for field in codec.get_fields(packet_class)
+        ]
+
+    @staticmethod
+    def to_message(message_type: str, packet: Packet) -> Dict:
+        """
+        Channel layer message of a packet, encoded once (JSON) for every
+        recipient: msgpack sockets convert it to a compact frame
+        (see WireFormatMixin.send_payload())
+        :param message_type: Consumer handler (lobby.callback, ...)
+        :param packet: Packet to send
+        """
+        return {
+            'type': message_type,
+            'name': packet.name,
+            'packet': packet.serialize()
+        }
+
+    @staticmethod
+    def from_compact(frame: List) -> Dict:
+        """
+        :param frame: Compact packet ([packet id, *values])
+        :return: JSON deserialized packet (dict with name)
+        """
+        if not isinstance(frame, (list, tuple)) or len(frame) == 0:
+            raise PacketException("Could not deserialize packet")
+
+        packet_id = frame[0]
+
+        if not isinstance(packet_id, int) or \
+                not 0 <= packet_id < len(PacketUtils.packet_names):
+            raise PacketException("Invalid packet")
+
+        name = PacketUtils.packet_names[packet_id]
+        fields = codec.get_fields(PacketUtils.packets[name])
+
+        obj = dict(zip(fields, frame[1:]))
+        obj["name"] = name
+
+        return obj
+
     @staticmethod
     def is_packet(obj: Dict) -> bool:
         return "name" in obj
 
     @staticmethod
-    def deserialize_packet(obj: Dict) -> "Packet":
-        if not PacketUtils.is_packet(obj):
+    def get_packet_class(obj: Dict) -> Type[Packet]:
+        """
+        Validate a packet without deserializing it
+        :param obj: JSON deserialized object
+        :return: Class of the packet
+        """
+        if not isinstance(obj, dict) or not PacketUtils.is_packet(obj):
             raise PacketException("Could not deserialize packet")
 
         packet_name = obj.get("name")
@@ -1199,9 +1094,22 @@ class PacketUtils:
         if packet_name not in PacketUtils.packets:
             raise PacketException("Invalid packet")
 
+        return PacketUtils.packets[packet_name]
+
+    @staticmethod
+    def deserialize_packet(obj: Dict) -> "Packet":
         # create a new instance
-        packet = PacketUtils.packets[packet_name]()
+        packet = PacketUtils.get_packet_class(obj)()
         # deserialize missing values
         packet.deserialize(obj)
 
         return packet
+
+
+# Generate encode/decode functions of every packet at import time
+codec.compile_codecs(PacketUtils.packets.values())
+
+PacketUtils.packet_names = list(PacketUtils.packets)
+PacketUtils.packet_ids = {
+    name: packet_id for packet_id, name in enumerate(PacketUtils.packets)
+}
@@ -1,4 +1,5 @@
 import collections
+import logging
 import random
 import uuid
 from datetime import datetime
@@ -6,13 +7,16 @@ from typing import Optional, Tuple, List, Deque
 
 from server.game_handler.models import User
 
+log = logging.getLogger(__name__)
+
 
 def get_player_avatar(player_token: str):
 
     try:  # get user from database
         user = User.objects.get(id=player_token)
     except User.DoesNotExist:
-        print("[get_player_username] user does not exists")
+        log.warning("get_player_avatar(%s): user does not exists",
+                    player_token)
         return
 
     return user.avatar
@@ -23,7 +27,8 @@ def get_player_username(player_token: str):
     try:  # get user from database
         user = User.objects.get(id=player_token)
     except User.DoesNotExist:
-        print("[get_player_username] user does not exists")
+        log.warning("get_player_username(%s): user does not exists",
+                    player_token)
         return
     return user.name
 
@@ -137,13 +142,15 @@ class Player:
             return 'Bot %s' % self.user.name
         return self.user.name
 
-    def roll_dices(self) -> int:
+    def roll_dices(self, rng: Optional[random.Random] = None) -> int:
         """
         Roll dices
+        :param rng: Random generator of the game (default: random module)
         :return: Sum of two dices
         """
-        a = random.randint(1, 6)
-        b = random.randint(1, 6)
+        rng = random if rng is None else rng
+        a = rng.randint(1, 6)
+        b = rng.randint(1, 6)
         self.current_dices = (a, b)
         return a + b
 
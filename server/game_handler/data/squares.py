@@ -42,18 +42,47 @@ class Square:
 
 
 class OwnableSquare(Square):
-    owner: Optional[Player]
-    mortgaged: bool
     buy_price: int
     rent_base: int
+    # OwnershipIndex of the board, updated when owner, mortgaged or
+    # nb_house change (set by Board)
+    ownership = None
 
     def __init__(self, id_: int = 0, buy_price: int = 0, rent_base: int = 0):
         super().__init__(id_)
-        self.owner = None
-        self.mortgaged = False
+        self._owner = None
+        self._mortgaged = False
         self.buy_price = buy_price
         self.rent_base = rent_base
 
+    @property
+    def owner(self) -> Optional[Player]:
+        return self._owner
+
+    @owner.setter
+    def owner(self, owner: Optional[Player]):
+        if self.ownership is None:
+            self._owner = owner
+            return
+
+        self.ownership.remove(self)
+        self._owner = owner
+        self.ownership.add(self)
+
+    @property
+    def mortgaged(self) -> bool:
+        return self._mortgaged
+
+    @mortgaged.setter
+    def mortgaged(self, mortgaged: bool):
+        if self.ownership is None:
+            self._mortgaged = mortgaged
+            return
+
+        self.ownership.remove(self)
+        self._mortgaged = mortgaged
+        self.ownership.add(self)
+
     def has_owner(self) -> bool:
         return self.owner is not None
 
@@ -118,7 +147,6 @@ class JailSquare(Square):
 
 
 class PropertySquare(OwnableSquare):
-    nb_house: int
     house_price: int  # same as hotel_price
     rents: {}  # 0 : base_rent | 5 : hotel_rent
     color: str
@@ -126,11 +154,25 @@ class PropertySquare(OwnableSquare):
     def __init__(self, id_: int = 0, house_price: int = 0,
                  rents: {} = None, color: str = ""):
         super().__init__(id_)
-        self.nb_house = 0
+        self._nb_house = 0
         self.house_price = house_price
         self.rents = rents
         self.color = color
 
+    @property
+    def nb_house(self) -> int:
+        return self._nb_house
+
+    @nb_house.setter
+    def nb_house(self, nb_house: int):
+        if self.ownership is None:
+            self._nb_house = nb_house
+            return
+
+        self.ownership.remove(self)
+        self._nb_house = nb_house
+        self.ownership.add(self)
+
     def get_rent(self) -> int:
         """
         :return: Properties rent
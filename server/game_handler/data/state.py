@@ -0,0 +1,185 @@
+from array import array
+from collections import deque
+from typing import Tuple
+
+from . import Board
+from .player import PlayerDebt
+from .squares import PropertySquare
+
+# Player flags
+IN_JAIL = 1
+BANKRUPT = 2
+JAIL_CARD_CHANCE = 4
+JAIL_CARD_COMMUNITY = 8
+
+# (debtor index, creditor index (-1: bank), amount, reason)
+Debt = Tuple[int, int, int, str]
+
+
+class BoardState:
+    """
+    Compact copy of the mutable state of a Board: squares and players
+    are stored in fixed-size arrays, indexed like board.squares and
+    board.players (owners are player indexes, -1 if none).
+
+    Static data (squares prices, cards, options, users) is not copied:
+    a state can only be applied to the board it was taken from (or to a
+    copy of it), copy() and apply_to_board() take a few microseconds.
+    """
+    __slots__ = ('owners', 'houses', 'mortgaged', 'money', 'positions',
+                 'jail_turns', 'doubles', 'flags', 'debts', 'board_money',
+                 'current_player_index', 'remaining_round_players',
+                 'current_round', 'bank_houses', 'bank_hotels')
+
+    # per square
+    owners: array
+    houses: array
+    mortgaged: array
+    # per player
+    money: array
+    positions: array
+    jail_turns: array
+    doubles: array
+    flags: array
+    # immutable, shared by copies
+    debts: Tuple[Debt, ...]
+
+    board_money: int
+    current_player_index: int
+    remaining_round_players: int
+    current_round: int
+    bank_houses: int
+    bank_hotels: int
+
+    @classmethod
+    def from_board(cls, board: Board) -> "BoardState":
+        """
+        :param board: Board to copy
+        :return: State of board
+        """
+        state = cls()
+        squares = board.squares
+        players = board.players
+
+        state.owners = array('b', [-1] * len(squares))
+        state.houses = array('b', bytes(len(squares)))
+        state.mortgaged = array('b', bytes(len(squares)))
+
+        for i in board.topology.ownable_indexes:
+            square = squares[i]
+            if square.owner is not None:
+                state.owners[i] = board.get_player_idx(square.owner)
+            if square.mortgaged:
+                state.mortgaged[i] = 1
+            if isinstance(square, PropertySquare):
+                state.houses[i] = square.nb_house
+
+        state.money = array('q', [player.money for player in players])
+        state.positions = array('b', [player.position for player in players])
+        state.jail_turns = array('b', [player.jail_turns
+                                       for player in players])
+        state.doubles = array('b', [player.doubles for player in players])
+        state.flags = array('b', [get_flags(player) for player in players])
+
+        debts = []
+        for i, player in enumerate(players):
+            for debt in player.debts:
+                creditor = -1 if debt.creditor is None else \
+                    board.get_player_idx(debt.creditor)
+                debts.append((i, creditor, debt.amount, debt.reason))
+        state.debts = tuple(debts)
+
+        state.board_money = board.board_money
+        state.current_player_index = board.current_player_index
+        state.remaining_round_players = board.remaining_round_players
+        state.current_round = board.current_round
+        state.bank_houses = board.bank.nb_house
+        state.bank_hotels = board.bank.nb_hotel
+
+        return state
+
+    def copy(self) -> "BoardState":
+        state = BoardState()
+
+        for name in BoardState.__slots__:
+            value = getattr(self, name)
+            # arrays are copied, other values are immutable
+            setattr(state, name, value[:] if isinstance(value, array)
+                    else value)
+
+        return state
+
+    def apply_to_board(self, board: Board):
+        """
+        Restore board to this state (only modified squares are updated,
+        the ownership index of board stays consistent)
+
+        :param board: Board the state was taken from (or a copy of it)
+        :raises ValueError: Board has not the same squares and players
+        """
+        squares = board.squares
+        players = board.players
+
+        if len(squares) != len(self.owners) or \
+                len(players) != len(self.money):
+            raise ValueError("BoardState does not match the board")
+
+        for i in board.topology.ownable_indexes:
+            square = squares[i]
+            index = self.owners[i]
+            owner = None if index < 0 else players[index]
+
+            if square.owner is not owner:
+                square.owner = owner
+            if square.mortgaged != bool(self.mortgaged[i]):
+                square.mortgaged = bool(self.mortgaged[i])
+            if isinstance(square, PropertySquare) and \
+                    square.nb_house != self.houses[i]:
+                square.nb_house = self.houses[i]
+
+        for i, player in enumerate(players):
+            player.money = self.money[i]
+            player.position = self.positions[i]
+            player.jail_turns = self.jail_turns[i]
+            player.doubles = self.doubles[i]
+            flags = self.flags[i]
+            player.in_jail = bool(flags & IN_JAIL)
+            player.bankrupt = bool(flags & BANKRUPT)
+            player.jail_cards['chance'] = bool(flags & JAIL_CARD_CHANCE)
+            player.jail_cards['community'] = bool(
+                flags & JAIL_CARD_COMMUNITY)
+            if len(player.debts) > 0:
+                player.debts = deque()
+
+        for debtor, creditor, amount, reason in self.debts:
+            players[debtor].debts.append(PlayerDebt(
+                creditor=None if creditor < 0 else players[creditor],
+                amount=amount,
+                reason=reason
+            ))
+
+        board.board_money = self.board_money
+        board.current_player_index = self.current_player_index
+        board.remaining_round_players = self.remaining_round_players
+        board.current_round = self.current_round
+        board.bank.nb_house = self.bank_houses
+        board.bank.nb_hotel = self.bank_hotels
+
+    def __eq__(self, other):
+        if not isinstance(other, BoardState):
+            return False
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in BoardState.__slots__)
+
+
+def get_flags(player) -> int:
+    flags = 0
+    if player.in_jail:
+        flags |= IN_JAIL
+    if player.bankrupt:
+        flags |= BANKRUPT
+    if player.jail_cards['chance']:
+        flags |= JAIL_CARD_CHANCE
+    if player.jail_cards['community']:
+        flags |= JAIL_CARD_COMMUNITY
+    return flags
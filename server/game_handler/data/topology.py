@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple
+
+from .squares import Square, JailSquare, StationSquare, CompanySquare, \
+    OwnableSquare, PropertySquare
+
+
+@dataclass(frozen=True)
+class BoardTopology:
+    """
+    Immutable index of a board layout (type and color of each square).
+    Built once per layout, shared by every board loaded with this layout.
+    """
+    size: int
+    # -1 if there is no jail square
+    prison_square_index: int
+    ownable_indexes: Tuple[int, ...]
+    property_indexes: Tuple[int, ...]
+    station_indexes: Tuple[int, ...]
+    company_indexes: Tuple[int, ...]
+    # color => indexes of the properties of the group
+    color_groups: Mapping[str, Tuple[int, ...]]
+    # position => index of the next station/company (-1 if none)
+    next_station: Tuple[int, ...]
+    next_company: Tuple[int, ...]
+
+
+# layout => topology
+TOPOLOGIES: Dict[Tuple, BoardTopology] = {}
+
+
+def get_layout(squares: List[Square]) -> Tuple:
+    """
+    :return: Hashable layout of squares (square types and colors)
+    """
+    return tuple((square.__class__, getattr(square, 'color', None))
+                 for square in squares)
+
+
+def next_indexes(size: int, indexes: Tuple[int, ...]) -> Tuple[int, ...]:
+    """
+    :param size: Number of squares
+    :param indexes: Indexes of the searched squares
+    :return: For each position, first index found after position
+             (board is a ring, position itself is checked last)
+    """
+    searched = set(indexes)
+    table = []
+
+    for position in range(size):
+        found = -1
+        for i in range(1, size + 1):
+            if (position + i) % size in searched:
+                found = (position + i) % size
+                break
+        table.append(found)
+
+    return tuple(table)
+
+
+def build_topology(squares: List[Square]) -> BoardTopology:
+    size = len(squares)
+    prison_square_index = -1
+    color_groups = {}
+
+    for i, square in enumerate(squares):
+        if isinstance(square, JailSquare):
+            prison_square_index = i
+        elif isinstance(square, PropertySquare):
+            color_groups.setdefault(square.color, []).append(i)
+
+    def indexes_of(square_type: type) -> Tuple[int, ...]:
+        return tuple(i for i, square in enumerate(squares)
+                     if isinstance(square, square_type))
+
+    station_indexes = indexes_of(StationSquare)
+    company_indexes = indexes_of(CompanySquare)
+
+    return BoardTopology(
+        size=size,
+        prison_square_index=prison_square_index,
+        ownable_indexes=indexes_of(OwnableSquare),
+        property_indexes=indexes_of(PropertySquare),
+        station_indexes=station_indexes,
+        company_indexes=company_indexes,
+        color_groups=MappingProxyType({
+            color: tuple(indexes) for color, indexes in color_groups.items()
+        }),
+        next_station=next_indexes(size, station_indexes),
+        next_company=next_indexes(size, company_indexes)
+    )
+
+
+def get_topology(squares: List[Square]) -> BoardTopology:
+    """
+    :param squares: Squares of a board
+    :return: Topology of the layout (built on first use)
+    """
+    layout = get_layout(squares)
+    topology = TOPOLOGIES.get(layout)
+
+    if topology is None:
+        topology = build_topology(squares)
+        TOPOLOGIES[layout] = topology
+
+    return topology
@@ -0,0 +1,65 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from channels.db import database_sync_to_async
+from django.db import close_old_connections
+
+log = logging.getLogger(__name__)
+
+
+class DatabasePool:
+    """
+    Bounded thread pool of the async game_engine worker: the ORM (and
+    async_to_sync) can not be used in the event loop thread, blocking work
+    is executed here.
+    """
+
+    def __init__(self, workers: int):
+        """
+        :param workers: Threads of the pool
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="Database")
+
+    async def run(self, function: Callable, *args, **kwargs) -> Any:
+        """
+        Await blocking work from the event loop, channel layer calls
+        (async_to_sync) of the function are executed in the event loop
+        :param function: Blocking function
+        :return: Result of the function
+        """
+        return await database_sync_to_async(
+            function, thread_sensitive=False,
+            executor=self.executor)(*args, **kwargs)
+
+    def submit(self, function: Callable, *args, **kwargs):
+        """
+        Execute writes without waiting for them
+        :param function: Blocking function
+        """
+        future = self.executor.submit(execute, function, *args, **kwargs)
+        future.add_done_callback(log_error)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def execute(function: Callable, *args, **kwargs) -> Any:
+    """
+    Execute a function in a pool thread, expired database connections
+    are closed (like database_sync_to_async)
+    """
+    close_old_connections()
+
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def log_error(future: Future):
+    exception = future.exception()
+
+    if exception is not None:
+        log.error("Database work failed", exc_info=exception)
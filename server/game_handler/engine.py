@@ -1,27 +1,46 @@
+import asyncio
 import copy
+import functools
 import json
+import logging
 import os
-from typing import List, Dict
+import time
+from typing import Callable, Coroutine, List, Dict, Optional, Set
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
+from server.game_handler.bots import BotEngine
+from server.game_handler.clock import Clock
 from server.game_handler.data import Player
 from server.game_handler.data.cards import ChanceCard, CommunityCard, CardUtils
 from server.game_handler.data.exceptions import \
     GameNotExistsException
+from server.game_handler.database import DatabasePool
 from server.game_handler.data.packets import Packet, ExceptionPacket, \
     CreateGame, CreateGameSucceed, UpdateReason, BroadcastUpdateLobby, \
     BroadcastUpdateRoom, LeaveRoom, BroadcastNewRoomToLobby, \
-    LeaveRoomSucceed, NewHost, StatusRoom, FriendConnected, FriendDisconnected
+    LeaveRoomSucceed, NewHost, StatusRoom, PacketUtils
 
 from django.conf import settings
 
-from server.game_handler.data.player import get_player_avatar, \
-    get_player_username
 from server.game_handler.data.squares import Square, SquareUtils
-from server.game_handler.game import Game, GameState, QueuePacket
-from server.game_handler.models import User, UserFriend
+from server.game_handler.game import Game, GameState, OutboundType, \
+    QueuePacket
+from server.game_handler.journal import Journal, get_journal_dir, \
+    get_journal_path
+from server.game_handler.lobby import LobbyIndex
+from server.game_handler.metrics import Metrics, publish_metrics
+from server.game_handler.presence import get_cached_presence, \
+    get_presence_messages, load_presence
+from server.game_handler.models import User
+from server.game_handler.scheduler import GameScheduler
+from server.game_handler.sharding import generate_game_uid, \
+    publish_shard_load, get_shards_count, get_player_game, PlayerRegistry, \
+    FRIENDS_SHARD, SHARD_LOAD_TIMEOUT
+from server.game_handler.snapshots import SnapshotStore, get_snapshot_store
+
+log = logging.getLogger(__name__)
 
 
 class Engine:
@@ -31,17 +50,76 @@ class Engine:
     community_deck: List[CommunityCard]
     # dictionary of id and channel_name for player in Lobby
     connected_players: Dict
+    # player token => uid of the game where the player is
+    player_games: Dict[str, str]
+    # games of the real players, shared with the other shards
+    players: PlayerRegistry
     offline: bool
-
-    def __init__(self):
+    scheduler: GameScheduler
+    # index of the shard owned by this engine (see sharding.py)
+    shard: int
+    metrics: Metrics
+    # rooms in LOBBY state, sent to the clients connecting to the lobby
+    lobby: LobbyIndex
+    # running sends of the event loop (references kept until done)
+    tasks: Set[asyncio.Task]
+    # decisions of the bots of every game
+    bots: BotEngine
+    # None => games are not saved (GAME_SNAPSHOTS setting)
+    snapshots: Optional[SnapshotStore]
+    # dates of the scheduler and of the games
+    clock: Clock
+    # None => games are not recorded (GAME_JOURNAL_DIR setting)
+    journal_dir: Optional[str]
+    # blocking work of the async worker (see start_async())
+    database: Optional[DatabasePool]
+
+    def __init__(self, shard: int = 0, clock: Clock = None):
+        self.shard = shard
+        self.clock = Clock() if clock is None else clock
         self.games = {}
         self.squares = []
         self.chance_deck = []
         self.community_deck = []
         self.connected_players = {}
+        self.player_games = {}
+        self.tasks = set()
         self.channel_layer = get_channel_layer()
         self.__load_json()
         self.offline = getattr(settings, "SERVER_OFFLINE", True)
+        self.CONFIG = getattr(settings, "ENGINE_CONFIG", None)
+        self.scheduler = GameScheduler(clock=self.clock)
+        self.journal_dir = get_journal_dir()
+        self.database = None
+        self.metrics = Metrics()
+        self.bots = BotEngine(workers=self.CONFIG.get('BOT_WORKERS', 0),
+                              levels=self.CONFIG.get('BOT_LEVELS'))
+
+        # 0 => every lobby update is broadcast by its game
+        interval = self.CONFIG.get('LOBBY_BROADCAST_INTERVAL', 0)
+        self.lobby = LobbyIndex(shard=shard,
+                                on_change=None if interval <= 0 else
+                                functools.partial(self.scheduler.call_later,
+                                                  interval, self.flush_lobby))
+
+        self.players = PlayerRegistry()
+
+        # Load and players are republished before they expire (see
+        # get_least_loaded_shard and PlayerRegistry)
+        if get_shards_count() > 1:
+            self.scheduler.add_job(SHARD_LOAD_TIMEOUT / 3, self.publish_load)
+            self.scheduler.add_job(SHARD_LOAD_TIMEOUT / 3,
+                                   self.publish_players)
+
+        # 0 => metrics are not published
+        interval = self.CONFIG.get('METRICS_PUBLISH_INTERVAL', 0)
+        if interval > 0:
+            self.scheduler.add_job(interval, self.publish_metrics)
+
+        self.snapshots = get_snapshot_store(shard)
+        if self.snapshots is not None:
+            self.scheduler.add_job(self.CONFIG.get('SNAPSHOT_INTERVAL'),
+                                   self.snapshot_games)
 
     def __load_json(self):
         squares_path = os.path.join(settings.STATIC_ROOT, 'data/squares.json')
@@ -73,10 +151,15 @@ class Engine:
         """
         Checks if a player exists in any of the game instances
         """
-        for game in self.games:
-            if self.games[game].board.player_exists(player_token):
-                return True
-        return False
+        return player_token in self.player_games
+
+    def get_player_game(self, player_token: str) -> Optional[Game]:
+        """
+        :param player_token: Player token
+        :return: Game where the player is, None if not in a game
+        """
+        uid = self.player_games.get(player_token)
+        return None if uid is None else self.games.get(uid)
 
     def add_game(self, game: Game):
         """
@@ -94,17 +177,187 @@ class Engine:
             community_deck=[copy.copy(card) for card in self.community_deck],
         )
 
+        self.attach_game(game)
+
+        # start game only if state is offline
+        if game.state is not GameState.OFFLINE:
+            return
+
+        game.start()
+
+        # Ticks are executed by the scheduler (one thread for all games)
+        self.scheduler.add_game(game)
+
+        self.publish_load()
+
+    def attach_game(self, game: Game):
+        """
+        Share the engine indexes and services with a game
+        """
         # Reference to games dict (delete game)
         game.games = self.games
+        game.player_games = self.player_games
+        game.publish_player = self.players.set_player
+        game.index_players()
+        game.metrics = self.metrics
+        game.lobby = self.lobby
+        game.bots = self.bots
+        game.wake = functools.partial(self.scheduler.wake, game)
+        game.publish_load = self.publish_load
+        game.database = self.database
+        self.set_clock(game)
+
+        if self.journal_dir is not None and game.journal is None:
+            game.journal = Journal(get_journal_path(self.journal_dir,
+                                                    game.uid))
 
         self.games[game.uid] = game
+        # restored rooms
+        self.lobby.set_room(game.uid, game.get_lobby_room())
 
-        # start thread only if state is offline
-        if game.state is not GameState.OFFLINE:
+    def set_clock(self, game: Game):
+        """
+        Use the engine clock for the dates of a game (the deadlines of the
+        scheduler are computed with it)
+        """
+        game.clock = self.clock
+        board = game.board
+
+        for action in (board.current_auction, board.current_exchange):
+            if action is not None:
+                action.clock = self.clock
+
+    def start_async(self) -> asyncio.Task:
+        """
+        Run the games in the running event loop (async game_engine worker),
+        blocking database work goes to a bounded thread pool
+        """
+        if self.database is None:
+            self.database = DatabasePool(
+                workers=self.CONFIG.get('DATABASE_WORKERS'))
+
+            for game in self.games.values():
+                game.database = self.database
+
+        return self.scheduler.start_async()
+
+    def restore_games(self):
+        """
+        Restore the games saved before the last stop of this worker (before
+        the scheduler is started), players reconnect to them
+        """
+        if self.snapshots is None:
             return
 
-        # Start thread
-        game.start()
+        for game in self.snapshots.load(self.clock):
+            self.attach_game(game)
+            self.scheduler.add_game(game)
+
+        self.publish_load()
+        self.snapshots.start()
+
+    def snapshot_games(self):
+        """
+        Queue snapshots of the games that changed (scheduler thread)
+        """
+        self.snapshots.capture(list(self.games.values()))
+
+    def publish_load(self):
+        """
+        Publish the number of games of this shard (routing of CreateGame)
+        """
+        self.submit(publish_shard_load, self.shard, len(self.games))
+
+    def publish_players(self):
+        """
+        Republish the game of every real player of this shard (a player
+        is in one game at most, whatever its shard)
+        """
+        self.players.refresh({
+            player.get_id(): game.uid
+            for game in list(self.games.values())
+            for player in game.board.players if not player.bot
+        })
+
+    def publish_metrics(self):
+        """
+        Push metrics of this worker to the cache (read by the metrics view)
+        """
+        families = self.metrics.collect(
+            [game.state.name for game in list(self.games.values())])
+        self.submit(publish_metrics, self.shard, families)
+
+    def submit(self, function: Callable, *args):
+        """
+        Cache writes are blocking: executed by the database pool of the
+        async worker, without waiting for them (directly otherwise)
+        :param function: Blocking function
+        """
+        if self.database is None:
+            function(*args)
+            return
+
+        self.database.submit(function, *args)
+
+    def flush_lobby(self):
+        """
+        Broadcast the rooms changed since the last flush in one message
+        (scheduled by the first change)
+        """
+        message = self.lobby.take_changes()
+
+        if message is None:
+            return
+
+        if self.scheduler.loop is None:
+            async_to_sync(self.broadcast_lobby)(message)
+            return
+
+        # Job executed by the event loop (see start_async())
+        self.create_task(self.broadcast_lobby(message))
+
+    def create_task(self, coroutine: Coroutine) -> asyncio.Task:
+        """
+        Run a coroutine in the event loop without waiting for it, failures
+        are logged
+        :param coroutine: Coroutine to run
+        """
+        task = self.scheduler.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+        return task
+
+    def task_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Task %s failed", task.get_coro().__qualname__,
+                      exc_info=task.exception())
+
+    async def broadcast_lobby(self, message: Dict):
+        start = time.perf_counter()
+        await self.channel_layer.group_send("lobby", message)
+        self.metrics.observe_channel('lobby', time.perf_counter() - start)
+        self.metrics.count_packets_sent([message])
+
+    def send_to_channel(self, channel_name: str, message: Dict):
+        """
+        Send a message to a channel (not awaited in the event loop of the
+        async worker, blocking otherwise)
+        :param channel_name: Channel to send message to
+        :param message: Channel layer message
+        """
+        if self.scheduler.loop is None:
+            async_to_sync(self.send_channel)(channel_name, message)
+            return
+
+        self.create_task(self.send_channel(channel_name, message))
+
+    async def send_channel(self, channel_name: str, message: Dict):
+        start = time.perf_counter()
+        await self.channel_layer.send(channel_name, message)
+        self.metrics.observe_channel('send', time.perf_counter() - start)
+        self.metrics.count_packets_sent([message])
 
     def remove_game(self, uid: str):
         """
@@ -113,7 +366,7 @@ class Engine:
         :param uid: UUID of an existing game
         """
 
-        print("remove_game(%s)" % uid)
+        log.info("remove_game(%s)", uid)
 
         if uid not in self.games:
             raise GameNotExistsException()
@@ -124,23 +377,49 @@ class Engine:
         game.state = GameState.STOP_THREAD
 
         del self.games[uid]
+        game.unindex_players()
+
+        self.publish_load()
+
+        # proceed_stop() is executed by the scheduler
+        self.scheduler.wake(game)
 
     def send_packet(self, game_uid: str, packet: Packet,
-                    channel_name: str = None):
+                    channel_name: str = None, user: User = None) -> bool:
         """
-        Add packet to game packets queue
-        Blocking thread until packet is added to queue
+        Add packet to game packets queue (never blocks)
 
         :param game_uid: UUID of an existing game
         :param packet: Packet to send
         :param channel_name: Channel name (to contact player)
+        :param user: User of the player (EnterRoom, see load_user())
+        :return: False if the packet was dropped (queue of the game full)
         """
         if game_uid not in self.games:
             raise GameNotExistsException()
 
-        # Blocking function that adds packet to queue
-        self.games[game_uid].packets_queue.put(
-            QueuePacket(packet=packet, channel_name=channel_name))
+        game = self.games[game_uid]
+
+        if not game.packets_queue.put(
+                QueuePacket(packet=packet, channel_name=channel_name,
+                            user=user)):
+            self.metrics.count_packet_dropped(packet.name)
+            return False
+
+        # Process packet on next scheduler loop
+        self.scheduler.wake(game)
+        return True
+
+    def load_user(self, player_token: str) -> Optional[User]:
+        """
+        Query the user of a player (blocking: database pool thread)
+        :param player_token: Player token
+        :return: User, None if it does not exist
+        """
+        try:
+            return User.objects.get(id=player_token)
+        except User.DoesNotExist:
+            return None
 
     def leave_game(self, packet, game_token: str, channel_name: str):
         """
@@ -155,9 +434,7 @@ class Engine:
         if not isinstance(packet, LeaveRoom):
             return
 
-        print("def leave_game(%s)" % game_token)
-
-        print(self.games)
+        log.debug("leave_game(%s)", game_token)
 
         # check if player is part of a room
         if game_token not in self.games:
@@ -174,15 +451,13 @@ class Engine:
             return
 
         # player leaves game group
-        async_to_sync(
-            game.channel_layer.group_discard)(game.uid,
-                                              channel_name)
+        game.group_discard(game.uid, channel_name)
 
         # if checks passed, kick out player
         piece = player.piece
         avatar = player.user.avatar
         username = player.user.name
-        game.board.remove_player(player)
+        game.remove_player(player)
 
         game.send_lobby_packet(channel_name=channel_name,
                                packet=LeaveRoomSucceed())
@@ -223,49 +498,70 @@ class Engine:
 
         update = BroadcastUpdateLobby(game_token=game.uid,
                                       reason=reason.value)
-        game.send_packet_to_group(update, "lobby")
+        game.send_lobby_update(update)
 
         # add player to the lobby group
-        async_to_sync(
-            game.channel_layer.group_add)("lobby", channel_name)
+        game.group_add("lobby", channel_name)
 
         # because the player left, he has to get the status of all the rooms
-        self.send_all_lobby_status(channel_name=channel_name)
+        # (sent after LeaveRoomSucceed)
+        message = self.lobby.get_message()
+        if message is not None:
+            game.queue_outbound(OutboundType.SEND, channel_name, message)
+
+        # sent by the next tick of the game, in order with its other
+        # packets
+        game.wake()
+
+    def load_creator(self, player_token: str) -> Optional[User]:
+        """
+        Query the host of a new game (blocking: database pool thread), the
+        in-memory checks are done by create_game() on the event loop
+        :param player_token: Player token
+        :return: User, None if he can not create a game
+        """
+        # if player is already in a game of another shard
+        if get_player_game(player_token) is not None:
+            log.info("create_game(): player in another game")
+            return None
+
+        user = self.load_user(player_token)
+
+        if user is None:
+            log.warning("create_game(): user does not exists")
 
-    def create_game(self, packet: Packet, channel_name: str):
+        return user
+
+    def create_game(self, packet: Packet, channel_name: str, user: User):
         """
         creating a new game based on the CreateGame packet specification
-         sent by a host
+         sent by a host (event loop, user loaded by load_creator())
         :param packet: MUST BE CREATEGAME INSTANCE otherwise useless
+        :param channel_name: Lobby channel of the host
+        :param user: Host of the game
         """
-        print("[engine.create_game()] got in function")
+        log.debug("create_game()")
         if not isinstance(packet, CreateGame):
             return
 
         # if player is already in another game
         if self.player_exists(packet.player_token):
-            print("[engine.create_game()] player in another game")
+            log.info("create_game(): player in another game")
             return  # or maybe send error
 
-        try:  # get user from database
-            user = User.objects.get(id=packet.player_token)
-        except User.DoesNotExist:
-            print("[engine.create_game()] user does not exists")
-            return
+        # 0 => no limit, idle games are not costing anything
+        max_games = self.CONFIG.get('MAX_NUMBER_OF_GAMES', 0)
 
-        new_game = Game()
-        self.add_game(new_game)
-        if len(self.games) > getattr(settings, "MAX_NUMBER_OF_GAMES", 10):
-            print("[engine.create_game()] too many games")
-            self.send_packet(game_uid=new_game.uid,
-                             packet=ExceptionPacket(code=4206),
-                             channel_name=channel_name)
-            self.remove_game(new_game.uid)
+        if 0 < max_games <= len(self.games):
+            log.warning("create_game(): too many games")
+            packet = ExceptionPacket(code=4206)
+            self.send_to_channel(
+                channel_name,
+                PacketUtils.to_message('lobby.callback', packet))
             return
 
-        print("[engine.create_game()] created game instance")
-        print("[engine.create_game() game uid: " + new_game.uid)
-
+        # uid is generated so that game is owned by this shard
+        new_game = Game(uid=generate_game_uid(self.shard), clock=self.clock)
         board = new_game.board
 
         # adding host to the game
@@ -277,7 +573,7 @@ class Engine:
             if packet.username != "" and len(packet.username) < 32:
                 player.user.name = packet.username
 
-        board.add_player(player)
+        new_game.add_player(player)
 
         new_game.host_player = player
         board.set_nb_players(packet.max_nb_players)
@@ -289,9 +585,14 @@ class Engine:
         board.set_option_max_time(packet.option_max_time)
         board.set_option_max_rounds(packet.option_max_rounds)
         board.set_option_start_balance(packet.starting_balance)
+        piece = board.assign_piece(player.user)
+
+        # game is ticked and listed once configured
+        self.add_game(new_game)
+
+        log.info("create_game(): created game %s", new_game.uid)
 
         # sending CreateGameSuccess to host
-        piece = board.assign_piece(player.user)
         new_game.send_lobby_packet(channel_name=channel_name,
                                    packet=CreateGameSucceed(
                                        game_token=new_game.uid,
@@ -326,125 +627,84 @@ class Engine:
             ))
 
         # adding host to the game group
-        async_to_sync(new_game.channel_layer.group_discard)("lobby",
-                                                            channel_name)
-
-        async_to_sync(new_game.channel_layer.group_add)(group=new_game.uid,
-                                                        channel=channel_name)
+        new_game.group_discard("lobby", channel_name)
+        new_game.group_add(new_game.uid, channel_name)
 
         # this is sent to lobby no need to send it to game group, host is alone
-        update = BroadcastNewRoomToLobby(
-            game_token=new_game.uid,
-            game_name=new_game.public_name,
-            nb_players=len(board.players),
-            max_nb_players=board.players_nb,
-            is_private=board.option_is_private,
-            has_password=(board.option_password != ""))
+        update = BroadcastNewRoomToLobby(**new_game.get_lobby_room())
 
-        new_game.send_packet_to_group(update, "lobby")
+        new_game.send_lobby_update(update)
+
+        # sent by the next tick of the game, in order with its other
+        # packets
+        new_game.wake()
 
     def send_all_lobby_status(self, channel_name: str):
         """
-        send status of all the games that are in LOBBY state
+        send the rooms that are in LOBBY state, in one LobbySnapshot
+        (serialized once until a room changes)
         :param channel_name: player_token to send the status to
         """
-        print("game length: %d" % len(self.games))
-        for game in self.games:
-            game_c = self.games[game]
-            board = game_c.board
-            print("Processing state %d for %s" % (
-                game_c.state.value, game_c.public_name))
-            if game_c.state == GameState.LOBBY:
-                packet = BroadcastNewRoomToLobby(
-                    game_token=game,
-                    game_name=game_c.public_name,
-                    nb_players=len(board.players),
-                    max_nb_players=board.players_nb,
-                    is_private=board.option_is_private,
-                    has_password=(board.option_password != ""))
-                game_c.send_lobby_packet(channel_name=channel_name,
-                                         packet=packet)
-
-    def send_friend_notification(self, channel_name: str, player_token: str):
-        # fetch les amis du joueur dans la base de données
-        # regarder si les joueurs sont connecté à un websocket
-        # leur envoyer à eux un paquet FriendConnected
-        # envoyer au channel un paquet FriendConnected par ami connecté
-
-        # getting friends from database
-        try:
-            friends = UserFriend.objects.filter(user_id=player_token)
-        except UserFriend.DoesNotExist:
+        message = self.lobby.get_message()
+
+        if message is None:
             return
 
-        for friend in friends:
-            friend_token = friend.id
-            # if friend is connected
-            if friend_token in self.connected_players:
-                # sending to player that his friend is connected
-                packet = FriendConnected(friend_token=friend_token,
-                                         username=friend.name,
-                                         avatar_url=friend.avatar
-                                         )
-
-                async_to_sync(self.channel_layer.send)(
-                    channel_name, {
-                        'type': 'lobby.callback',
-                        'packet': packet.serialize()
-                    })
-
-                # sending to friend that the player is connected
-                packet = FriendConnected(friend_token=player_token,
-                                         username=get_player_username(
-                                             player_token),
-                                         avatar_url=get_player_avatar(
-                                             player_token)
-                                         )
-                async_to_sync(self.channel_layer.send)(
-                    self.connected_players[friend_token], {
-                        'type': 'lobby.callback',
-                        'packet': packet.serialize()
-                    })
+        self.send_to_channel(channel_name, message)
 
-    def disconnect_player(self, player_token: str, channel_name: str):
+    async def send_presence(self, player_token: str, channel_name: str,
+                            online: bool):
+        """
+        Notify the connected friends of a player (and the player) that he
+        connected to (or left) the lobby, from the event loop: friends are
+        loaded by the database pool on connection (and on disconnection when
+        not cached), every message is sent in one batch
+        :param player_token: Player connecting or leaving
+        :param channel_name: Lobby channel of the player
+        :param online: Player connects or leaves the lobby
+        """
+        # Lobby connections are sent to every shard, only one notifies
+        if self.shard != FRIENDS_SHARD:
+            return
 
-        try:
-            friends = UserFriend.objects.filter(user_id=player_token)
-        except UserFriend.DoesNotExist:
+        # Friends and users are written by the external API, the signals
+        # (signals.py) do not see these writes: the presence of a
+        # connecting player is always loaded again, the cache only serves
+        # his disconnection
+        presence = None if online else get_cached_presence(player_token)
+
+        if presence is None:
+            presence = await self.database.run(load_presence, player_token)
+
+        outbound = get_presence_messages(
+            player_token=player_token, channel_name=channel_name,
+            presence=presence, connected=self.connected_players,
+            online=online)
+
+        if len(outbound) == 0:
             return
 
-        for friend in friends:
-            friend_token = friend.friend_id
-            # if friend is connected
-            if friend_token in self.connected_players:
-                # sending to friends that the player is gonna disconnect
-
-                packet = FriendDisconnected(friend_token=player_token,
-                                            username=get_player_username(
-                                             player_token),
-                                            avatar_url=get_player_avatar(
-                                             player_token)
-                                            )
-
-                async_to_sync(self.channel_layer.send)(
-                    self.connected_players[friend_token], {
-                        'type': 'lobby.callback',
-                        'packet': packet.serialize()
-                    })
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            self.channel_layer.send(destination, message)
+            for _, destination, message in outbound))
+        self.metrics.observe_channel('presence', time.perf_counter() - start)
+        self.metrics.count_packets_sent(
+            message for _, _, message in outbound)
 
+    def disconnect_player(self, player_token: str, channel_name: str):
+        """
+        Player left the lobby (friends are notified by send_presence())
+        """
         # find out if the player is in a game and which one
-        in_game = False
-        game_token = ""
-        for game in self.games:
-            if self.games[game].board.player_exists(player_token):
-                game_token = game
-                in_game = True
-                break
+        game = self.get_player_game(player_token)
 
-        if not in_game:
+        if game is None:
             # this has been handled in the lobby consumer, should not happen
             return
 
+        game_token = game.uid
+
         self.leave_game(LeaveRoom(player_token=player_token,
                                   game_token=game_token),
                         game_token=game_token,
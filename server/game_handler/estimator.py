@@ -0,0 +1,403 @@
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+from server.game_handler.data import Board
+from server.game_handler.data.cards import Card, CardActionType
+from server.game_handler.data.squares import OwnableSquare, PropertySquare, \
+    CompanySquare, GoSquare, GoToJailSquare, TaxSquare, FreeParkingSquare, \
+    ChanceSquare, CommunitySquare
+
+# Square kinds
+OTHER = 0
+GO_TO_JAIL = 1
+TAX = 2
+FREE_PARKING = 3
+OWNABLE = 4
+CHANCE = 5
+COMMUNITY = 6
+
+
+@dataclass
+class Estimate:
+    # player id => probability to have the highest score at the horizon
+    win_probabilities: Dict[str, float]
+    # player id => probability to be bankrupt at the horizon
+    bankruptcy_risks: Dict[str, float]
+    # square id => mean rent paid to the owner of the square
+    rent_incomes: Dict[int, float]
+    samples: int
+    # Rounds simulated (less than requested if the budget expired)
+    rounds: float
+
+
+class Deck:
+    """
+    Available cards of a deck as arrays (action type, value, alt)
+    """
+
+    def __init__(self, cards: List[Card]):
+        cards = [card for card in cards if card.available]
+        self.size = len(cards)
+        self.actions = np.array([card.action_type.value for card in cards],
+                                dtype=np.int64)
+        self.values = np.array([card.action_value for card in cards],
+                               dtype=np.int64)
+        self.alts = np.array([card.alt for card in cards], dtype=np.int64)
+
+
+class Simulation:
+    """
+    Simulates samples games in parallel from the current state of a board:
+    every array has one row per sample, a step plays the turn of the
+    current player of every sample.
+
+    Dices, jail, doubles, taxes, free parking, cards and rents follow the
+    game rules. Squares are never bought, built or mortgaged during the
+    simulation (ownership is the current one), and a player is bankrupt
+    when its debts exceed what mortgaging everything would give.
+    """
+
+    def __init__(self, board: Board, samples: int, seed: Optional[int]):
+        config = board.CONFIG
+        squares = board.squares
+        players = board.players
+        size = len(squares)
+        nb_players = len(players)
+
+        self.rng = np.random.default_rng(seed)
+        self.samples = samples
+        self.size = size
+        self.money_go = config.get('MONEY_GO')
+        self.max_jail_turns = config.get('MAX_JAIL_TURNS')
+        self.max_doubles = config.get('MAX_DOUBLES_JAIL')
+        self.jail_price = config.get('JAIL_LEAVE_PRICE')
+        self.prison = board.prison_square_index
+        self.go_double = board.option_go_case_double_money
+
+        # Static tables (per square, per player)
+        self.kinds = np.zeros(size, dtype=np.int64)
+        self.taxes = np.zeros(size, dtype=np.int64)
+        self.rents = np.zeros(size, dtype=np.int64)
+        self.company_multipliers = np.zeros(size, dtype=np.int64)
+        self.is_go = np.zeros(size, dtype=bool)
+        owners = np.full(size, -1, dtype=np.int64)
+        self.liquidation = np.zeros(nb_players, dtype=np.int64)
+        self.values = np.zeros(nb_players, dtype=np.int64)
+        self.houses = np.zeros(nb_players, dtype=np.int64)
+        self.hotels = np.zeros(nb_players, dtype=np.int64)
+
+        for i, square in enumerate(squares):
+            if isinstance(square, GoToJailSquare):
+                self.kinds[i] = GO_TO_JAIL
+            elif isinstance(square, TaxSquare):
+                self.kinds[i] = TAX
+                self.taxes[i] = square.tax_price
+            elif isinstance(square, FreeParkingSquare):
+                self.kinds[i] = FREE_PARKING
+            elif isinstance(square, ChanceSquare):
+                self.kinds[i] = CHANCE
+            elif isinstance(square, CommunitySquare):
+                self.kinds[i] = COMMUNITY
+            elif isinstance(square, GoSquare):
+                self.is_go[i] = True
+            elif isinstance(square, OwnableSquare):
+                self.kinds[i] = OWNABLE
+                self.add_ownable(board, i, square, owners)
+
+        for i, player in enumerate(players):
+            self.values[i] = board.get_score(player) - player.money \
+                + player.get_total_debts()
+            self.houses[i], self.hotels[i] = \
+                board.get_player_buildings_count(player)
+
+        self.next_station = np.array(board.topology.next_station,
+                                     dtype=np.int64)
+        self.next_company = np.array(board.topology.next_company,
+                                     dtype=np.int64)
+        self.chance = Deck(board.chance_deck)
+        self.community = Deck(board.community_deck)
+
+        # Dynamic state (one row per sample)
+        self.money = np.tile(np.array(
+            [p.money - p.get_total_debts() for p in players],
+            dtype=np.int64), (samples, 1))
+        self.positions = np.tile(np.array(
+            [p.position for p in players], dtype=np.int64), (samples, 1))
+        self.in_jail = np.tile(np.array(
+            [p.in_jail for p in players], dtype=bool), (samples, 1))
+        self.jail_turns = np.tile(np.array(
+            [p.jail_turns for p in players], dtype=np.int64), (samples, 1))
+        self.bankrupt = np.tile(np.array(
+            [p.bankrupt for p in players], dtype=bool), (samples, 1))
+        self.owners = np.tile(owners, (samples, 1))
+        self.current = np.full(samples, board.current_player_index,
+                               dtype=np.int64)
+        self.doubles = np.zeros(samples, dtype=np.int64)
+        self.board_money = np.full(samples, board.board_money,
+                                   dtype=np.int64)
+        self.dices = np.zeros(samples, dtype=np.int64)
+        self.rent_incomes = np.zeros(size, dtype=np.float64)
+
+    def add_ownable(self, board: Board, i: int, square: OwnableSquare,
+                    owners):
+        if square.owner is None or square.owner.bankrupt:
+            return
+
+        owner = board.get_player_idx(square.owner)
+        owners[i] = owner
+
+        if square.mortgaged:
+            return
+
+        # Rents only change when an owner goes bankrupt (squares are freed)
+        if isinstance(square, CompanySquare):
+            self.company_multipliers[i] = board.get_rent(square, (1, 0))
+        else:
+            self.rents[i] = board.get_rent(square)
+
+        self.liquidation[owner] += square.buy_price // 2
+        if isinstance(square, PropertySquare):
+            self.liquidation[owner] += square.nb_house * square.house_price
+
+    def step(self):
+        """
+        Play the turn of the current player of every sample
+        """
+        rng = self.rng
+        samples = self.samples
+        rows = np.arange(samples)
+        current = self.current
+
+        first = rng.integers(1, 7, samples)
+        second = rng.integers(1, 7, samples)
+        double = first == second
+        self.dices = first + second
+
+        # Jail: a double or MAX_JAIL_TURNS frees the player (without moving)
+        jailed = self.in_jail[rows, current]
+        stay = jailed & ~double
+        self.jail_turns[rows[stay], current[stay]] += 1
+        pay = stay & (self.jail_turns[rows, current] >= self.max_jail_turns)
+        self.pay_bank(rows[pay], current[pay], self.jail_price)
+        leave = jailed & (double | pay)
+        self.in_jail[rows[leave], current[leave]] = False
+        self.jail_turns[rows[leave], current[leave]] = 0
+
+        # Doubles: plays again, MAX_DOUBLES_JAIL doubles => jail
+        free = ~jailed
+        self.doubles = np.where(free & double, self.doubles + 1, 0)
+        too_many = free & (self.doubles >= self.max_doubles)
+        self.enter_prison(rows[too_many], current[too_many])
+
+        moving = free & ~too_many
+        positions = self.positions[rows, current] + self.dices
+        passed = moving & (positions >= self.size)
+        positions %= self.size
+        self.pass_go(rows[passed], current[passed], positions[passed])
+        self.positions[rows[moving], current[moving]] = positions[moving]
+        self.land(rows[moving], current[moving], cards=True)
+
+        # Bankruptcy is checked at the end of the turn (like the game)
+        broke = ~self.bankrupt[rows, current] & (
+                self.money[rows, current] + self.liquidation[current] < 0)
+        self.bankrupt[rows[broke], current[broke]] = True
+        self.owners[(self.owners == current[:, None]) & broke[:, None]] = -1
+
+        replay = moving & double & ~self.in_jail[rows, current] & ~broke
+        self.doubles[~replay] = 0
+        self.current = np.where(replay, current, self.next_players())
+
+    def next_players(self):
+        """
+        :return: Next non-bankrupt player of every sample
+        """
+        nb_players = self.money.shape[1]
+        rows = np.arange(self.samples)[:, None]
+        candidates = (self.current[:, None]
+                      + np.arange(1, nb_players + 1)) % nb_players
+        alive = ~self.bankrupt[rows, candidates]
+        return candidates[rows[:, 0], np.argmax(alive, axis=1)]
+
+    def pay_bank(self, rows, players, amounts):
+        self.money[rows, players] -= amounts
+        self.board_money[rows] += amounts
+
+    def enter_prison(self, rows, players):
+        self.in_jail[rows, players] = True
+        self.jail_turns[rows, players] = 0
+        self.positions[rows, players] = self.prison
+        self.doubles[rows] = 0
+
+    def pass_go(self, rows, players, destinations):
+        amounts = np.where(self.go_double & self.is_go[destinations],
+                           2 * self.money_go, self.money_go)
+        self.money[rows, players] += amounts
+
+    def land(self, rows, players, cards: bool):
+        """
+        Actions of the destination square (rows are distinct samples)
+
+        :param cards: Draw cards (False after a card move)
+        """
+        positions = self.positions[rows, players]
+        kinds = self.kinds[positions]
+
+        jail = kinds == GO_TO_JAIL
+        self.enter_prison(rows[jail], players[jail])
+
+        tax = kinds == TAX
+        self.pay_bank(rows[tax], players[tax], self.taxes[positions[tax]])
+
+        park = kinds == FREE_PARKING
+        self.money[rows[park], players[park]] += self.board_money[rows[park]]
+        self.board_money[rows[park]] = 0
+
+        ownable = kinds == OWNABLE
+        r, p, s = rows[ownable], players[ownable], positions[ownable]
+        owners = self.owners[r, s]
+        paying = (owners >= 0) & (owners != p)
+        r, p, s, owners = r[paying], p[paying], s[paying], owners[paying]
+        rents = self.rents[s] + self.company_multipliers[s] * self.dices[r]
+        self.money[r, p] -= rents
+        self.money[r, owners] += rents
+        self.rent_incomes += np.bincount(s, weights=rents,
+                                         minlength=self.size)
+
+        if not cards:
+            return
+
+        for kind, deck in ((CHANCE, self.chance),
+                           (COMMUNITY, self.community)):
+            drawing = (kinds == kind) & (deck.size > 0)
+            if drawing.any():
+                self.draw(rows[drawing], players[drawing], deck)
+
+    def draw(self, rows, players, deck: Deck):
+        drawn = self.rng.integers(0, deck.size, len(rows))
+        actions = deck.actions[drawn]
+        values = deck.values[drawn]
+        positions = self.positions[rows, players]
+        destinations = np.full(len(rows), -1, dtype=np.int64)
+
+        def of(action: CardActionType):
+            return actions == action.value
+
+        receive = of(CardActionType.RECEIVE_BANK)
+        self.money[rows[receive], players[receive]] += values[receive]
+
+        give = of(CardActionType.GIVE_BOARD)
+        self.pay_bank(rows[give], players[give], values[give])
+
+        houses = of(CardActionType.GIVE_BOARD_HOUSES)
+        self.pay_bank(rows[houses], players[houses],
+                      self.houses[players[houses]] * values[houses]
+                      + self.hotels[players[houses]]
+                      * deck.alts[drawn[houses]])
+
+        jail = of(CardActionType.GOTO_JAIL)
+        self.enter_prison(rows[jail], players[jail])
+
+        # Money given to (received from) every other non-bankrupt player
+        for action, sign in ((CardActionType.GIVE_ALL, 1),
+                             (CardActionType.RECEIVE_ALL, -1)):
+            mask = of(action)
+            r, p = rows[mask], players[mask]
+            others = ~self.bankrupt[r]
+            others[np.arange(len(r)), p] = False
+            amounts = sign * values[mask]
+            self.money[r] += others * amounts[:, None]
+            self.money[r, p] -= others.sum(axis=1) * amounts
+
+        backward = of(CardActionType.MOVE_BACKWARD)
+        destinations[backward] = (positions[backward]
+                                  - values[backward]) % self.size
+
+        forward = of(CardActionType.GOTO_POSITION)
+        destinations[forward] = values[forward]
+
+        station = of(CardActionType.CLOSEST_STATION)
+        destinations[station] = self.next_station[positions[station]]
+
+        company = of(CardActionType.CLOSEST_COMPANY)
+        destinations[company] = self.next_company[positions[company]]
+
+        moved = destinations >= 0
+        passed = moved & ~backward & (destinations < positions)
+        self.pass_go(rows[passed], players[passed], destinations[passed])
+        self.positions[rows[moved], players[moved]] = destinations[moved]
+        self.land(rows[moved], players[moved], cards=False)
+
+    def get_scores(self):
+        """
+        :return: Score of every player (Board.get_score()), -inf if bankrupt
+        """
+        scores = (self.money + self.values).astype(np.float64)
+        scores[self.bankrupt] = -np.inf
+        return scores
+
+
+def estimate(board: Board, samples: int = None, rounds: int = None,
+             budget: float = None, seed: int = None) -> Optional[Estimate]:
+    """
+    Monte-Carlo estimation of the outcome of a game, all samples are
+    simulated at once with numpy arrays
+
+    :param board: Board of the game (not modified)
+    :param samples: Simulated games (default ESTIMATOR_SAMPLES)
+    :param rounds: Rounds simulated (default: remaining rounds if the game
+                   has a max rounds, else ESTIMATOR_ROUNDS)
+    :param budget: Max duration in seconds (default: one tick)
+    :param seed: Seed of the dices
+    :return: Estimate, None if numpy is not installed
+    """
+    if np is None:
+        return None
+
+    config = board.CONFIG
+    samples = samples or config.get('ESTIMATOR_SAMPLES', 1000)
+
+    if rounds is None:
+        if board.option_max_rounds > 0:
+            rounds = max(board.option_max_rounds - board.current_round, 0)
+        else:
+            rounds = config.get('ESTIMATOR_ROUNDS', 20)
+
+    if budget is None:
+        budget = 1.0 / config.get('TICK_RATE')
+
+    deadline = time.perf_counter() + budget
+    simulation = Simulation(board, samples, seed)
+    players = board.players
+    nb_alive = max(len(board.get_non_bankrupt_players()), 1)
+    steps = 0
+
+    while steps < rounds * nb_alive and time.perf_counter() < deadline:
+        simulation.step()
+        steps += 1
+
+    winners = np.argmax(simulation.get_scores(), axis=1)
+    wins = np.bincount(winners, minlength=len(players)) / samples
+    risks = simulation.bankrupt.mean(axis=0)
+    incomes = simulation.rent_incomes / samples
+
+    return Estimate(
+        win_probabilities={
+            player.get_id(): float(wins[i]) for i, player in enumerate(players)
+        },
+        bankruptcy_risks={
+            player.get_id(): float(risks[i])
+            for i, player in enumerate(players)
+        },
+        rent_incomes={
+            board.squares[i].id_: float(incomes[i])
+            for i in board.topology.ownable_indexes
+        },
+        samples=samples,
+        rounds=steps / nb_alive
+    )
@@ -1,25 +1,28 @@
+import logging
 import math
-import random
+import time
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-import time
 import uuid
+from concurrent.futures import Future
 from enum import Enum
-from threading import Thread
-from queue import Queue
-from typing import Optional
+from threading import Lock
+from typing import Optional, List, Tuple, Callable, Dict, Any
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-import pause
 
 from server.game_handler import models
+from server.game_handler.bots import BotEngine, Decision
+from server.game_handler.clock import Clock
 from server.game_handler.data import Board, Player, Card
+from server.game_handler.database import DatabasePool
 from server.game_handler.data.auction import Auction
 from server.game_handler.data.cards import ChanceCard, CardActionType, \
     CommunityCard
 from server.game_handler.data.exchange import Exchange, ExchangeState
 from server.game_handler.data.packets import PlayerPacket, Packet, \
+    InternalPacket, \
     InternalCheckPlayerValidity, GameStart, ExceptionPacket, AppletReady, \
     GameStartDice, GameStartDiceThrow, GameStartDiceResults, RoundStart, \
     PingPacket, PlayerDisconnect, InternalPlayerDisconnect, RoundDiceChoice, \
@@ -38,14 +41,20 @@ from server.game_handler.data.packets import PlayerPacket, Packet, \
     ExchangeTradeSelectType, ActionExchangeTransfer, ExchangeTransferType, \
     ActionExchangeCancel, ActionAuctionProperty, AuctionBid, AuctionEnd, \
     ActionStart, PlayerDefeat, ChatPacket, PlayerReconnect, DeleteBot, \
-    GameWin, GameEnd, AddBotSucceed, DeleteBotSucceed, PlayerUpdateProperty
+    GameWin, GameEnd, AddBotSucceed, DeleteBotSucceed, PlayerUpdateProperty, \
+    BroadcastLobbyChanges, PacketUtils
 
+from server.game_handler.lobby import LobbyIndex
+from server.game_handler.logs import Lazy
+from server.game_handler.metrics import Metrics
 from server.game_handler.models import User
 from django.conf import settings
 from server.game_handler.data.squares import GoSquare, TaxSquare, \
     FreeParkingSquare, OwnableSquare, ChanceSquare, CommunitySquare, \
     GoToJailSquare, PropertySquare
 
+log = logging.getLogger(__name__)
+
 
 class GameState(Enum):
     # To stop thread
@@ -92,17 +101,119 @@ class GameState(Enum):
     GAME_END_TIMEOUT = 12
 
 
+# States where process_logic() waits for game.timeout to expire
+TIMEOUT_STATES = {
+    GameState.WAITING_PLAYERS,
+    GameState.STARTING,
+    GameState.START_DICE,
+    GameState.START_DICE_REROLL,
+    GameState.FIRST_ROUND_START_WAIT,
+    GameState.ROUND_START_WAIT,
+    GameState.ROUND_DICE_CHOICE_WAIT,
+    GameState.ACTION_START_WAIT,
+    GameState.ACTION_TIMEOUT_WAIT,
+    GameState.GAME_WIN_TIMEOUT,
+    GameState.GAME_END_TIMEOUT
+}
+
+
 @dataclass
 class QueuePacket:
     packet: Packet
     channel_name: str
+    # EnterRoom: user loaded by the engine (database pool), the tick does
+    # not wait for the database
+    user: Optional[User] = None
+    # produced by the server (bots decisions), never dropped
+    internal: bool = False
+
+
+# Only the last pending packet of a player is kept (at the place of the
+# first one) for these packets
+COALESCED_PACKETS = (PingPacket, AuctionBid)
+
+
+class PacketsQueue:
+    """
+    Bounded inbound queue of a game, filled by the engine (consumer) and by
+    the bots, drained by the tick.
+
+    When the queue is full, packets are dropped (internal packets and
+    packets of the bots are always accepted): memory and tick duration stay
+    bounded whatever the clients send.
+    """
+    packets: List[QueuePacket]
+    # (packet name, player token) => index of the pending packet
+    pending: Dict[Tuple[str, str], int]
+
+    def __init__(self, size: int):
+        """
+        :param size: Max number of pending packets
+        """
+        self.size = size
+        self.lock = Lock()
+        self.packets = []
+        self.pending = {}
 
+    def put(self, queue_packet: QueuePacket) -> bool:
+        """
+        :param queue_packet: Packet received
+        :return: False if the packet was dropped (queue full)
+        """
+        packet = queue_packet.packet
+        key = None
+
+        if isinstance(packet, COALESCED_PACKETS):
+            key = (packet.name, packet.player_token)
+
+        with self.lock:
+            index = self.pending.get(key)
+
+            if index is not None:
+                self.packets[index] = queue_packet
+                return True
+
+            if len(self.packets) >= self.size and \
+                    not queue_packet.internal and \
+                    not isinstance(packet, InternalPacket):
+                return False
+
+            if key is not None:
+                self.pending[key] = len(self.packets)
+            self.packets.append(queue_packet)
+
+        return True
+
+    def drain(self) -> List[QueuePacket]:
+        """
+        :return: Pending packets, in order (queue is emptied)
+        """
+        with self.lock:
+            packets = self.packets
+            self.packets = []
+            self.pending = {}
 
-class Game(Thread):
+        return packets
+
+    def qsize(self) -> int:
+        return len(self.packets)
+
+    def empty(self) -> bool:
+        return len(self.packets) == 0
+
+
+class OutboundType(Enum):
+    SEND = 0
+    GROUP_SEND = 1
+    GROUP_ADD = 2
+    GROUP_DISCARD = 3
+
+
+class Game:
     uid: str
     state: GameState
     board: Board
-    packets_queue: Queue
+    packets_queue: PacketsQueue
     timeout: datetime
     start_date: datetime
 
@@ -110,61 +221,109 @@ class Game(Thread):
     CONFIG: {}
     # reference to games dict
     games: {}
+    # reference to engine player index (player token => game uid)
+    player_games: {}
     host_player: Player
 
     offline: bool
-
-    def __init__(self, **kwargs):
-        self.uid = str(uuid.uuid4())
-        super().__init__(daemon=True, name="Game_%s" % self.uid, **kwargs)
+    # shared with the engine (see Engine.add_game)
+    metrics: Metrics
+    # rooms sent to the lobby clients, shared with the engine
+    lobby: LobbyIndex
+    # None => bots only wait for timeouts
+    bots: Optional[BotEngine]
+    # player token => (context of the request, future packets)
+    bot_decisions: Dict[str, Tuple[Tuple, Future]]
+    # incremented by start_round() (bot decisions of a previous tour
+    # are dropped)
+    turn_counter: int
+    # set by Engine.add_game: ticks the game as soon as possible
+    wake: Callable[[], None]
+    # set by Engine.add_game: publishes the number of games of the shard
+    publish_load: Callable[[], None]
+    # set by Engine.add_game: publishes the game of a real player to the
+    # other shards (token, game uid, joined)
+    publish_player: Callable[[str, str, bool], None]
+    # restored game (see snapshots.py): stopped at this date if no player
+    # reconnected
+    reconnect_timeout: Optional[datetime]
+    # dates of the game (ManualClock to replay a journal)
+    clock: Clock
+    # set by Engine.add_game (see journal.py), None => not recorded
+    journal: Optional[Any]
+    # set by Engine.start_async(): ticks are executed in the event loop,
+    # None => database is used directly by the tick
+    database: Optional[DatabasePool]
+
+    # (type, channel or group name, message or channel name)
+    outbound: List[Tuple[OutboundType, str, object]]
+
+    def __init__(self, uid: str = None, clock: Clock = None):
+        self.uid = str(uuid.uuid4()) if uid is None else uid
+        self.clock = Clock() if clock is None else clock
         self.channel_layer = get_channel_layer()
         self.state = GameState.OFFLINE
-        self.packets_queue = Queue()
         self.CONFIG = getattr(settings, "ENGINE_CONFIG", None)
+        self.packets_queue = PacketsQueue(
+            size=self.CONFIG.get('PACKETS_QUEUE_SIZE'))
         self.tick_duration = 1.0 / self.CONFIG.get('TICK_RATE')
         self.board = Board()
-        self.timeout = datetime.now()
+        self.public_name = ""
+        self.timeout = self.clock.now()
         self.offline = getattr(settings, "SERVER_OFFLINE", True)
-
-    def run(self) -> None:
-        # Starting game thread
+        self.player_games = {}
+        self.outbound = []
+        # outbound is filled by scheduler and engine (consumer) threads
+        self.outbound_lock = Lock()
+        # keeps flushes in order
+        self.flush_lock = Lock()
+        self.metrics = Metrics()
+        self.lobby = LobbyIndex()
+        self.bots = None
+        self.bot_decisions = {}
+        self.turn_counter = 0
+        self.wake = lambda: None
+        self.publish_load = lambda: None
+        self.publish_player = lambda token, uid, joined: None
+        self.reconnect_timeout = None
+        self.journal = None
+        self.database = None
+        # every record has a game field
+        self.log = logging.LoggerAdapter(log, {'game': self.uid})
+
+    def start(self):
+        """
+        Starting game (lobby mode)
+        Ticks are then executed by the engine's GameScheduler
+        """
         self.state = GameState.LOBBY
         # Set start date
-        self.start_date = datetime.now()
-
-        # while state is not stop thread
-        while self.state is not GameState.STOP_THREAD:
-            # get unix time in seconds before tick processing
-            start = time.time()
-
-            # process game tick
-            self.tick()
-
-            # sleep until(start + tick_duration)
-            # To reduce tick loss if tick processing is too long
-            pause.until(start + self.tick_duration)
-
-        # execute last func before stop
-        self.proceed_stop()
+        self.start_date = self.clock.now()
 
     def tick(self):
         """
-        Main function: every tick, this function will be executed
+        Main function: executed by the scheduler when a packet is received
+        or when next_deadline() has expired
         """
-
-        # Blocking queue
-        # self.packets_queue.join()
-
-        # Store all packets in temp array
-        # If packet processing is taking too much time,
-        # The queue will be locked for a too long period
-        packets = []
-
-        while not self.packets_queue.empty():
-            packets.append(self.packets_queue.get(block=False))
-
-        # Unblock
-        # self.packets_queue.task_done()
+        # Every date of the tick is the same (replayed ticks are identical)
+        self.clock.freeze()
+
+        try:
+            self.process_tick()
+        finally:
+            self.clock.unfreeze()
+
+    def process_tick(self):
+        start = time.perf_counter()
+        # Packets of the bots are processed like players packets
+        self.collect_bot_decisions()
+        # Packets are taken at once: the queue is only locked by the swap
+        packets = self.packets_queue.drain()
+        queue_depth = len(packets)
+
+        # Packets are recorded before being processed (replay)
+        if self.journal is not None:
+            self.journal.record_tick(self, packets)
 
         # Process all packets in queue
         for packet in packets:
@@ -173,9 +332,14 @@ class Game(Thread):
         # Do logic here
         self.process_logic()
 
+        duration = time.perf_counter() - start
+        self.metrics.observe_tick(self.uid, duration, queue_depth,
+                                  overrun=duration > self.tick_duration)
+
     def process_packet(self, queue_packet: QueuePacket):
         packet: Packet = queue_packet.packet
-        print("process_packet(%s)" % packet.serialize())
+        self.log.debug("process_packet(%s)", Lazy(packet.serialize))
+        self.metrics.count_packet_processed(packet.name)
 
         # check player validity
         if isinstance(packet, InternalCheckPlayerValidity):
@@ -199,7 +363,7 @@ class Game(Thread):
             if not valid:
                 return
 
-            print("Player %s is VALID" % player.get_name())
+            self.log.info("Player %s is VALID", player.get_name())
 
             # Change channel_name
             player.channel_name = queue_packet.channel_name
@@ -208,9 +372,10 @@ class Game(Thread):
         # Before Player validity check
         if self.state is GameState.LOBBY and isinstance(packet, EnterRoom):
 
-            try:  # get user from database
-                user = User.objects.get(id=packet.player_token)
-            except User.DoesNotExist:
+            user = queue_packet.user
+
+            # Unknown user (see Engine.load_user)
+            if user is None:
                 return
 
             if packet.password != "":
@@ -235,10 +400,10 @@ class Game(Thread):
                 if packet.username != "" and len(packet.username) < 32:
                     p.user.name = packet.username
 
-            self.board.add_player(p)
+            self.add_player(p)
 
             # player leaves lobby group
-            async_to_sync(self.channel_layer.group_discard)(
+            self.group_discard(
                 "lobby", queue_packet.channel_name
             )
 
@@ -271,7 +436,7 @@ class Game(Thread):
             self.send_packet_to_group(update, self.uid)
 
             # add player to this specific game group
-            async_to_sync(self.channel_layer.group_add)(
+            self.group_add(
                 self.uid, queue_packet.channel_name
             )
 
@@ -310,7 +475,7 @@ class Game(Thread):
             update = BroadcastUpdateLobby(game_token=self.uid,
                                           reason=reason)
             # sending to the lobby people
-            self.send_packet_to_group(update, "lobby")
+            self.send_lobby_update(update)
             return
 
         if isinstance(packet, PlayerPacket):
@@ -328,14 +493,7 @@ class Game(Thread):
                 if queue_packet.channel_name != self.host_player.channel_name:
                     return
 
-                if self.public_name != packet.game_name:
-                    # send update to list of lobbies
-                    self.send_packet_to_group(packet=BroadcastUpdateLobby(
-                        game_token=self.uid,
-                        reason=UpdateReason.NEW_GAME_NAME.value,
-                        value=packet.game_name
-                    ),
-                        group_name="lobby")
+                renamed = self.public_name != packet.game_name
 
                 self.board.set_nb_players(packet.max_nb_players)
                 self.public_name = packet.game_name
@@ -348,6 +506,17 @@ class Game(Thread):
                 self.board.set_option_max_rounds(packet.option_max_rounds)
                 self.board.set_option_start_balance(packet.starting_balance)
 
+                if renamed:
+                    # send update to list of lobbies
+                    self.send_lobby_update(BroadcastUpdateLobby(
+                        game_token=self.uid,
+                        reason=UpdateReason.NEW_GAME_NAME.value,
+                        value=packet.game_name
+                    ))
+                else:
+                    # max players, private or password changed
+                    self.send_lobby_room()
+
                 double_on_start = self.board.option_go_case_double_money
                 first_round_buy = self.board.option_first_round_buy
 
@@ -380,7 +549,7 @@ class Game(Thread):
                 return
 
             if isinstance(packet, LaunchGame):
-                print("received LaunchGame")
+                self.log.info("received LaunchGame")
                 player = self.board.get_player(packet.player_token)
                 # check if player_token is the token of the game host
                 if player != self.host_player:
@@ -390,7 +559,7 @@ class Game(Thread):
                 if len(self.board.players) <= 1:
                     return
 
-                print("Set state to GameState.WAITING_PLAYERS")
+                self.log.debug("Set state to GameState.WAITING_PLAYERS")
                 # putting the game in waiting mode (waiting for AppletReady
                 # from all the players)
                 self.state = GameState.WAITING_PLAYERS
@@ -406,7 +575,7 @@ class Game(Thread):
 
                 update = BroadcastUpdateLobby(game_token=self.uid,
                                               reason=reason)
-                self.send_packet_to_group(update, "lobby")
+                self.send_lobby_update(update)
                 return
 
             elif isinstance(packet, AddBot):
@@ -429,7 +598,7 @@ class Game(Thread):
                 # add bot to the game
                 p = Player(bot=True, bot_name=self.board.get_random_bot_name(),
                            bot_level=packet.bot_difficulty)
-                self.board.add_player(p)
+                self.add_player(p)
 
                 # broadcast updated room status
                 nb_players = len(self.board.players)
@@ -448,7 +617,7 @@ class Game(Thread):
                 self.send_packet_to_group(update, self.uid)
                 update = BroadcastUpdateLobby(game_token=self.uid,
                                               reason=reason)
-                self.send_packet_to_group(update, "lobby")
+                self.send_lobby_update(update)
                 return
 
             elif isinstance(packet, DeleteBot):
@@ -463,7 +632,7 @@ class Game(Thread):
 
                 bot = self.board.get_player(token)
 
-                self.board.remove_player(player=bot)
+                self.remove_player(player=bot)
                 reason = UpdateReason.DELETE_BOT.value
 
                 self.send_packet_to_group(
@@ -483,7 +652,7 @@ class Game(Thread):
                 update = BroadcastUpdateLobby(game_token=self.uid,
                                               reason=reason)
 
-                self.send_packet_to_group(update, "lobby")
+                self.send_lobby_update(update)
 
                 return
 
@@ -496,40 +665,45 @@ class Game(Thread):
                 player.ping = True
                 return
 
-        if self.state is GameState.WAITING_PLAYERS:
-            # WebGL app is ready to play
-            if not isinstance(packet, AppletReady):
+        # AppletReady -> connect from client
+        # Could be first connect as reconnect
+        if isinstance(packet, AppletReady) and \
+                self.state.value >= GameState.WAITING_PLAYERS.value:
+            player = self.board.get_player(packet.player_token)
+
+            # Player already online (duplicate AppletReady)
+            if player.online:
                 return
 
-            # AppletReady -> connect from client
-            # Could be first connect as reconnect
-            if isinstance(packet, AppletReady):
-                player = self.board.get_player(packet.player_token)
+            self.log.info("Got AppletReady from %s",
+                          player.get_name())
 
-                print("Got AppletReady from %s" % player.get_name())
+            # Set player to connected (bot disabled)
+            player.connect()
 
-                # Set player to connected (bot disabled)
-                player.connect()
+            # init ping heartbeat
+            player.ping = True
+            player.ping_timeout = self.clock.now() + timedelta(
+                seconds=self.CONFIG.get('PING_HEARTBEAT_TIMEOUT'))
 
-                # init ping heartbeat
-                player.ping = True
-                player.ping_timeout = datetime.now() + timedelta(
-                    seconds=self.CONFIG.get('PING_HEARTBEAT_TIMEOUT'))
+            # Add player to game group
+            self.group_add(
+                self.uid, player.channel_name
+            )
 
-                # Add player to game group
-                async_to_sync(self.channel_layer.group_add)(
-                    self.uid, player.channel_name
-                )
+            # Waiting_players => first connection => not sending anything
+            if self.state is not GameState.WAITING_PLAYERS:
+                self.broadcast_packet(PlayerReconnect(
+                    player_token=player.get_id()
+                ))
+                # TODO: RECONNECT => Send global state to player
+                return
 
-                # Waiting_players => first connection => not sending anything
-                if self.state is not GameState.WAITING_PLAYERS:
-                    self.broadcast_packet(PlayerReconnect(
-                        player_token=player.get_id()
-                    ))
-                    # TODO: RECONNECT => Send global state to player
-                    return
+            return
 
-                return
+        # WebGL app is ready to play
+        if self.state is GameState.WAITING_PLAYERS:
+            return
 
         if isinstance(packet, InternalPlayerDisconnect):
             # Add player to game group
@@ -661,6 +835,17 @@ class Game(Thread):
         if self.state.value > GameState.LOBBY.value:
             self.proceed_heartbeat()
 
+        # Restored game: stopped if no player reconnected
+        if self.reconnect_timeout is not None and \
+                self.reconnect_timeout <= self.clock.now():
+            self.reconnect_timeout = None
+
+            if self.board.get_online_real_players_count() == 0:
+                self.log.info("Stopping restored game, no player "
+                              "reconnected")
+                self.state = GameState.STOP_THREAD
+                return
+
         # State is waiting that players connecting and send AppletReady
         if self.state is GameState.WAITING_PLAYERS:
             if self.board.get_online_players_count() == len(
@@ -671,7 +856,8 @@ class Game(Thread):
                 if self.board.get_online_real_players_count() == 0:
                     # After timeout, if no one is connected
                     # Stop game
-                    print("Stopping game after timeout with no players online")
+                    self.log.info("Stopping game after timeout with no "
+                                  "players online")
                     self.state = GameState.STOP_THREAD
                     return
                 else:
@@ -715,6 +901,8 @@ class Game(Thread):
                 self.state = GameState.ACTION_TIMEOUT_WAIT
                 self.set_timeout(seconds=self.board.option_max_time)
                 self.broadcast_packet(ActionStart())
+                self.request_bot_decision(Decision.TOUR_ACTIONS,
+                                          self.board.get_current_player())
 
             elif self.state is GameState.ACTION_TIMEOUT_WAIT:
                 # Tour is ended
@@ -729,23 +917,173 @@ class Game(Thread):
     def proceed_stop(self):
         # Delete game
         self.state = GameState.STOP_THREAD
+        self.metrics.remove_game(self.uid)
+        self.lobby.set_room(self.uid, None)
+        self.unindex_players()
+
+        if self.journal is not None:
+            self.journal.close()
 
         if self.uid not in self.games:
             return
 
         del self.games[self.uid]
+        self.publish_load()
+
+    def add_player(self, player: Player):
+        """
+        Add a player to the board and to the engine player index
+        """
+        self.board.add_player(player)
+        self.player_games[player.get_id()] = self.uid
+
+        if not player.bot:
+            self.publish_player(player.get_id(), self.uid, True)
+
+    def remove_player(self, player: Player):
+        """
+        Remove a player from the board and from the engine player index
+        """
+        self.board.remove_player(player)
+        uid = player.get_id()
+
+        if self.player_games.get(uid) == self.uid:
+            del self.player_games[uid]
+
+        if not player.bot:
+            self.publish_player(uid, self.uid, False)
+
+    def index_players(self):
+        """
+        Add every player of the board to the engine player index
+        """
+        for player in self.board.players:
+            self.player_games[player.get_id()] = self.uid
+
+            if not player.bot:
+                self.publish_player(player.get_id(), self.uid, True)
+
+    def unindex_players(self):
+        """
+        Remove every player of the board from the engine player index
+        """
+        for player in self.board.players:
+            uid = player.get_id()
+            if self.player_games.get(uid) != self.uid:
+                continue
+
+            del self.player_games[uid]
+
+            if not player.bot:
+                self.publish_player(uid, self.uid, False)
+
+    def get_bot_context(self) -> Tuple:
+        """
+        :return: Game state on which bot decisions are based, a decision
+                 is dropped if the context changed before its packets are
+                 processed
+        """
+        exchange = self.board.current_exchange
+
+        return (self.state, self.turn_counter, id(exchange),
+                None if exchange is None else exchange.state)
+
+    def request_bot_decision(self, decision: Decision, player: Player):
+        """
+        Ask the bot engine for a decision of a bot (computed out of the
+        game thread when the engine has a pool)
+
+        :param decision: Decision to take
+        :param player: Bot (ignored if player is not a bot)
+        """
+        if self.bots is None or not player.bot or player.bankrupt:
+            return
+
+        token = player.get_id()
+        context = self.get_bot_context()
+        pending = self.bot_decisions.get(token)
+
+        # Same decision already requested
+        if pending is not None and pending[0] == context:
+            return
+
+        future = self.bots.submit(decision, player, self.board)
+        self.bot_decisions[token] = (context, future)
+        future.add_done_callback(lambda _: self.wake())
+
+    def request_bot_bids(self):
+        """
+        Ask every bot (except the highest bidder) if it bids on the
+        current auction
+        """
+        auction = self.board.current_auction
+
+        for player in self.board.get_non_bankrupt_players():
+            if player != auction.highest_bidder:
+                self.request_bot_decision(Decision.AUCTION_BID, player)
+
+    def collect_bot_decisions(self):
+        """
+        Queue packets of the finished bot decisions
+        """
+        context = self.get_bot_context()
+
+        for token, (request_context, future) in list(
+                self.bot_decisions.items()):
+            if not future.done():
+                continue
+
+            del self.bot_decisions[token]
+
+            if request_context != context:
+                continue
+
+            try:
+                packets = future.result()
+            except Exception:
+                self.log.exception("Bot decision of %s failed", token)
+                continue
+
+            # Never dropped: the turn of the bot would wait for the timeout
+            for packet in packets:
+                self.packets_queue.put(QueuePacket(packet=packet,
+                                                   channel_name="",
+                                                   internal=True))
+
+    def next_deadline(self) -> Optional[datetime]:
+        """
+        :return: Next date where process_logic() has something to do,
+                 None if the game is only waiting for packets
+        """
+        deadlines = []
+
+        if self.state is GameState.ACTION_AUCTION:
+            if self.board.current_auction is not None:
+                deadlines.append(self.board.current_auction.timeout)
+        elif self.state in TIMEOUT_STATES:
+            deadlines.append(self.timeout)
+
+        # Heartbeat
+        if self.state.value > GameState.LOBBY.value:
+            for player in self.board.get_online_real_players():
+                deadlines.append(player.ping_timeout)
+
+        if self.reconnect_timeout is not None:
+            deadlines.append(self.reconnect_timeout)
+
+        return min(deadlines) if len(deadlines) > 0 else None
 
     def set_timeout(self, seconds: int):
-        self.timeout = datetime.now() + timedelta(seconds=seconds)
+        self.timeout = self.clock.now() + timedelta(seconds=seconds)
 
     def timeout_expired(self) -> bool:
-        return self.timeout < datetime.now()
+        return self.timeout <= self.clock.now()
 
     def get_remaining_timeout_seconds(self) -> float:
         """
         :return: Get remaining time in seconds before timeout occurs
         """
-        return (self.timeout - datetime.now()).total_seconds()
+        return (self.timeout - self.clock.now()).total_seconds()
 
     def start_game(self):
         """
@@ -800,9 +1138,9 @@ class Game(Thread):
 
         game = models.Game()
         game.name = self.public_name
-        game.duration = (datetime.now() - self.start_date).total_seconds()
+        game.duration = (self.clock.now() - self.start_date).total_seconds()
         game.date = self.start_date
-        game.save()
+        game_users = []
 
         sorted_players = []
 
@@ -832,9 +1170,12 @@ class Game(Thread):
             game_user.host = self.host_player == player
             game_user.bot = bot
             game_user.duration = play_duration
-            game_user.save()
+            game_users.append(game_user)
             rank += 1
 
+        # Results are computed by the tick, only saved later
+        self.save_database(save_game_results, game, game_users)
+
         self.state = GameState.GAME_END_TIMEOUT
         self.set_timeout(seconds=self.CONFIG.get('GAME_END_WAIT'))
 
@@ -852,7 +1193,7 @@ class Game(Thread):
         self.set_timeout(seconds=self.CONFIG.get('START_DICE_WAIT'))
 
         for player in self.board.get_online_players():
-            player.roll_dices()
+            player.roll_dices(self.board.random)
             # The bot should send a packet here (GameStartDiceThrow)
             if player.bot:
                 self.broadcast_packet(
@@ -917,20 +1258,20 @@ class Game(Thread):
 
         # Get current player
         current_player = self.board.get_current_player()
-        current_player.roll_dices()
+        current_player.roll_dices(self.board.random)
 
         # Accept new auction
         self.board.round_auction_done = False
+        self.turn_counter += 1
 
-        # TODO : AI should randomly do some actions
-        # Check if player is in prison -> random between :
-        # -> buy if he can or trie to dice
-        # maybe execute AI random timeouts.
+        # Bots actions are decided after ActionStart (see bots.py)
         round_dice_choice_wait = self.CONFIG.get('ROUND_DICE_CHOICE_WAIT')
 
-        # Bot only waits 5 to 15 seconds
+        # Bot only waits 5 to 15 seconds (by default)
         if current_player.bot:
-            round_dice_choice_wait = random.randint(5, 15)
+            round_dice_choice_wait = self.board.random.randint(
+                self.CONFIG.get('BOT_DICE_CHOICE_WAIT_MIN', 5),
+                self.CONFIG.get('BOT_DICE_CHOICE_WAIT_MAX', 15))
 
         can_buy = \
             self.board.option_first_round_buy or self.board.current_round != 0
@@ -970,7 +1311,7 @@ class Game(Thread):
         Proceed tour actions
         :param packet: Packet received
         """
-        print("proceed_tour_actions(%s)" % packet.serialize())
+        self.log.debug("proceed_tour_actions(%s)", Lazy(packet.serialize))
         # No buy before 2nd round
         if not self.board.option_first_round_buy and \
                 self.board.current_round == 0:
@@ -1232,7 +1573,8 @@ class Game(Thread):
             auction = Auction(player=player,
                               tour_duration=auction_tour_wait,
                               highest_bet=packet.min_bid,
-                              square=current_square)
+                              square=current_square,
+                              clock=self.clock)
 
             self.state = GameState.ACTION_AUCTION
 
@@ -1249,6 +1591,7 @@ class Game(Thread):
                 property_id=current_square.id_,
                 min_bid=auction.highest_bid
             ))
+            self.request_bot_bids()
             return
 
         if auction is None or self.state is not GameState.ACTION_AUCTION:
@@ -1264,6 +1607,7 @@ class Game(Thread):
                 player_token=player.get_id(),
                 bid=packet.bid
             ))
+            self.request_bot_bids()
 
     def proceed_auction_end(self):
         """
@@ -1326,7 +1670,7 @@ class Game(Thread):
             if self.board.get_current_player() != player:
                 return
 
-            self.board.current_exchange = Exchange(player)
+            self.board.current_exchange = Exchange(player, clock=self.clock)
 
             self.broadcast_packet(ActionExchange(
                 player_token=player.get_id()
@@ -1556,6 +1900,10 @@ class Game(Thread):
                 player_token=player.get_id(),
             ))
 
+            # Waiting response of the other player
+            responder = exchange.selected_player if exchange.state is \
+                ExchangeState.WAITING_RESPONSE else exchange.player
+            self.request_bot_decision(Decision.EXCHANGE_RESPONSE, responder)
             return
 
         # Next states are actions responses: accept, decline, counter
@@ -1668,7 +2016,7 @@ class Game(Thread):
         """
 
         for player in self.board.get_online_real_players():
-            if player.ping_timeout < datetime.now():
+            if player.ping_timeout <= self.clock.now():
                 if not player.ping:
                     self.disconnect_player(player, reason="ping_timeout")
                     continue
@@ -1676,7 +2024,7 @@ class Game(Thread):
                 player.ping = False
 
                 # Set timeout for heartbeat
-                player.ping_timeout = datetime.now() + timedelta(
+                player.ping_timeout = self.clock.now() + timedelta(
                     seconds=self.CONFIG.get('PING_HEARTBEAT_TIMEOUT'))
 
                 self.send_packet_to_player(player, PingPacket())
@@ -1711,7 +2059,7 @@ class Game(Thread):
         :param player: Player playing
         :param choice: Player's choice
         """
-        player.roll_dices()
+        player.roll_dices(self.board.random)
 
         # Broadcast roll_dices results
         self.broadcast_packet(RoundDiceResults(
@@ -1813,19 +2161,19 @@ class Game(Thread):
         :param player: Player moved
         """
 
-        print("move_player(%s) dices: (%d, %d) current_pos: %d" %
-              (player.get_name(),
-               player.current_dices[0],
-               player.current_dices[1],
-               player.position))
+        self.log.debug("move_player(%s) dices: (%d, %d) current_pos: %d",
+                       Lazy(player.get_name),
+                       player.current_dices[0],
+                       player.current_dices[1],
+                       player.position)
 
         # Move player and check if he reached start
         passed_go = self.board.move_player_with_dices(player)
 
-        print("move_player(%s) updated_pos: %d, passed_go %r" %
-              (player.get_name(),
-               player.position,
-               passed_go))
+        self.log.debug("move_player(%s) updated_pos: %d, passed_go %r",
+                       Lazy(player.get_name),
+                       player.position,
+                       passed_go)
 
         # Broadcast new player position
         self.broadcast_packet(PlayerMove(
@@ -1941,7 +2289,7 @@ class Game(Thread):
 
         player.disconnect()
 
-        async_to_sync(self.channel_layer.group_discard)(
+        self.group_discard(
             self.uid, player.channel_name
         )
 
@@ -1950,7 +2298,7 @@ class Game(Thread):
             return
 
         if self.board.get_online_real_players_count() == 0:
-            print("Player disconnected, stopping game.")
+            self.log.info("Player disconnected, stopping game.")
             self.state = GameState.STOP_THREAD
             return
 
@@ -1972,9 +2320,9 @@ class Game(Thread):
         :param card: Card to handle action
         """
 
-        print("process_card_actions(%s) => card: %d (%s) available? %r"
-              % (player.get_name(),
-                 card.id_, card.action_type.name, card.available))
+        self.log.debug("process_card_actions(%s) => card: %d (%s) "
+                       "available? %r", Lazy(player.get_name),
+                       card.id_, card.action_type.name, card.available)
 
         if not card.available:  # WTF?
             return
@@ -2286,11 +2634,11 @@ class Game(Thread):
 
         # Player has enough money, no debt must be created
         if player.money >= amount:
-            print("player_balance_pay(%s) to (%s) player.money (%d) >= amount"
-                  " (%d)"
-                  % (player.get_name(),
-                     receiver.get_name() if receiver is not None else "Bank",
-                     player.money, amount))
+            self.log.debug("player_balance_pay(%s) to (%s) player.money "
+                           "(%d) >= amount (%d)",
+                           Lazy(player.get_name),
+                           Lazy(get_receiver_name, receiver),
+                           player.money, amount)
             self.player_balance_update(player=player,
                                        new_balance=player.money - amount,
                                        reason=reason)
@@ -2308,9 +2656,10 @@ class Game(Thread):
         temp_amount = 0
 
         if receiver is not None and receiver.has_debts():
-            print("player_balance_pay(%s) to (%s) receiver.has_debts()"
-                  % (player.get_name(),
-                     receiver.get_name() if receiver is not None else "Bank"))
+            self.log.debug("player_balance_pay(%s) to (%s) "
+                           "receiver.has_debts()",
+                           Lazy(player.get_name),
+                           Lazy(get_receiver_name, receiver))
             for debt in receiver.debts.copy():
                 if amount == 0:
                     break
@@ -2478,9 +2827,8 @@ class Game(Thread):
         ))
 
     def broadcast_packet(self, packet: Packet):
-        async_to_sync(self.channel_layer.group_send)(
-            self.uid, {"type": "send.packet", "packet": packet.serialize()}
-        )
+        self.queue_outbound(OutboundType.GROUP_SEND, self.uid,
+                            PacketUtils.to_message('send.packet', packet))
 
     def send_packet_to_group(self, packet: Packet, group_name: str):
         """
@@ -2489,12 +2837,66 @@ class Game(Thread):
         :param group_name: Name of the channels group
         :param packet: packet to be sent
         """
-        print("send_packet_to_group(%s, %s)" % (packet.name, group_name))
-        async_to_sync(self.channel_layer.group_send)(
-            group_name, {
-                'type': 'send.lobby.packet',
-                'packet': packet.serialize()
-            })
+        self.log.debug("send_packet_to_group(%s, %s)", packet.name,
+                       group_name)
+        self.queue_outbound(
+            OutboundType.GROUP_SEND, group_name,
+            PacketUtils.to_message('send.lobby.packet', packet))
+
+    def send_lobby_update(self, packet: Packet):
+        """
+        Broadcast a change of this room to the lobby group, the packet is
+        stamped with the shard and the version of its lobby index including
+        the change
+        :param packet: BroadcastUpdateLobby or BroadcastNewRoomToLobby
+        """
+        packet.version = self.lobby.set_room(self.uid, self.get_lobby_room())
+        packet.shard = self.lobby.shard
+
+        # sent with the other changes by Engine.flush_lobby()
+        if self.lobby.coalesce:
+            return
+
+        self.send_packet_to_group(packet, "lobby")
+
+    def send_lobby_room(self):
+        """
+        Broadcast the fields of this room that BroadcastUpdateLobby does not
+        carry (max players, private, password), in a BroadcastLobbyChanges,
+        only if the room changed (no gap in the versions seen by clients)
+        """
+        room = self.get_lobby_room()
+
+        if self.lobby.rooms.get(self.uid) == room:
+            return
+
+        version = self.lobby.set_room(self.uid, room)
+
+        # sent with the other changes by Engine.flush_lobby()
+        if self.lobby.coalesce:
+            return
+
+        self.send_packet_to_group(BroadcastLobbyChanges(
+            version=version, shard=self.lobby.shard,
+            rooms=[] if room is None else [room],
+            removed=[self.uid] if room is None else []), "lobby")
+
+    def get_lobby_room(self) -> Optional[Dict]:
+        """
+        :return: Fields of BroadcastNewRoomToLobby, None if the game is
+                 not in LOBBY state
+        """
+        if self.state is not GameState.LOBBY:
+            return None
+
+        return {
+            'game_token': self.uid,
+            'game_name': self.public_name,
+            'nb_players': len(self.board.players),
+            'max_nb_players': self.board.players_nb,
+            'is_private': self.board.option_is_private,
+            'has_password': self.board.option_password != ""
+        }
 
     def send_packet_to_player(self, player: Player, packet: Packet):
         if player.bot is True:
@@ -2510,11 +2912,8 @@ class Game(Thread):
         if channel_name is None:
             return
 
-        async_to_sync(self.channel_layer.send)(
-            channel_name, {
-                'type': 'lobby.callback',
-                'packet': packet.serialize()
-            })
+        self.queue_outbound(OutboundType.SEND, channel_name,
+                            PacketUtils.to_message('lobby.callback', packet))
 
     def send_packet(self, channel_name: str, packet: Packet):
         """
@@ -2529,8 +2928,151 @@ class Game(Thread):
         function_name = 'lobby.callback' if self.state == GameState.LOBBY \
             else 'player.callback'
 
-        async_to_sync(self.channel_layer.send)(
-            channel_name, {
-                'type': function_name,
-                'packet': packet.serialize()
-            })
+        self.queue_outbound(OutboundType.SEND, channel_name,
+                            PacketUtils.to_message(function_name, packet))
+
+    def group_add(self, group: str, channel_name: str):
+        """
+        Add a channel to a group (applied in order with packets)
+        :param group: Group name
+        :param channel_name: Channel to add
+        """
+        self.queue_outbound(OutboundType.GROUP_ADD, group, channel_name)
+
+    def group_discard(self, group: str, channel_name: str):
+        """
+        Remove a channel from a group (applied in order with packets)
+        :param group: Group name
+        :param channel_name: Channel to remove
+        """
+        self.queue_outbound(OutboundType.GROUP_DISCARD, group, channel_name)
+
+    def queue_outbound(self, outbound_type: OutboundType, destination: str,
+                       content):
+        """
+        Packets are not sent directly, they are sent by flush_packets()
+        at the end of the tick
+        :param outbound_type: Channel layer operation
+        :param destination: Channel or group name
+        :param content: Message to send or channel name (group add/discard)
+        """
+        with self.outbound_lock:
+            self.outbound.append((outbound_type, destination, content))
+
+    def take_outbound(self) -> List[Tuple]:
+        """
+        :return: Buffered operations, removed from the buffer
+        """
+        with self.outbound_lock:
+            outbound = self.outbound
+            self.outbound = []
+
+        return outbound
+
+    def flush_packets(self):
+        """
+        Send every buffered packet with a single event loop hop.
+        Consecutive messages for the same destination are merged into one
+        "send.bundle" message, order is kept.
+        """
+        with self.flush_lock:
+            outbound = self.take_outbound()
+            if len(outbound) == 0:
+                return
+
+            start = time.perf_counter()
+            async_to_sync(self.send_outbound)(outbound)
+            self.observe_flush(outbound, time.perf_counter() - start)
+
+    async def flush_packets_async(self):
+        """
+        flush_packets() from the event loop (see Engine.start_async()),
+        channel layer calls are awaited directly
+        """
+        outbound = self.take_outbound()
+        if len(outbound) == 0:
+            return
+
+        start = time.perf_counter()
+        await self.send_outbound(outbound)
+        self.observe_flush(outbound, time.perf_counter() - start)
+
+    def observe_flush(self, outbound: List[Tuple], duration: float):
+        self.metrics.observe_channel('flush', duration)
+        self.metrics.count_packets_sent(
+            content for outbound_type, _, content in outbound
+            if outbound_type in (OutboundType.SEND,
+                                 OutboundType.GROUP_SEND))
+
+    def save_database(self, function: Callable, *args, **kwargs):
+        """
+        Execute writes, without waiting for them in the event loop
+        """
+        if self.database is None:
+            function(*args, **kwargs)
+            return
+
+        self.database.submit(function, *args, **kwargs)
+
+    async def send_outbound(self, outbound: List[Tuple]):
+        """
+        :param outbound: Buffered operations (see queue_outbound)
+        """
+        for outbound_type, destination, content in merge_outbound(outbound):
+            if outbound_type is OutboundType.SEND:
+                await self.channel_layer.send(destination, content)
+            elif outbound_type is OutboundType.GROUP_SEND:
+                await self.channel_layer.group_send(destination, content)
+            elif outbound_type is OutboundType.GROUP_ADD:
+                await self.channel_layer.group_add(destination, content)
+            elif outbound_type is OutboundType.GROUP_DISCARD:
+                await self.channel_layer.group_discard(destination, content)
+
+
+def save_game_results(game: models.Game, game_users: List[models.GameUser]):
+    """
+    :param game: Ended game
+    :param game_users: Results of its players (ranks)
+    """
+    game.save()
+
+    for game_user in game_users:
+        game_user.save()
+
+
+def get_receiver_name(receiver: Optional[Player]) -> str:
+    return receiver.get_name() if receiver is not None else "Bank"
+
+
+def merge_outbound(outbound: List[Tuple]) -> List[Tuple]:
+    """
+    Merge consecutive messages sent to the same destination into bundles
+    :param outbound: Buffered operations (type, destination, content)
+    :return: Operations to execute
+    """
+    merged = []
+
+    for outbound_type, destination, content in outbound:
+        if outbound_type not in (OutboundType.SEND, OutboundType.GROUP_SEND):
+            merged.append((outbound_type, destination, content))
+            continue
+
+        previous = merged[-1] if len(merged) > 0 else None
+
+        if previous is not None and previous[0] is outbound_type \
+                and previous[1] == destination:
+            previous[2].append(content)
+        else:
+            merged.append((outbound_type, destination, [content]))
+
+    result = []
+
+    for outbound_type, destination, content in merged:
+        if outbound_type in (OutboundType.SEND, OutboundType.GROUP_SEND):
+            content = content[0] if len(content) == 1 else {
+                'type': 'send.bundle',
+                'messages': content
+            }
+        result.append((outbound_type, destination, content))
+
+    return result
@@ -0,0 +1,224 @@
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+
+import msgpack
+from django.conf import settings
+
+from server.game_handler.clock import ManualClock
+from server.game_handler.data import Board
+from server.game_handler.data.packets import PacketUtils
+from server.game_handler.game import Game, GameState, QueuePacket
+
+log = logging.getLogger(__name__)
+
+JOURNAL_VERSION = 1
+
+# Records: [START, version, pickled JournalStart]
+#          [TICK, seconds since start, [[channel name, compact packet], ...]]
+START = 0
+TICK = 1
+
+
+@dataclass
+class JournalStart:
+    """
+    Game when it leaves the lobby, its board contains the random generator
+    used for every draw of the game (dices, cards, bots waits)
+    """
+    uid: str
+    public_name: str
+    # token of the host player
+    host: Optional[str]
+    start_date: datetime
+    state: GameState
+    timeout: datetime
+    turn_counter: int
+    board: Board
+    date: datetime
+
+
+class Journal:
+    """
+    Append-only journal of a game: state of the game when it leaves the
+    lobby, then the date and the inbound packets (players and bots) of
+    every tick. replay() rebuilds the game from its journal.
+
+    The lobby is not recorded: players are loaded from the database.
+    A journal that cannot be written (full disk, permissions) is closed and
+    the game continues without journal.
+    """
+    path: str
+    # opened by the first recorded tick
+    file: Optional[BinaryIO]
+    # date of the start record
+    date: Optional[datetime]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.date = None
+        self.packer = msgpack.Packer()
+
+    def start(self, game: Game):
+        """
+        Record the start state of a game
+        """
+        self.file = open(self.path, 'ab')
+        self.date = game.clock.now()
+        host = getattr(game, 'host_player', None)
+
+        self.write([START, JOURNAL_VERSION, pickle.dumps(JournalStart(
+            uid=game.uid,
+            public_name=getattr(game, 'public_name', ""),
+            host=None if host is None else host.get_id(),
+            start_date=getattr(game, 'start_date', self.date),
+            state=game.state,
+            timeout=game.timeout,
+            turn_counter=game.turn_counter,
+            board=game.board,
+            date=self.date
+        ))])
+
+    def record_tick(self, game: Game, packets: List[QueuePacket]):
+        """
+        Record a tick, before its packets are processed
+        :param game: Ticked game
+        :param packets: Packets processed by the tick
+        """
+        try:
+            if self.file is None:
+                if game.state.value <= GameState.LOBBY.value:
+                    return
+                self.start(game)
+
+            self.write([TICK, (game.clock.now() - self.date).total_seconds(),
+                        [[queue_packet.channel_name,
+                          PacketUtils.to_compact(vars(queue_packet.packet))]
+                         for queue_packet in packets]])
+            # Journal is complete up to the last tick
+            self.file.flush()
+        except OSError:
+            log.exception("Journal of game %s could not be written, "
+                          "journal disabled", game.uid)
+            self.close()
+            game.journal = None
+
+    def write(self, record: list):
+        self.file.write(self.packer.pack(record))
+
+    def close(self):
+        if self.file is None:
+            return
+
+        file, self.file = self.file, None
+
+        try:
+            file.close()
+        except OSError:
+            log.exception("Journal %s could not be closed", self.path)
+
+
+def get_journal_dir() -> Optional[str]:
+    """
+    Create the journal directory if needed (engine startup)
+    :return: Journal directory, None if journals are disabled
+             (GAME_JOURNAL_DIR setting) or if it cannot be created
+    """
+    directory = getattr(settings, 'GAME_JOURNAL_DIR', '')
+
+    if not directory:
+        return None
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        log.exception("Journal directory %s could not be created, "
+                      "journals disabled", directory)
+        return None
+
+    if not os.access(directory, os.W_OK):
+        log.error("Journal directory %s is not writable, journals disabled",
+                  directory)
+        return None
+
+    return directory
+
+
+def get_journal_path(directory: str, uid: str) -> str:
+    """
+    :param directory: Journal directory (see get_journal_dir())
+    :param uid: Game uid
+    :return: Journal file of the game
+    """
+    return os.path.join(directory, '%s.journal' % uid)
+
+
+def read_journal(path: str) -> Iterator[list]:
+    """
+    :param path: Journal file
+    :return: Records of the journal (a truncated last record is ignored)
+    """
+    with open(path, 'rb') as file:
+        unpacker = msgpack.Unpacker(file, raw=False, use_list=True)
+
+        try:
+            for record in unpacker:
+                yield record
+        except msgpack.OutOfData:
+            return
+
+
+def replay(records: Iterable[list], until: float = None) -> Game:
+    """
+    Rebuild a game: packets of every tick are processed at the recorded
+    date (ManualClock), bots decisions are read from the journal.
+
+    :param records: Records of a journal (see read_journal())
+    :param until: Seconds after the start record (None: whole journal)
+    :return: Game after the last replayed tick (not added to an engine)
+    """
+    records = iter(records)
+    kind, version, data = next(records)
+
+    if kind != START or version != JOURNAL_VERSION:
+        raise ValueError("Invalid journal")
+
+    start: JournalStart = pickle.loads(data)
+    clock = ManualClock(start.date)
+    game = Game(uid=start.uid, clock=clock)
+    game.board = start.board
+    game.public_name = start.public_name
+    game.start_date = start.start_date
+    game.host_player = None if start.host is None else \
+        start.board.get_player(start.host)
+    game.state = start.state
+    game.timeout = start.timeout
+    game.turn_counter = start.turn_counter
+
+    for kind, seconds, packets in records:
+        # Journal of another run of the game
+        if kind != TICK:
+            break
+
+        if until is not None and seconds > until:
+            break
+
+        clock.set(start.date + timedelta(seconds=seconds))
+
+        for channel_name, frame in packets:
+            packet = PacketUtils.deserialize_packet(
+                PacketUtils.from_compact(frame))
+            # accepted when recorded
+            game.packets_queue.put(QueuePacket(packet=packet,
+                                               channel_name=channel_name,
+                                               internal=True))
+
+        game.tick()
+        # Nothing is sent
+        game.outbound.clear()
+
+    return game
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.worker import Worker
+from django.utils.module_loading import import_string
+
+log = logging.getLogger(__name__)
+
+# Added to the group messages forwarded to the fallback layer: members in
+# the sending process already received them
+ORIGIN_KEY = '__local_origin__'
+
+
+class LocalChannelLayer(InMemoryChannelLayer):
+    """
+    Channel layer of single-node deployments (ENGINE_IN_PROCESS): consumers
+    and game_engine workers run in the same process, messages go through
+    asyncio queues without serialization (a message must not be modified
+    once sent).
+
+    Channels without receiver in this process are reached through the
+    fallback layer (channels_redis), which also brings the messages sent
+    by the other processes.
+    """
+
+    def __init__(self, fallback: Optional[Dict] = None, **kwargs):
+        """
+        :param fallback: BACKEND and CONFIG of the layer reaching the other
+                         processes, None => single process
+        """
+        super().__init__(**kwargs)
+        self.fallback = None if fallback is None else import_string(
+            fallback['BACKEND'])(**fallback.get('CONFIG', {}))
+        # channels received in this process
+        self.local = set()
+        # channel => task moving the fallback messages to the local queue
+        self.pumps = {}
+        self.origin = uuid.uuid4().hex
+
+    def listen(self, channel: str):
+        """
+        Messages for this channel are received in this process (workers
+        listening before their first receive())
+        """
+        self.local.add(channel)
+
+    async def new_channel(self, prefix: str = "specific.") -> str:
+        if self.fallback is None:
+            channel = await super().new_channel(prefix)
+        else:
+            # Name reachable from the other processes
+            channel = await self.fallback.new_channel(prefix)
+
+        self.local.add(channel)
+        return channel
+
+    async def send(self, channel: str, message: Dict):
+        if self.fallback is not None and channel not in self.local:
+            return await self.fallback.send(channel, message)
+
+        self.put(channel, message)
+
+    def put(self, channel: str, message: Dict):
+        """
+        Add a message to the local queue of a channel (not copied)
+        """
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+
+        queue = self.channels.setdefault(channel, asyncio.Queue())
+
+        if queue.qsize() >= self.capacity:
+            raise ChannelFull(channel)
+
+        queue.put_nowait((time.time() + self.expiry, message))
+
+    async def receive(self, channel: str) -> Dict:
+        self.local.add(channel)
+
+        if self.fallback is None:
+            return await super().receive(channel)
+
+        # Specific channels are buffered by the fallback layer, their
+        # receive() can be cancelled
+        if '!' in channel:
+            return await self.receive_any(channel)
+
+        if channel not in self.pumps:
+            self.pumps[channel] = asyncio.ensure_future(self.pump(channel))
+
+        return await super().receive(channel)
+
+    async def receive_any(self, channel: str) -> Dict:
+        """
+        First message of the local queue or of the fallback layer
+        """
+        local = asyncio.ensure_future(super().receive(channel))
+        remote = asyncio.ensure_future(self.receive_remote(channel))
+
+        try:
+            done, _ = await asyncio.wait(
+                {local, remote}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (local, remote):
+                if not task.done():
+                    task.cancel()
+
+        if local not in done:
+            return remote.result()
+
+        # Both received: remote message is kept for the next receive()
+        if remote in done and remote.exception() is None:
+            self.put(channel, remote.result())
+
+        return local.result()
+
+    async def receive_remote(self, channel: str) -> Dict:
+        """
+        :return: Next message sent by another process
+        """
+        while True:
+            message = await self.fallback.receive(channel)
+
+            if message.pop(ORIGIN_KEY, None) != self.origin:
+                return message
+
+    async def pump(self, channel: str):
+        while True:
+            message = await self.receive_remote(channel)
+
+            try:
+                self.put(channel, message)
+            except ChannelFull:
+                log.warning("Channel %s full, message dropped", channel)
+
+    async def group_add(self, group: str, channel: str):
+        await super().group_add(group, channel)
+
+        if self.fallback is not None:
+            await self.fallback.group_add(group, channel)
+
+    async def group_discard(self, group: str, channel: str):
+        await super().group_discard(group, channel)
+
+        if self.fallback is not None:
+            await self.fallback.group_discard(group, channel)
+
+    async def group_send(self, group: str, message: Dict):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_group_name(group), "Group name not valid"
+        self._clean_expired()
+
+        # Members of other processes get it from the fallback layer
+        for channel in list(self.groups.get(group, {})):
+            if self.fallback is not None and channel not in self.local:
+                continue
+
+            try:
+                self.put(channel, message)
+            except ChannelFull:
+                pass
+
+        if self.fallback is not None:
+            await self.fallback.group_send(
+                group, {**message, ORIGIN_KEY: self.origin})
+
+    async def flush(self):
+        for task in self.pumps.values():
+            task.cancel()
+
+        self.pumps = {}
+        await super().flush()
+
+        if self.fallback is not None:
+            await self.fallback.flush()
+
+
+class InProcessWorkers:
+    """
+    ASGI application starting the game_engine workers in the event loop of
+    the ASGI server (ENGINE_IN_PROCESS), on the first connection
+    """
+    task: Optional[asyncio.Task]
+
+    def __init__(self, application, channels: List[str]):
+        """
+        :param application: Application routing the "channel" scopes
+        :param channels: Channels of the workers (see sharding.py)
+        """
+        self.application = application
+        self.channels = channels
+        self.task = None
+
+    async def __call__(self, scope, receive, send):
+        if self.task is None:
+            self.start()
+
+        return await self.application(scope, receive, send)
+
+    def start(self):
+        layer = get_channel_layer()
+
+        if isinstance(layer, LocalChannelLayer):
+            for channel in self.channels:
+                layer.listen(channel)
+
+        worker = Worker(application=self.application,
+                        channels=self.channels, channel_layer=layer)
+        self.task = asyncio.ensure_future(worker.arun())
@@ -0,0 +1,118 @@
+from threading import Lock
+from typing import Callable, Dict, Optional, Set
+
+from server.game_handler.data.packets import LobbySnapshot, \
+    BroadcastLobbyChanges, PacketUtils
+
+
+class LobbyIndex:
+    """
+    Rooms of an engine that are in LOBBY state, updated with every lobby
+    broadcast (see Game.send_lobby_update()). A client connecting to the
+    lobby receives one LobbySnapshot, then the broadcasts (deltas) carry
+    the version of the index after their change.
+
+    Coalesced index: broadcasts are not sent by the games, the rooms
+    changed since the last flush are sent in one BroadcastLobbyChanges
+    (see Engine.flush_lobby()).
+
+    Every game_engine worker (shard) has its own index: packets carry the
+    shard, a client keeps one version per shard.
+    """
+    shard: int
+    # game token => room (fields of BroadcastNewRoomToLobby)
+    rooms: Dict[str, Dict]
+    # incremented on every change of a room
+    version: int
+    # serialized LobbySnapshot of the current version, never modified once
+    # built (sent to every connecting client)
+    message: Optional[Dict]
+    # game tokens of the rooms changed since the last take_changes()
+    changed: Set[str]
+
+    def __init__(self, shard: int = 0,
+                 on_change: Callable[[], None] = None):
+        """
+        :param shard: Shard of the engine
+        :param on_change: Called by the first change after take_changes()
+                          (schedules it), None => not coalesced
+        """
+        self.shard = shard
+        self.rooms = {}
+        self.version = 0
+        self.message = None
+        self.on_change = on_change
+        self.changed = set()
+        # read by the consumers while the scheduler thread updates it
+        self.lock = Lock()
+
+    @property
+    def coalesce(self) -> bool:
+        return self.on_change is not None
+
+    def set_room(self, game_token: str, room: Optional[Dict]) -> int:
+        """
+        :param game_token: Game of the room
+        :param room: Room fields, None => room removed (game launched or
+                     deleted)
+        :return: Version of the index including this room
+        """
+        with self.lock:
+            if self.rooms.get(game_token) == room:
+                return self.version
+
+            if room is None:
+                del self.rooms[game_token]
+            else:
+                self.rooms[game_token] = room
+
+            self.version += 1
+            self.message = None
+            version = self.version
+            first = len(self.changed) == 0
+
+            if self.coalesce:
+                self.changed.add(game_token)
+
+        if self.coalesce and first:
+            self.on_change()
+
+        return version
+
+    def get_message(self) -> Optional[Dict]:
+        """
+        :return: Lobby message of the snapshot (serialized once per
+                 version), None if there is no room
+        """
+        with self.lock:
+            if len(self.rooms) == 0:
+                return None
+
+            if self.message is None:
+                packet = LobbySnapshot(version=self.version,
+                                       shard=self.shard,
+                                       rooms=list(self.rooms.values()))
+                self.message = PacketUtils.to_message('lobby.callback',
+                                                      packet)
+
+            return self.message
+
+    def take_changes(self) -> Optional[Dict]:
+        """
+        :return: Group message of the rooms changed since the last call
+                 (latest values only), None if nothing changed
+        """
+        with self.lock:
+            if len(self.changed) == 0:
+                return None
+
+            packet = BroadcastLobbyChanges(
+                version=self.version,
+                shard=self.shard,
+                rooms=[self.rooms[token] for token in self.changed
+                       if token in self.rooms],
+                removed=[token for token in self.changed
+                         if token not in self.rooms])
+            self.changed = set()
+
+        return PacketUtils.to_message('send.lobby.packet', packet)
@@ -0,0 +1,72 @@
+import json
+import logging
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+# Attributes of every LogRecord, anything else was given with extra=
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord(
+    '', logging.DEBUG, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class Lazy:
+    """
+    Value computed only if the record is emitted:
+    log.debug("packet: %s", Lazy(packet.serialize))
+    """
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function: Callable, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+        return str(self.function(*self.args))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep 1 out of rate DEBUG records of each event (logger and message).
+    Records of higher levels are always kept.
+    """
+    counters: Dict[Tuple[str, str], int]
+
+    def __init__(self, rate: int = 1):
+        super().__init__()
+        self.rate = max(1, int(rate))
+        self.counters = {}
+        self.lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate == 1 or record.levelno > logging.DEBUG:
+            return True
+
+        key = (record.name, record.msg)
+
+        with self.lock:
+            count = self.counters.get(key, 0)
+            self.counters[key] = count + 1
+
+        return count % self.rate == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, fields given with extra= are kept
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, default=str)
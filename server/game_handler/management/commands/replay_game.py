@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from server.game_handler.journal import read_journal, replay
+
+
+class Command(BaseCommand):
+    help = "Replay the journal of a game (see GAME_JOURNAL_DIR)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('journal', help="Journal file of the game")
+        parser.add_argument('--until', type=float, default=None,
+                            help="Stop after this number of seconds")
+
+    def handle(self, *args, **options):
+        # The end of the game is not saved to the database
+        with transaction.atomic():
+            try:
+                game = replay(read_journal(options['journal']),
+                              until=options['until'])
+            except (OSError, ValueError, StopIteration) as e:
+                raise CommandError("Could not replay journal: %r" % e)
+            finally:
+                transaction.set_rollback(True)
+
+        board = game.board
+        self.stdout.write("Game %s: %s, round %d" % (
+            game.uid, game.state.name, board.current_round))
+
+        for player in board.players:
+            self.stdout.write("  %s: %d money, position %d%s" % (
+                player.get_name(), player.money, player.position,
+                " (bankrupt)" if player.bankrupt else ""))
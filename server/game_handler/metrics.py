@@ -0,0 +1,277 @@
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, List, Tuple, Iterable
+
+from django.core.cache import cache
+
+from server.game_handler.sharding import get_shards_count
+
+# Upper bounds (seconds) of the histograms buckets
+TICK_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+CHANNEL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5)
+
+# Seconds before the metrics of a worker that stopped publishing expire
+METRICS_TIMEOUT = 120
+
+# (sample name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class Histogram:
+    """
+    Prometheus-like histogram (cumulative buckets, sum and count)
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: Dict[str, str]) -> List[Sample]:
+        samples = []
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples.append(('%s_bucket' % name, {**labels, 'le': le},
+                            cumulative))
+
+        samples.append(('%s_sum' % name, labels, self.sum))
+        samples.append(('%s_count' % name, labels, self.count))
+        return samples
+
+
+class Metrics:
+    """
+    Metrics of one game_engine worker (shard).
+
+    Values are recorded by the games (scheduler thread) and by the engine
+    (consumer thread), then published to the cache by the worker so that
+    the HTTP metrics view can read them (see publish_metrics()).
+    """
+    # game uid => tick duration histogram
+    tick_duration: Dict[str, Histogram]
+    # game uid => ticks longer than the tick duration
+    tick_overruns: Dict[str, int]
+    # game uid => packets_queue size at the start of the last tick
+    queue_depth: Dict[str, int]
+    # packet name => count
+    packets_processed: Dict[str, int]
+    packets_sent: Dict[str, int]
+    # packets dropped by full game queues
+    packets_dropped: Dict[str, int]
+    # channel layer operation => duration of async_to_sync calls
+    channel_duration: Dict[str, Histogram]
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tick_duration = {}
+        self.tick_overruns = defaultdict(int)
+        self.queue_depth = {}
+        self.packets_processed = defaultdict(int)
+        self.packets_sent = defaultdict(int)
+        self.packets_dropped = defaultdict(int)
+        self.channel_duration = {}
+
+    def observe_tick(self, game_uid: str, duration: float, queue_depth: int,
+                     overrun: bool):
+        """
+        :param game_uid: Ticked game
+        :param duration: Duration of the tick (seconds)
+        :param queue_depth: Number of packets waiting before the tick
+        :param overrun: Tick took longer than the game tick duration
+        """
+        with self.lock:
+            histogram = self.tick_duration.get(game_uid)
+
+            if histogram is None:
+                histogram = Histogram(TICK_BUCKETS)
+                self.tick_duration[game_uid] = histogram
+
+            histogram.observe(duration)
+            self.queue_depth[game_uid] = queue_depth
+
+            if overrun:
+                self.tick_overruns[game_uid] += 1
+
+    def count_packet_processed(self, name: str):
+        with self.lock:
+            self.packets_processed[name] += 1
+
+    def count_packet_dropped(self, name: str):
+        with self.lock:
+            self.packets_dropped[name] += 1
+
+    def count_packets_sent(self, messages: Iterable[Dict]):
+        """
+        :param messages: Channel layer messages (bundles are unpacked)
+        """
+        with self.lock:
+            for message in messages:
+                if message.get('type') == 'send.bundle':
+                    for bundled in message['messages']:
+                        self.packets_sent[bundled.get('name', '')] += 1
+                else:
+                    self.packets_sent[message.get('name', '')] += 1
+
+    def observe_channel(self, operation: str, duration: float):
+        """
+        :param operation: Channel layer operation (send, flush, ...)
+        :param duration: Duration of the async_to_sync call (seconds)
+        """
+        with self.lock:
+            histogram = self.channel_duration.get(operation)
+
+            if histogram is None:
+                histogram = Histogram(CHANNEL_BUCKETS)
+                self.channel_duration[operation] = histogram
+
+            histogram.observe(duration)
+
+    def remove_game(self, game_uid: str):
+        """
+        Forget per-game metrics of a stopped game
+        """
+        with self.lock:
+            self.tick_duration.pop(game_uid, None)
+            self.tick_overruns.pop(game_uid, None)
+            self.queue_depth.pop(game_uid, None)
+
+    def collect(self, states: Iterable[str]) -> List[Dict]:
+        """
+        :param states: State name of every live game
+        :return: Metric families (name, type, help, samples)
+        """
+        games_per_state = defaultdict(int)
+        for state in states:
+            games_per_state[state] += 1
+
+        with self.lock:
+            tick_samples = []
+            for uid, histogram in self.tick_duration.items():
+                tick_samples += histogram.samples(
+                    'engine_tick_duration_seconds', {'game': uid})
+
+            channel_samples = []
+            for operation, histogram in self.channel_duration.items():
+                channel_samples += histogram.samples(
+                    'engine_channel_layer_duration_seconds',
+                    {'operation': operation})
+
+            return [
+                family('engine_tick_duration_seconds', 'histogram',
+                       'Duration of game ticks', tick_samples),
+                family('engine_tick_overruns_total', 'counter',
+                       'Ticks longer than the tick duration',
+                       counter_samples('engine_tick_overruns_total', 'game',
+                                       self.tick_overruns)),
+                family('engine_packets_queue_depth', 'gauge',
+                       'Packets waiting in the game queue before a tick',
+                       counter_samples('engine_packets_queue_depth', 'game',
+                                       self.queue_depth)),
+                family('engine_packets_processed_total', 'counter',
+                       'Packets processed by the games, per type',
+                       counter_samples('engine_packets_processed_total',
+                                       'packet', self.packets_processed)),
+                family('engine_packets_sent_total', 'counter',
+                       'Packets sent by the engine, per type',
+                       counter_samples('engine_packets_sent_total',
+                                       'packet', self.packets_sent)),
+                family('engine_packets_dropped_total', 'counter',
+                       'Packets dropped by full game queues, per type',
+                       counter_samples('engine_packets_dropped_total',
+                                       'packet', self.packets_dropped)),
+                family('engine_channel_layer_duration_seconds', 'histogram',
+                       'Time spent in async_to_sync channel layer calls',
+                       channel_samples),
+                family('engine_games', 'gauge', 'Live games per state',
+                       counter_samples('engine_games', 'state',
+                                       games_per_state)),
+            ]
+
+
+def family(name: str, metric_type: str, description: str,
+           samples: List[Sample]) -> Dict:
+    return {
+        'name': name,
+        'type': metric_type,
+        'help': description,
+        'samples': samples
+    }
+
+
+def counter_samples(name: str, label: str,
+                    values: Dict[str, float]) -> List[Sample]:
+    return [(name, {label: key}, value) for key, value in values.items()]
+
+
+def publish_metrics(shard: int, families: List[Dict]):
+    """
+    Publish metrics of a game_engine worker (read by the metrics view)
+
+    :param shard: Shard index of the worker
+    :param families: Metrics.collect() result
+    """
+    cache.set('game_engine_metrics_%d' % shard, families,
+              timeout=METRICS_TIMEOUT)
+
+
+def get_published_metrics() -> Dict[int, List[Dict]]:
+    """
+    :return: shard index => metric families (missing workers are ignored)
+    """
+    keys = ['game_engine_metrics_%d' % shard
+            for shard in range(get_shards_count())]
+    values = cache.get_many(keys)
+
+    return {
+        shard: values[key] for shard, key in enumerate(keys) if key in values
+    }
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def render_metrics(metrics: Dict[int, List[Dict]]) -> str:
+    """
+    Prometheus text exposition format, every sample gets a shard label
+
+    :param metrics: shard index => metric families
+    :return: Text
+    """
+    families = {}
+
+    for shard, shard_families in sorted(metrics.items()):
+        for metric in shard_families:
+            merged = families.setdefault(metric['name'], {
+                **metric, 'samples': []
+            })
+
+            for name, labels, value in metric['samples']:
+                merged['samples'].append(
+                    (name, {'shard': str(shard), **labels}, value))
+
+    lines = []
+
+    for metric in families.values():
+        lines.append('# HELP %s %s' % (metric['name'], metric['help']))
+        lines.append('# TYPE %s %s' % (metric['name'], metric['type']))
+
+        for name, labels, value in metric['samples']:
+            labels = ','.join('%s="%s"' % (key, escape_label(label))
+                              for key, label in labels.items())
+            lines.append('%s{%s} %s' % (name, labels, repr(float(value))))
+
+    return '\n'.join(lines) + '\n'
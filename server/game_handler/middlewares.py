@@ -1,6 +1,8 @@
+import copy
+import logging
 import random
-import traceback
-from typing import Optional
+import time
+from typing import Dict, List, Optional
 from urllib.parse import parse_qs
 from uuid import UUID
 
@@ -8,12 +10,22 @@ import jwt
 import names
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from django.db import close_old_connections
 from jwt import InvalidTokenError
 
 from server.game_handler.models import User
+from server.game_handler.ttlcache import TTLCache
 from django.conf import settings
 
+log = logging.getLogger(__name__)
+
+# jwt token => user id (until the expiration of the token)
+claims_cache = TTLCache(size=settings.AUTH_CACHE_SIZE,
+                        ttl=settings.AUTH_CACHE_TTL)
+# user id => User (invalidated when a user is saved through Django, see
+# signals.py, writes of the external API are seen after AUTH_CACHE_TTL)
+users_cache = TTLCache(size=settings.AUTH_CACHE_SIZE,
+                       ttl=settings.AUTH_CACHE_TTL)
+
 
 def is_valid_uuid(uuid_to_test, version=4):
     """
@@ -43,6 +55,23 @@ def is_valid_uuid(uuid_to_test, version=4):
     return str(uuid_obj) == uuid_to_test
 
 
+# Formats of WebSocket frames (?format=), json is the default
+WIRE_FORMATS = ("json", "msgpack")
+
+
+def get_wire_format(query: Dict[str, List[str]]) -> str:
+    """
+    :param query: Parsed query string
+    :return: Negotiated format of WebSocket frames (json if invalid)
+    """
+    wire_format = query.get('format', [WIRE_FORMATS[0]])[0]
+
+    if wire_format not in WIRE_FORMATS:
+        return WIRE_FORMATS[0]
+
+    return wire_format
+
+
 class AuthMiddleware:
     """
     Middleware for WebSocket connections.
@@ -59,11 +88,12 @@ class AuthMiddleware:
         self.key = getattr(settings, "JWT_KEY", None)
 
     async def __call__(self, scope, receive, send):
-        close_old_connections()
         try:
             # get token from url
-            query = scope["query_string"].decode("utf8")
-            token = parse_qs(query).get('token', None)
+            query = parse_qs(scope["query_string"].decode("utf8"))
+            token = query.get('token', None)
+
+            scope['format'] = get_wire_format(query)
 
             if (jwt_token_list := token) is not None:
 
@@ -78,22 +108,60 @@ class AuthMiddleware:
                     else:
                         token = jwt_token
                 else:
-                    # decode jwt and get jti
-                    encoded = jwt.decode(jwt_token, self.key,
-                                         algorithms=["HS256"])
-                    token = encoded.get('userId')
+                    token = self.decode_token(jwt_token)
 
-                # get user from db
-                scope['user'] = await self.get_user(token)
+                scope['user'] = await self.get_cached_user(token)
             else:
                 scope['user'] = None
                 return None
-        except (InvalidTokenError, KeyError):
-            traceback.print_exc()
+        except (InvalidTokenError, KeyError) as e:
+            # rejected handshake, client-triggerable: not a server error
+            log.debug("Handshake rejected: %r", e, exc_info=True)
             scope['user'] = None
             return None
         return await self.app(scope, receive, send)
 
+    def decode_token(self, jwt_token: str) -> Optional[str]:
+        """
+        :param jwt_token: Token sent by the client
+        :return: userId claim of the token
+        """
+        token = claims_cache.get(jwt_token)
+
+        if token is not None:
+            return token
+
+        # decode jwt and get jti
+        encoded = jwt.decode(jwt_token, self.key, algorithms=["HS256"])
+        token = encoded.get('userId')
+
+        if token is not None:
+            # never used after its expiration
+            ttl = None if 'exp' not in encoded else \
+                encoded['exp'] - time.time()
+            claims_cache.set(jwt_token, token, ttl=ttl)
+
+        return token
+
+    async def get_cached_user(self, token) -> Optional[User]:
+        """
+        :param token: User id
+        :return: User, from the cache when possible (copy: connections do
+                 not share their user)
+        """
+        key = str(token)
+        user = users_cache.get(key)
+
+        if user is None:
+            user = await self.get_user(token)
+
+            if user is None:
+                return None
+
+            users_cache.set(key, user)
+
+        return copy.copy(user)
+
     @database_sync_to_async
     def get_user(self, token):
         try:
@@ -115,7 +183,7 @@ class AuthMiddleware:
                 user.avatar = ""
                 user.save()
 
-                print("Creating new user=%s" % token)
+                log.info("Creating new user=%s", token)
 
                 return user
 
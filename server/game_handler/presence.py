@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from server.game_handler.data.packets import FriendConnected, \
+    FriendDisconnected, Packet, PacketUtils
+from server.game_handler.game import OutboundType, merge_outbound
+from server.game_handler.models import User, UserFriend
+from server.game_handler.ttlcache import TTLCache
+
+# player token => friends tokens, reloaded when the player connects to the
+# lobby (signals.py only sees the writes made through Django)
+friends_cache = TTLCache(size=settings.PRESENCE_CACHE_SIZE,
+                         ttl=settings.PRESENCE_CACHE_TTL)
+# player token => Profile (same)
+profiles_cache = TTLCache(size=settings.PRESENCE_CACHE_SIZE,
+                          ttl=settings.PRESENCE_CACHE_TTL)
+
+
+@dataclass
+class Profile:
+    token: str
+    username: str
+    avatar: str
+
+    @staticmethod
+    def from_user(user: User) -> 'Profile':
+        return Profile(token=str(user.id), username=user.name,
+                       avatar=user.avatar)
+
+
+# (friends tokens, token => Profile of the player and of his friends)
+Presence = Tuple[List[str], Dict[str, Profile]]
+
+
+def get_cached_presence(player_token: str) -> Optional[Presence]:
+    """
+    :param player_token: Player connecting to (or leaving) the lobby
+    :return: Friends and profiles, None if not cached
+    """
+    friends = friends_cache.get(player_token)
+
+    if friends is None:
+        return None
+
+    # Profile of the player is only needed to notify his friends
+    tokens = friends + [player_token] if len(friends) > 0 else []
+    profiles = {}
+
+    for token in tokens:
+        profile = profiles_cache.get(token)
+
+        if profile is None:
+            return None
+
+        profiles[token] = profile
+
+    return friends, profiles
+
+
+def load_presence(player_token: str) -> Presence:
+    """
+    Friends of a player and their profiles in one query (blocking)
+    :param player_token: Player connecting to (or leaving) the lobby
+    :return: Friends and profiles
+    """
+    friendships = UserFriend.objects.filter(user_id=player_token) \
+        .select_related('user', 'friend').order_by('id')
+    friends = []
+    profiles = {}
+
+    for friendship in friendships:
+        for user in (friendship.user, friendship.friend):
+            profile = Profile.from_user(user)
+            profiles[profile.token] = profile
+            profiles_cache.set(profile.token, profile)
+
+        friends.append(str(friendship.friend_id))
+
+    friends_cache.set(player_token, friends)
+
+    return friends, profiles
+
+
+def get_presence_messages(player_token: str, channel_name: str,
+                          presence: Presence, connected: Dict[str, str],
+                          online: bool) -> List[Tuple]:
+    """
+    :param player_token: Player connecting to (or leaving) the lobby
+    :param channel_name: Lobby channel of the player
+    :param presence: Friends and profiles of the player
+    :param connected: Lobby channel of every connected player
+    :param online: Player connects (FriendConnected) or leaves the lobby
+    :return: Channel layer operations (type, channel, message), messages
+             to the player are merged in one bundle
+    """
+    friends, profiles = presence
+    to_player = []
+    to_friends = []
+
+    for token in friends:
+        friend_channel = connected.get(token)
+
+        # Friend not in the lobby
+        if friend_channel is None:
+            continue
+
+        player = profiles[player_token]
+
+        if online:
+            friend = profiles[token]
+            to_player.append((OutboundType.SEND, channel_name, get_message(
+                FriendConnected(friend_token=token,
+                                username=friend.username,
+                                avatar_url=friend.avatar))))
+            packet = FriendConnected(friend_token=player_token,
+                                     username=player.username,
+                                     avatar_url=player.avatar)
+        else:
+            packet = FriendDisconnected(friend_token=player_token,
+                                        username=player.username,
+                                        avatar_url=player.avatar)
+
+        to_friends.append((OutboundType.SEND, friend_channel,
+                           get_message(packet)))
+
+    return merge_outbound(to_player + to_friends)
+
+
+def get_message(packet: Packet) -> Dict:
+    return PacketUtils.to_message('lobby.callback', packet)
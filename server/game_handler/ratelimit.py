@@ -0,0 +1,30 @@
+import time
+
+
+class TokenBucket:
+    """
+    Rate limit of a client: rate tokens per second, at most burst tokens.
+    Refused packets also take a token: a client that keeps flooding goes
+    into debt (see PlayerConsumer.receive_json).
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        :param rate: Tokens added per second
+        :param burst: Max tokens (packets accepted at once)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.date = time.monotonic()
+
+    def consume(self) -> float:
+        """
+        Take a token for a received packet
+        :return: Tokens left, negative if the packet is refused
+        """
+        now = time.monotonic()
+        self.tokens = min(float(self.burst),
+                          self.tokens + (now - self.date) * self.rate) - 1
+        self.date = now
+        return self.tokens
@@ -0,0 +1,336 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+from threading import Condition, Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+from server.game_handler.clock import Clock, SimulatedClock
+from server.game_handler.game import Game, GameState
+
+log = logging.getLogger(__name__)
+
+
+class GameScheduler:
+    """
+    Single scheduler driving every game of the game_engine worker.
+
+    A game is only ticked when a packet is added to its queue (wake()) or
+    when its next deadline (state timeout, auction timeout or heartbeat)
+    has expired. Idle games do not cost anything.
+
+    Driven by its own thread (start()) or by a task of the event loop of
+    the async game_engine worker (start_async()).
+    """
+    games: Dict[str, Game]
+    # heap of (date, sequence, game uid)
+    heap: List[Tuple[datetime, int, str]]
+    # date of the valid heap entry for each scheduled game
+    deadlines: Dict[str, datetime]
+    # jobs: [next date, interval (seconds, None => once), callback]
+    jobs: List[list]
+    thread: Optional[Thread]
+    # start_async(): task driving the games, set when woken up
+    task: Optional[asyncio.Task]
+    loop: Optional[asyncio.AbstractEventLoop]
+    event: Optional[asyncio.Event]
+    # shared with the games of the engine
+    clock: Clock
+
+    def __init__(self, clock: Clock = None):
+        self.clock = Clock() if clock is None else clock
+        self.games = {}
+        self.heap = []
+        self.deadlines = {}
+        self.sequence = itertools.count()
+        self.condition = Condition()
+        self.jobs = []
+        self.thread = None
+        self.task = None
+        self.loop = None
+        self.event = None
+
+    def start(self):
+        """
+        Start scheduler thread (only once)
+        """
+        if self.thread is not None:
+            return
+
+        self.thread = Thread(target=self.run, daemon=True,
+                             name="GameScheduler")
+        self.thread.start()
+
+    def start_async(self) -> asyncio.Task:
+        """
+        Drive the games from the running event loop (only once)
+        """
+        if self.task is not None:
+            return self.task
+
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.task = self.loop.create_task(self.run_async())
+        return self.task
+
+    def notify(self):
+        """
+        Wake the scheduler up (condition lock held), from any thread
+        """
+        self.condition.notify()
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def add_game(self, game: Game):
+        """
+        Add a game to the scheduler, game is ticked as soon as possible
+        :param game: Started game
+        """
+        with self.condition:
+            self.games[game.uid] = game
+        self.wake(game)
+
+    def remove_game(self, game: Game):
+        with self.condition:
+            self.games.pop(game.uid, None)
+            self.deadlines.pop(game.uid, None)
+
+    def add_job(self, interval: float, callback: Callable):
+        """
+        Execute a callback every interval seconds (in the scheduler thread)
+        :param interval: Seconds between two executions
+        :param callback: Function without arguments
+        """
+        with self.condition:
+            self.jobs.append([self.clock.now() + timedelta(seconds=interval),
+                              interval, callback])
+            self.notify()
+
+    def call_later(self, delay: float, callback: Callable):
+        """
+        Execute a callback once, in delay seconds (in the scheduler thread)
+        :param delay: Seconds before the execution
+        :param callback: Function without arguments
+        """
+        with self.condition:
+            self.jobs.append([self.clock.now() + timedelta(seconds=delay),
+                              None, callback])
+            self.notify()
+
+    def wake(self, game: Game):
+        """
+        Tick game as soon as possible (packet received, state changed)
+        """
+        self.schedule(game, self.clock.now())
+
+    def schedule(self, game: Game, date: datetime):
+        """
+        Schedule next tick of a game, an earlier tick is never postponed
+        :param game: Game to tick
+        :param date: Date of the tick
+        """
+        with self.condition:
+            if game.uid not in self.games:
+                return
+
+            current = self.deadlines.get(game.uid)
+
+            if current is not None and current <= date:
+                return
+
+            self.deadlines[game.uid] = date
+            heapq.heappush(self.heap, (date, next(self.sequence), game.uid))
+            self.notify()
+
+    def pop_due_games(self, now: datetime) -> List[Game]:
+        """
+        :param now: Current date
+        :return: Games that should be ticked
+        """
+        due = []
+
+        with self.condition:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                date, _, uid = heapq.heappop(self.heap)
+
+                # Entry was replaced by an earlier one, or game removed
+                if self.deadlines.get(uid) != date:
+                    continue
+
+                del self.deadlines[uid]
+                due.append(self.games[uid])
+
+        return due
+
+    def get_wait_seconds(self) -> Optional[float]:
+        """
+        :return: Seconds before next scheduled tick, None if nothing planned
+        """
+        with self.condition:
+            dates = [job[0] for job in self.jobs]
+            if len(self.heap) > 0:
+                dates.append(self.heap[0][0])
+            if len(dates) == 0:
+                return None
+            return (min(dates) - self.clock.now()).total_seconds()
+
+    def run_jobs(self, now: datetime):
+        """
+        Execute periodic jobs whose date has expired
+        :param now: Current date
+        """
+        with self.condition:
+            due = [job for job in self.jobs if job[0] <= now]
+            for job in due:
+                if job[1] is None:
+                    self.jobs.remove(job)
+                else:
+                    job[0] = now + timedelta(seconds=job[1])
+
+        for _, _, callback in due:
+            try:
+                callback()
+            except Exception:
+                log.exception("Scheduler job %r failed", callback)
+
+    def run_pending(self, now: datetime = None) -> int:
+        """
+        Tick every game whose deadline has expired
+        :param now: Current date (default: clock.now())
+        :return: Number of ticked games
+        """
+        now = self.clock.now() if now is None else now
+        due = self.pop_due_games(now)
+
+        for game in due:
+            self.run_game(game)
+
+        self.run_jobs(now)
+
+        return len(due)
+
+    async def run_pending_async(self, now: datetime = None) -> int:
+        """
+        run_pending() from the event loop
+        :param now: Current date (default: clock.now())
+        :return: Number of ticked games
+        """
+        now = self.clock.now() if now is None else now
+        due = self.pop_due_games(now)
+
+        for game in due:
+            await self.run_game_async(game)
+
+        self.run_jobs(now)
+
+        return len(due)
+
+    def run_game(self, game: Game):
+        """
+        Tick a game and plan its next tick
+        """
+        self.tick_game(game)
+
+        # Packets produced during the tick are sent at once
+        try:
+            game.flush_packets()
+        except Exception:
+            log.exception("Packets of game %s could not be sent", game.uid,
+                          extra={'game': game.uid})
+
+        self.plan_game(game)
+
+    async def run_game_async(self, game: Game):
+        """
+        run_game() from the event loop, packets are sent without leaving it
+        """
+        self.tick_game(game)
+
+        try:
+            await game.flush_packets_async()
+        except Exception:
+            log.exception("Packets of game %s could not be sent", game.uid,
+                          extra={'game': game.uid})
+
+        self.plan_game(game)
+
+    def tick_game(self, game: Game):
+        if game.state is GameState.STOP_THREAD:
+            return
+
+        try:
+            game.tick()
+        except Exception:
+            # One broken game should not stop all the others
+            log.exception("Tick of game %s failed", game.uid,
+                          extra={'game': game.uid})
+
+    def plan_game(self, game: Game):
+        """
+        Remove a stopped game or schedule its next deadline
+        """
+        if game.state is GameState.STOP_THREAD:
+            self.remove_game(game)
+            game.proceed_stop()
+            return
+
+        deadline = game.next_deadline()
+
+        # Nothing to do until a packet is received
+        if deadline is None:
+            return
+
+        # Never tick a game more often than TICK_RATE
+        earliest = self.clock.now() + timedelta(seconds=game.tick_duration)
+        self.schedule(game, max(deadline, earliest))
+
+    def run_simulation(self, until: datetime) -> int:
+        """
+        Run the games without waiting, the clock jumps straight to the next
+        deadline (benchmark, tests)
+        :param until: Date where the simulation stops
+        :return: Number of ticked games
+        """
+        if not isinstance(self.clock, SimulatedClock):
+            raise ValueError("run_simulation() needs a SimulatedClock")
+
+        ticks = 0
+
+        while True:
+            wait = self.get_wait_seconds()
+
+            if wait is None or self.clock.now() + timedelta(
+                    seconds=max(0.0, wait)) > until:
+                break
+
+            self.clock.advance(wait)
+            ticks += self.run_pending()
+
+        return ticks
+
+    def run(self):
+        while True:
+            with self.condition:
+                wait = self.get_wait_seconds()
+                # Sleep until next deadline or until a game is woken up
+                if wait is None or wait > 0:
+                    self.condition.wait(timeout=wait)
+
+            self.run_pending()
+
+    async def run_async(self):
+        while True:
+            wait = self.get_wait_seconds()
+
+            # Sleep until next deadline or until a game is woken up
+            if wait is None or wait > 0:
+                try:
+                    await asyncio.wait_for(self.event.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            # Games woken up from now on are ticked by the next loop
+            self.event.clear()
+            await self.run_pending_async()
@@ -0,0 +1,227 @@
+import logging
+import uuid
+from queue import Queue
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Channel used when sharding is disabled (ENGINE_SHARDS = 1)
+ENGINE_CHANNEL = 'game_engine'
+
+# Shard handling friends notifications (only one shard should send them)
+FRIENDS_SHARD = 0
+
+# Seconds before a shard that stopped publishing its load (or its players)
+# is ignored
+SHARD_LOAD_TIMEOUT = 60
+
+log = logging.getLogger(__name__)
+
+
+def get_shards_count() -> int:
+    """
+    :return: Number of game_engine workers (ENGINE_SHARDS setting)
+    """
+    return max(1, getattr(settings, "ENGINE_SHARDS", 1))
+
+
+def get_shard_channel(shard: int) -> str:
+    """
+    :param shard: Shard index
+    :return: Channel name of the game_engine worker owning this shard
+    """
+    if get_shards_count() == 1:
+        return ENGINE_CHANNEL
+
+    return '%s_%d' % (ENGINE_CHANNEL, shard)
+
+
+def get_all_channels() -> List[str]:
+    """
+    :return: Channel names of every game_engine worker
+    """
+    return [get_shard_channel(shard) for shard in range(get_shards_count())]
+
+
+def get_game_shard(game_token: str) -> int:
+    """
+    Games are distributed by their UUID, every consumer is able to find
+    the shard of a game without any lookup.
+
+    :param game_token: UUID of the game
+    :return: Shard index owning the game (0 if game token is invalid)
+    """
+    if get_shards_count() == 1 or not game_token:
+        return 0
+
+    try:
+        return uuid.UUID(game_token).int % get_shards_count()
+    except ValueError:
+        return 0
+
+
+def get_game_channel(game_token: str) -> str:
+    """
+    :param game_token: UUID of the game
+    :return: Channel name of the game_engine worker owning the game
+    """
+    return get_shard_channel(get_game_shard(game_token))
+
+
+def generate_game_uid(shard: int) -> str:
+    """
+    Generate a game UUID owned by a shard
+
+    :param shard: Shard index
+    :return: UUID (str)
+    """
+    while True:
+        uid = uuid.uuid4()
+        if uid.int % get_shards_count() == shard:
+            return str(uid)
+
+
+def publish_shard_load(shard: int, nb_games: int):
+    """
+    Publish number of games of a shard (used to route CreateGame)
+
+    :param shard: Shard index
+    :param nb_games: Number of games owned by the shard
+    """
+    if get_shards_count() == 1:
+        return
+
+    cache.set('game_engine_load_%d' % shard, nb_games,
+              timeout=SHARD_LOAD_TIMEOUT)
+
+
+def get_least_loaded_shard() -> int:
+    """
+    :return: Shard index with the lowest number of games
+    """
+    count = get_shards_count()
+
+    if count == 1:
+        return 0
+
+    keys = ['game_engine_load_%d' % shard for shard in range(count)]
+    loads = cache.get_many(keys)
+    # Shards that did not publish for SHARD_LOAD_TIMEOUT (stopped or not
+    # started yet) are ignored
+    published = [shard for shard in range(count) if keys[shard] in loads]
+
+    if len(published) == 0:
+        return 0
+
+    return min(published, key=lambda shard: loads[keys[shard]])
+
+
+def get_player_key(player_token: str) -> str:
+    return 'game_engine_player_%s' % player_token
+
+
+def get_player_game(player_token: str) -> Optional[str]:
+    """
+    Game of a player on any shard (blocking: database pool thread)
+
+    :param player_token: Player token
+    :return: Game uid, None if the player is not in a game
+    """
+    if get_shards_count() == 1:
+        return None
+
+    return cache.get(get_player_key(player_token))
+
+
+class PlayerRegistry:
+    """
+    Games of the real players of a shard, published to the cache so that a
+    player cannot be in games of two shards (see Engine.create_game()).
+
+    Writes are queued by the ticks and done in order by a writer thread:
+    the cache is never used by the event loop. Entries expire after
+    SHARD_LOAD_TIMEOUT, they are republished with the load of the shard
+    (refresh()): players of a stopped shard are released.
+    """
+    # lists of (player token, game uid, joined => True, left => False)
+    queue: Queue
+    thread: Optional[Thread]
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return get_shards_count() > 1
+
+    def set_player(self, player_token: str, game_uid: str, joined: bool):
+        """
+        :param player_token: Real player (bots are not published)
+        :param game_uid: Game joined or left by the player
+        :param joined: Player joined the game, False => left it
+        """
+        if self.enabled:
+            self.put([(player_token, game_uid, joined)])
+
+    def refresh(self, players: Dict[str, str]):
+        """
+        Republish every player of the shard before the entries expire
+        :param players: Player token => game uid
+        """
+        if self.enabled and len(players) > 0:
+            self.put([(token, uid, True) for token, uid in players.items()])
+
+    def put(self, changes: List[Tuple[str, str, bool]]):
+        if self.thread is None:
+            self.thread = Thread(target=self.run, daemon=True,
+                                 name="PlayerRegistry")
+            self.thread.start()
+
+        self.queue.put(changes)
+
+    def write(self, changes: List[Tuple[str, str, bool]]):
+        """
+        Write changes to the cache (writer thread)
+        """
+        joined = {}
+        left = {}
+
+        for token, uid, is_joined in changes:
+            key = get_player_key(token)
+
+            if is_joined:
+                joined[key] = uid
+                left.pop(key, None)
+            else:
+                left[key] = uid
+                joined.pop(key, None)
+
+        if len(joined) > 0:
+            cache.set_many(joined, timeout=SHARD_LOAD_TIMEOUT)
+
+        if len(left) > 0:
+            # the player may already be in a game of another shard
+            current = cache.get_many(list(left))
+            cache.delete_many([key for key, uid in current.items()
+                               if left[key] == uid])
+
+    def wait(self):
+        """
+        Block until every queued write is done
+        """
+        self.queue.join()
+
+    def run(self):
+        while True:
+            changes = self.queue.get()
+
+            try:
+                self.write(changes)
+            except Exception:
+                # Next writes may succeed (cache unavailable)
+                log.exception("Players of the shard could not be published")
+            finally:
+                self.queue.task_done()
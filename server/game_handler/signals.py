@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from server.game_handler.middlewares import users_cache
+from server.game_handler.models import User, UserFriend
+from server.game_handler.presence import friends_cache, profiles_cache
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance: User, **kwargs):
+    """
+    Handshakes and friends notifications read the saved user from the
+    database again
+    """
+    users_cache.delete(str(instance.id))
+    profiles_cache.delete(str(instance.id))
+
+
+@receiver(post_save, sender=UserFriend)
+@receiver(post_delete, sender=UserFriend)
+def invalidate_friends(sender, instance: UserFriend, **kwargs):
+    """
+    Friends lists of both players are loaded again
+    """
+    friends_cache.delete(str(instance.user_id))
+    friends_cache.delete(str(instance.friend_id))
@@ -0,0 +1,495 @@
+import itertools
+import logging
+import pickle
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from queue import Queue
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from server.game_handler.clock import Clock
+from server.game_handler.data import Board
+from server.game_handler.data.auction import Auction
+from server.game_handler.data.exchange import Exchange, ExchangeState
+from server.game_handler.data.state import BoardState
+from server.game_handler.game import Game, GameState
+
+log = logging.getLogger(__name__)
+
+# Seconds before the snapshots of a game that is not saved anymore expire
+SNAPSHOT_TIMEOUT = 24 * 3600
+
+
+@dataclass(frozen=True)
+class AuctionRecord:
+    """
+    Copy of the running auction (players are indexes of board.players,
+    -1 if none)
+    """
+    square: int
+    highest_bid: int
+    highest_bidder: int
+    timeout: Optional[datetime]
+    tour_duration: int
+    tour_remaining_seconds: int
+
+
+@dataclass(frozen=True)
+class ExchangeRecord:
+    """
+    Copy of the running exchange (players are indexes of board.players,
+    -1 if none, squares are square ids and cards are indexes of the chance
+    deck followed by the community deck)
+    """
+    player: int
+    selected_player: int
+    player_squares: Tuple[int, ...]
+    player_cards: Tuple[int, ...]
+    player_money: int
+    selected_player_squares: Tuple[int, ...]
+    selected_player_cards: Tuple[int, ...]
+    selected_player_money: int
+    state: ExchangeState
+    timeout: Optional[datetime]
+
+
+@dataclass
+class GameDelta:
+    """
+    Mutable state of a game that is not part of its BoardState.
+    A delta is only valid with the base it was taken from.
+    """
+    # version of the base
+    base: int
+    state: GameState
+    timeout: datetime
+    turn_counter: int
+    board: BoardState
+    # available flag of every card (chance deck, then community deck)
+    cards: Tuple[bool, ...]
+    # (bankrupt date, dices) of every player
+    players: Tuple[Tuple[Optional[datetime], Tuple[int, int]], ...]
+    round_auction_done: bool
+    property_list: Tuple[int, ...]
+    auction: Optional[AuctionRecord]
+    exchange: Optional[ExchangeRecord]
+    # capture date, ignored by comparisons
+    date: datetime = field(compare=False)
+
+
+@dataclass
+class GameBase:
+    """
+    Full copy of a game (board with its players, squares and cards) and
+    its delta at the time of the copy
+    """
+    version: int
+    uid: str
+    public_name: str
+    # token of the host player
+    host: Optional[str]
+    start_date: datetime
+    board: Board
+    delta: GameDelta
+
+
+@dataclass
+class SavedGame:
+    version: int
+    # tokens of the players of the base
+    tokens: Tuple[str, ...]
+    delta: GameDelta
+
+
+def get_index_key(shard: int) -> str:
+    return 'game_snapshots_%d' % shard
+
+
+def get_base_key(uid: str) -> str:
+    return 'game_snapshot_base_%s' % uid
+
+
+def get_delta_key(uid: str) -> str:
+    return 'game_snapshot_delta_%s' % uid
+
+
+def get_player_idx(board: Board, player) -> int:
+    return -1 if player is None else board.get_player_idx(player)
+
+
+def get_card_indexes(board: Board, cards) -> Tuple[int, ...]:
+    deck = list(itertools.chain(board.chance_deck, board.community_deck))
+    return tuple(next(i for i, card in enumerate(deck) if card is selected)
+                 for selected in cards)
+
+
+def get_auction_record(board: Board) -> Optional[AuctionRecord]:
+    auction = board.current_auction
+
+    if auction is None:
+        return None
+
+    return AuctionRecord(
+        square=auction.square.id_,
+        highest_bid=auction.highest_bid,
+        highest_bidder=get_player_idx(board, auction.highest_bidder),
+        timeout=getattr(auction, 'timeout', None),
+        tour_duration=auction.tour_duration,
+        tour_remaining_seconds=auction.tour_remaining_seconds
+    )
+
+
+def get_exchange_record(board: Board) -> Optional[ExchangeRecord]:
+    exchange = board.current_exchange
+
+    if exchange is None:
+        return None
+
+    return ExchangeRecord(
+        player=get_player_idx(board, exchange.player),
+        selected_player=get_player_idx(board, exchange.selected_player),
+        player_squares=tuple(square.id_
+                             for square in exchange.player_squares),
+        player_cards=get_card_indexes(board, exchange.player_cards),
+        player_money=exchange.player_money,
+        selected_player_squares=tuple(
+            square.id_ for square in exchange.selected_player_squares),
+        selected_player_cards=get_card_indexes(
+            board, exchange.selected_player_cards),
+        selected_player_money=exchange.selected_player_money,
+        state=exchange.state,
+        timeout=getattr(exchange, 'timeout', None)
+    )
+
+
+def restore_auction(game: Game, record: AuctionRecord) -> Auction:
+    board = game.board
+    auction = Auction(
+        player=None if record.highest_bidder < 0 else
+        board.players[record.highest_bidder],
+        tour_duration=record.tour_duration,
+        square=board.squares[record.square],
+        clock=game.clock)
+    auction.highest_bid = record.highest_bid
+    auction.tour_remaining_seconds = record.tour_remaining_seconds
+
+    if record.timeout is not None:
+        auction.timeout = record.timeout
+
+    return auction
+
+
+def restore_exchange(game: Game, record: ExchangeRecord) -> Exchange:
+    board = game.board
+    deck = list(itertools.chain(board.chance_deck, board.community_deck))
+    exchange = Exchange(
+        player=board.players[record.player],
+        selected_player=None if record.selected_player < 0 else
+        board.players[record.selected_player],
+        clock=game.clock)
+    exchange.player_squares = [board.squares[i]
+                               for i in record.player_squares]
+    exchange.player_cards = [deck[i] for i in record.player_cards]
+    exchange.player_money = record.player_money
+    exchange.selected_player_squares = [
+        board.squares[i] for i in record.selected_player_squares]
+    exchange.selected_player_cards = [
+        deck[i] for i in record.selected_player_cards]
+    exchange.selected_player_money = record.selected_player_money
+    exchange.state = record.state
+
+    if record.timeout is not None:
+        exchange.timeout = record.timeout
+
+    return exchange
+
+
+def get_delta(game: Game, version: int) -> GameDelta:
+    """
+    :param game: Game to copy (game thread)
+    :param version: Version of the base of the game
+    :return: Delta of the game
+    """
+    board = game.board
+
+    return GameDelta(
+        base=version,
+        state=game.state,
+        timeout=game.timeout,
+        turn_counter=game.turn_counter,
+        board=BoardState.from_board(board),
+        cards=tuple(card.available for card in itertools.chain(
+            board.chance_deck, board.community_deck)),
+        players=tuple((player.bankrupt_date, player.current_dices)
+                      for player in board.players),
+        round_auction_done=board.round_auction_done,
+        property_list=tuple(board.property_list),
+        auction=get_auction_record(board),
+        exchange=get_exchange_record(board),
+        date=game.clock.now()
+    )
+
+
+def restore_game(base: GameBase, delta: Optional[GameDelta] = None,
+                 clock: Optional[Clock] = None) -> Game:
+    """
+    Rebuild a game from its snapshots. Players are disconnected, they
+    reconnect with InternalCheckPlayerValidity and AppletReady.
+
+    :param base: Last base of the game
+    :param delta: Last delta of the game (ignored if older than base)
+    :param clock: Clock of the engine (timeouts are resumed with it)
+    :return: Game (not added to an engine)
+    """
+    game = Game(uid=base.uid, clock=clock)
+    board = base.board
+    game.board = board
+    game.public_name = base.public_name
+    game.start_date = base.start_date
+    game.host_player = None if base.host is None else \
+        board.get_player(base.host)
+
+    if delta is None or delta.base != base.version:
+        delta = base.delta
+
+    delta.board.apply_to_board(board)
+    board.current_auction = None if delta.auction is None else \
+        restore_auction(game, delta.auction)
+    board.current_exchange = None if delta.exchange is None else \
+        restore_exchange(game, delta.exchange)
+
+    for card, available in zip(itertools.chain(
+            board.chance_deck, board.community_deck), delta.cards):
+        card.available = available
+
+    for player, (bankrupt_date, dices) in zip(board.players,
+                                              delta.players):
+        player.bankrupt_date = bankrupt_date
+        player.current_dices = dices
+
+    board.round_auction_done = delta.round_auction_done
+    board.property_list = list(delta.property_list)
+
+    # Timeouts are paused while the game is not running
+    shift = game.clock.now() - delta.date
+    game.state = delta.state
+    game.timeout = delta.timeout + shift
+    game.turn_counter = delta.turn_counter
+
+    for action in (board.current_auction, board.current_exchange):
+        if hasattr(action, 'timeout'):
+            action.timeout += shift
+
+    for player in board.players:
+        # Real players (bots have no user)
+        if player.user is not None:
+            player.disconnect()
+            player.channel_name = None
+
+    game.reconnect_timeout = game.clock.now() + timedelta(
+        seconds=game.CONFIG.get('WAITING_PLAYERS_TIMEOUT'))
+
+    return game
+
+
+class SnapshotStore:
+    """
+    Snapshots of the running games of a game_engine worker (shard), saved
+    to the cache so that a restarted worker can restore its games.
+
+    A base (pickled copy of the game) is saved when a game is seen for the
+    first time or when its players change. Otherwise only a delta
+    (BoardState, running auction and exchange and a few values) is taken,
+    and only if the game changed since the last snapshot: the board is only
+    pickled once per game in the scheduler thread (between ticks), deltas
+    are serialized and written by a writer thread.
+    """
+    shard: int
+    # game uid => last snapshot
+    saved: Dict[str, SavedGame]
+    # (game uid, pickled base, delta), both None => game stopped
+    queue: Queue
+    # uids of the saved games (writer thread)
+    index: set
+    thread: Optional[Thread]
+
+    def __init__(self, shard: int = 0):
+        self.shard = shard
+        self.saved = {}
+        self.queue = Queue()
+        self.index = set()
+        self.versions = itertools.count(1)
+        self.thread = None
+
+    def start(self):
+        """
+        Start writer thread (only once)
+        """
+        if self.thread is not None:
+            return
+
+        self.thread = Thread(target=self.run, daemon=True,
+                             name="SnapshotWriter")
+        self.thread.start()
+
+    def capture(self, games: List[Game]) -> int:
+        """
+        Take a snapshot of every changed game (game thread)
+        :param games: Games of the worker
+        :return: Number of queued snapshots
+        """
+        queued = 0
+        uids = set()
+
+        for game in games:
+            # Only in-flight games are saved
+            if game.state.value <= GameState.LOBBY.value:
+                continue
+
+            uids.add(game.uid)
+
+            if self.capture_game(game):
+                queued += 1
+
+        # Stopped games
+        for uid in list(self.saved):
+            if uid not in uids:
+                del self.saved[uid]
+                self.queue.put((uid, None, None))
+
+        return queued
+
+    def capture_game(self, game: Game) -> bool:
+        """
+        :param game: Game to save
+        :return: A snapshot was queued
+        """
+        board = game.board
+        tokens = tuple(player.get_id() for player in board.players)
+        saved = self.saved.get(game.uid)
+
+        if saved is not None and saved.tokens == tokens:
+            delta = get_delta(game, saved.version)
+
+            # Nothing changed
+            if delta == saved.delta:
+                return False
+
+            saved.delta = delta
+            self.queue.put((game.uid, None, delta))
+            return True
+
+        version = next(self.versions)
+        delta = get_delta(game, version)
+        host = getattr(game, 'host_player', None)
+
+        # board is modified by the next ticks, it is pickled now (only
+        # once per game and per change of players)
+        base = pickle.dumps(GameBase(
+            version=version,
+            uid=game.uid,
+            public_name=getattr(game, 'public_name', ""),
+            host=None if host is None else host.get_id(),
+            start_date=getattr(game, 'start_date', delta.date),
+            board=board,
+            delta=delta
+        ))
+
+        self.saved[game.uid] = SavedGame(version=version, tokens=tokens,
+                                         delta=delta)
+        self.queue.put((game.uid, base, None))
+        return True
+
+    def write(self, uid: str, base: Optional[bytes],
+              delta: Optional[GameDelta]):
+        """
+        Write a snapshot to the cache (writer thread)
+        :param uid: Game uid
+        :param base: Pickled GameBase
+        :param delta: Delta of the last base
+        """
+        if base is not None:
+            cache.set(get_base_key(uid), base, timeout=SNAPSHOT_TIMEOUT)
+        elif delta is not None:
+            cache.set(get_delta_key(uid), delta, timeout=SNAPSHOT_TIMEOUT)
+        else:
+            cache.delete_many([get_base_key(uid), get_delta_key(uid)])
+
+        saved = base is not None or delta is not None
+
+        if saved == (uid in self.index):
+            return
+
+        if saved:
+            self.index.add(uid)
+        else:
+            self.index.discard(uid)
+
+        cache.set(get_index_key(self.shard), sorted(self.index),
+                  timeout=SNAPSHOT_TIMEOUT)
+
+    def wait(self):
+        """
+        Block until every queued snapshot is written
+        """
+        self.queue.join()
+
+    def run(self):
+        while True:
+            snapshot = self.queue.get()
+
+            try:
+                self.write(*snapshot)
+            except Exception:
+                # Next snapshots may succeed (cache unavailable)
+                log.exception("Snapshot of game %s could not be written",
+                              snapshot[0])
+            finally:
+                self.queue.task_done()
+
+    def load(self, clock: Optional[Clock] = None) -> List[Game]:
+        """
+        Restore the games saved by this shard (before start())
+        :param clock: Clock of the engine
+        :return: Restored games
+        """
+        games = []
+
+        for uid in cache.get(get_index_key(self.shard), []):
+            values = cache.get_many([get_base_key(uid), get_delta_key(uid)])
+            base = values.get(get_base_key(uid))
+
+            if base is None:
+                continue
+
+            try:
+                game = restore_game(pickle.loads(base),
+                                    values.get(get_delta_key(uid)), clock)
+            except Exception:
+                log.exception("Game %s could not be restored", uid)
+                cache.delete_many([get_base_key(uid), get_delta_key(uid)])
+                continue
+
+            games.append(game)
+
+        self.index = {game.uid for game in games}
+        cache.set(get_index_key(self.shard), sorted(self.index),
+                  timeout=SNAPSHOT_TIMEOUT)
+
+        log.info("Restored %d games", len(games))
+        return games
+
+
+def get_snapshot_store(shard: int) -> Optional[SnapshotStore]:
+    """
+    :param shard: Shard of the engine
+    :return: Store of the shard, None if snapshots are disabled
+             (GAME_SNAPSHOTS setting)
+    """
+    if not getattr(settings, 'GAME_SNAPSHOTS', False):
+        return None
+
+    return SnapshotStore(shard)
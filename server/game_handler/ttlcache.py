@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after ttl seconds
+    """
+    # key => (expiry date (monotonic), value), least recently used first
+    entries: OrderedDict
+
+    def __init__(self, size: int, ttl: float):
+        """
+        :param size: Max number of entries (least recently used removed)
+        :param ttl: Seconds before an entry expires
+        """
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return default
+
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        """
+        :param key: Key of the entry
+        :param value: Value of the entry
+        :param ttl: Seconds before expiration (at most the cache ttl)
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+
+        if ttl <= 0 or self.size <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
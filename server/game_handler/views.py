@@ -0,0 +1,39 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+
+from server.game_handler.metrics import get_published_metrics, \
+    render_metrics
+
+
+def metrics_allowed(request) -> bool:
+    """
+    :return: True if the client may read the metrics (METRICS_ALLOWED_IPS,
+             METRICS_TOKEN or staff user)
+    """
+    if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+        return True
+
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+
+    if token != '' and hmac.compare_digest(header, 'Bearer %s' % token):
+        return True
+
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+@require_GET
+def metrics(request):
+    """
+    Metrics published by the game_engine workers (Prometheus text format)
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+
+    return HttpResponse(render_metrics(get_published_metrics()),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
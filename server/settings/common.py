@@ -2,7 +2,7 @@ import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
-from decouple import config
+from decouple import Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
@@ -76,13 +76,45 @@ AUTH_PASSWORD_VALIDATORS = [
 
 # Logging
 
+# Level of the server loggers (DEBUG logs every packet)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+# text or json (one JSON object per line)
+LOG_FORMAT = config('LOG_FORMAT', default='text')
+# Only 1 out of LOG_SAMPLING_RATE debug records of each event is written
+LOG_SAMPLING_RATE = config('LOG_SAMPLING_RATE', default=1, cast=int)
+
+# Access to the /metrics view: clients with these addresses, or with the
+# header "Authorization: Bearer <METRICS_TOKEN>" ('' => no token), or staff
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1',
+                             cast=Csv())
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'server.game_handler.logs.SamplingFilter',
+            'rate': LOG_SAMPLING_RATE,
+        },
+    },
+    'formatters': {
+        'text': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+        'json': {
+            '()': 'server.game_handler.logs.JsonFormatter',
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'server': {
+            'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['sampling'],
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -99,7 +131,12 @@ LOGGING = {
                 'console',
             ],
             'level': 'DEBUG'
-        }
+        },
+        'server': {
+            'handlers': ['server'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
     },
 }
 
@@ -129,6 +166,20 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 JWT_KEY = config('JWT_TOKEN',
                  default='@xxw!3fx@wjfi+%t-#m5^m4n&r#(-gz$nz2o24tij%9a&w')
 
+# WebSocket handshakes: decoded tokens and users kept in memory (seconds,
+# max entries per process), 0 => disabled. Users are written by the
+# external API (not invalidated by signals.py): a renamed user or a new
+# avatar is seen at most AUTH_CACHE_TTL seconds later
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', default=20, cast=int)
+AUTH_CACHE_SIZE = config('AUTH_CACHE_SIZE', default=10000, cast=int)
+
+# Friends of the players connected to the lobby and their profiles, kept
+# in memory by the FRIENDS_SHARD worker (seconds, max entries). Friends are
+# written by the external API (not invalidated by signals.py): they are
+# reloaded on every lobby connection, the cache only serves disconnections
+PRESENCE_CACHE_TTL = config('PRESENCE_CACHE_TTL', default=60, cast=int)
+PRESENCE_CACHE_SIZE = config('PRESENCE_CACHE_SIZE', default=10000, cast=int)
+
 # django channels layers
 
 REDIS_HOST = config('REDIS_HOST', default='127.0.0.1')
@@ -150,10 +201,39 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Run the game_engine workers inside the ASGI server process (single-node
+# deployments): consumers and games exchange messages in memory, other
+# processes are reached through Redis (CHANNEL_LAYER_FALLBACK)
+ENGINE_IN_PROCESS = config('ENGINE_IN_PROCESS', default=False, cast=bool)
+
+if ENGINE_IN_PROCESS:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'server.game_handler.layers.LocalChannelLayer',
+            'CONFIG': {
+                'fallback': CHANNEL_LAYERS['default'] if config(
+                    'CHANNEL_LAYER_FALLBACK', default=True, cast=bool)
+                else None,
+            },
+        },
+    }
+
+# Number of game_engine workers, games are distributed by their uuid
+# 1 => single worker listening on 'game_engine'
+# N => one worker per channel 'game_engine_0' ... 'game_engine_N-1'
+ENGINE_SHARDS = config('ENGINE_SHARDS', default=1, cast=int)
+
+# Save running games to the cache, a restarted worker restores its games
+GAME_SNAPSHOTS = config('GAME_SNAPSHOTS', default=False, cast=bool)
+
+# Directory of the games journals (replay_game command), '' => disabled
+GAME_JOURNAL_DIR = config('GAME_JOURNAL_DIR', default='')
+
 # If server is localhost then SERVER_OFFLINE should be True
 SERVER_OFFLINE = config('SERVER_OFFLINE', default=False, cast=bool)
 
 ENGINE_CONFIG = {
+    # Max ticks per second of a game (games are only ticked when needed)
     'TICK_RATE': 20,
 
     # In seconds
@@ -168,9 +248,47 @@ ENGINE_CONFIG = {
     'AUCTION_TOUR_WAIT': 10,
     'GAME_WIN_WAIT': 10,
     'GAME_END_WAIT': 4,
+    # Random wait of bots before their dice choice
+    'BOT_DICE_CHOICE_WAIT_MIN': 5,
+    'BOT_DICE_CHOICE_WAIT_MAX': 15,
+
+    # Processes computing the bots decisions (0: in the game thread)
+    'BOT_WORKERS': 1,
+    # Per bot level (bot_difficulty): CPU seconds per decision,
+    # max rollouts per candidate action, rounds simulated per rollout
+    'BOT_LEVELS': [
+        {'budget': 0.02, 'rollouts': 8, 'rounds': 4},
+        {'budget': 0.05, 'rollouts': 24, 'rounds': 8},
+        {'budget': 0.15, 'rollouts': 64, 'rounds': 12},
+    ],
+
+    # Outcome estimator (estimator.py): simulated games, default rounds
+    'ESTIMATOR_SAMPLES': 1000,
+    'ESTIMATOR_ROUNDS': 20,
 
     'PING_HEARTBEAT_TIMEOUT': 10,
 
+    # Seconds between two publications of the worker metrics (0: disabled)
+    'METRICS_PUBLISH_INTERVAL': 15,
+
+    # Seconds between two snapshots of the games (GAME_SNAPSHOTS)
+    'SNAPSHOT_INTERVAL': 5,
+
+    # Seconds between two broadcasts of the changed lobby rooms, merged in
+    # one packet (0: one packet per change)
+    'LOBBY_BROADCAST_INTERVAL': 0.25,
+
+    # Max pending packets of a game (more are dropped)
+    'PACKETS_QUEUE_SIZE': 128,
+    # Packets per second allowed per player connection, and burst size
+    # (a player in debt of more than a burst is disconnected, code 4002)
+    'PLAYER_PACKETS_RATE': 10,
+    'PLAYER_PACKETS_BURST': 20,
+
+    # Threads executing the database queries of the async game_engine
+    # worker (at least 2: a lobby packet and a game query at the same time)
+    'DATABASE_WORKERS': 4,
+
     'MONEY_START_MIN': 500,
     'MONEY_START_DEFAULT': 1000,
     'MONEY_START_MAX': 4000,
@@ -196,7 +314,8 @@ ENGINE_CONFIG = {
     'MAX_DOUBLES_JAIL': 3,
     'MAX_JAIL_TURNS': 3,
     'JAIL_LEAVE_PRICE': 50,
-    'MAX_NUMBER_OF_GAMES': 10,
+    # 0 => unlimited
+    'MAX_NUMBER_OF_GAMES': 0,
 
     'BANK_HOUSES_COUNT': 32,
     'BANK_HOTELS_COUNT': 12
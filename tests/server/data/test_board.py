@@ -332,6 +332,27 @@ class TestPacket(TestCase):
         assert board.get_player_idx(player3) == 2
         assert board.get_player_idx(player4) == -1
 
+    def test_remove_player(self):
+        board = self.create_board()
+        player1, player2, player3 = create_players()
+        board.add_player(player1)
+        board.add_player(player2)
+        board.add_player(player3)
+
+        board.remove_player(player1)
+
+        assert not board.player_exists(player1.get_id())
+        assert board.get_player(player1.get_id()) is None
+        assert board.players == [player2, player3]
+        assert board.get_player_idx(player2) == 0
+        assert board.get_player_idx(player3) == 1
+        assert board.get_player_idx(player1) == -1
+
+        # added again, at the end
+        board.add_player(player1)
+        assert board.get_player_idx(player1) == 2
+        assert board.get_player(player1.get_id()) is player1
+
     def test_get_ownable_squares(self):
         board = self.create_board()
         assert len(board.get_ownable_squares()) == 28
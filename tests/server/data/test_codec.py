@@ -0,0 +1,57 @@
+import json
+from unittest import TestCase
+
+from server.game_handler.data import codec
+from server.game_handler.data.packets import PacketUtils, StatusRoom, \
+    GameStartDiceResults, PlayerMove, CreateGame, \
+    ActionExchangeTradeSelect, BroadcastUpdateRoom
+
+
+class TestCodec(TestCase):
+
+    def test_byte_identical(self):
+        for name, packet_class in PacketUtils.packets.items():
+            packet = packet_class()
+            assert packet.serialize() == codec.legacy_serialize(packet), name
+
+        status = StatusRoom(game_token="é\"\n", nb_players=3,
+                            players_data=[{"b": 1, "a": "ü"}],
+                            option_auction=True)
+        dice = GameStartDiceResults()
+        dice.add_dice_result("token", 1, 2, True)
+        # field with an unexpected type
+        update = BroadcastUpdateRoom()
+        update.player = None
+        # attribute added after construction
+        move = PlayerMove(player_token="a", destination=12)
+        move.extra = 4.5
+
+        for packet in (status, dice, update, move):
+            assert packet.serialize() == codec.legacy_serialize(packet)
+
+    def test_deserialize(self):
+        for name, packet_class in PacketUtils.packets.items():
+            packet = PacketUtils.deserialize_packet(
+                json.loads(packet_class().serialize()))
+            assert isinstance(packet, packet_class), name
+
+        packet = PacketUtils.deserialize_packet({
+            "name": "CreateGame",
+            "max_nb_players": "8",
+            "option_auction": 1,
+            "option_max_time": 60,
+            "starting_balance": "invalid"
+        })
+        assert isinstance(packet, CreateGame)
+        assert packet.max_nb_players == 8
+        assert packet.option_auction is True
+        assert packet.option_max_time == 60
+        assert packet.starting_balance == 0
+        assert packet.game_name == ""
+
+        packet = PacketUtils.deserialize_packet({
+            "name": "ActionExchangeTradeSelect",
+            "exchange_type": 12
+        })
+        assert isinstance(packet, ActionExchangeTradeSelect)
+        assert packet.exchange_type == 0
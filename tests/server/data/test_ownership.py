@@ -0,0 +1,105 @@
+import copy
+import random
+from unittest import TestCase
+
+from server.game_handler.data import Board, Player
+from server.game_handler.data.squares import PropertySquare, \
+    StationSquare, CompanySquare
+from server.game_handler.engine import Engine
+from server.game_handler.models import User
+
+
+class TestOwnership(TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        self.board = Board()
+        # squares are copied, like in Engine.add_game
+        self.board.load_data(
+            squares=[copy.copy(square) for square in self.engine.squares],
+            chance_deck=[],
+            community_deck=[]
+        )
+        self.players = [
+            Player(bot=False, user=User(id="283e1f5e-3411-44c5-9bc5-"
+                                           "037358c47100")),
+            Player(bot=False, user=User(id="153e1f5e-3411-32c5-9bc5-"
+                                           "037358c47100")),
+        ]
+
+    def check_counters(self, player: Player):
+        """
+        Compare index with a full scan of the board
+        """
+        owned = [square for square in self.board.squares
+                 if isinstance(square, (PropertySquare, StationSquare,
+                                        CompanySquare))
+                 and square.owner == player]
+        ownership = self.board.ownership.get(player)
+
+        assert ownership.squares == len(owned)
+        assert ownership.unmortgaged_stations == len(
+            [a for a in owned if isinstance(a, StationSquare)
+             and not a.mortgaged])
+        assert ownership.unmortgaged_companies == len(
+            [a for a in owned if isinstance(a, CompanySquare)
+             and not a.mortgaged])
+
+        houses = sum(a.nb_house for a in owned
+                     if isinstance(a, PropertySquare) and not a.has_hotel())
+        hotels = len([a for a in owned
+                      if isinstance(a, PropertySquare) and a.has_hotel()])
+        assert self.board.get_player_buildings_count(player) == \
+            (houses, hotels)
+
+        score = player.get_score() + sum(
+            a.rent_base + (a.nb_house * a.house_price
+                           if isinstance(a, PropertySquare) else 0)
+            for a in owned)
+        assert self.board.get_score(player) == score
+
+        for color in self.board.total_properties_color_squares:
+            group = [a for a in owned if isinstance(a, PropertySquare)
+                     and a.color == color]
+            assert self.board.has_property_group(color, player=player) == \
+                (len(group) ==
+                 self.board.total_properties_color_squares[color])
+            assert self.board.get_house_count_by_owned_group(
+                color, player=player) == sum(a.nb_house for a in group)
+
+    def test_random_changes(self):
+        random.seed(3)
+        ownables = self.board.get_ownable_squares()
+
+        for _ in range(500):
+            square = random.choice(ownables)
+            change = random.randint(0, 2)
+
+            if change == 0:
+                square.owner = random.choice(self.players + [None])
+            elif change == 1:
+                square.mortgaged = not square.mortgaged
+            elif isinstance(square, PropertySquare):
+                square.nb_house = random.randint(0, 5)
+
+            for player in self.players:
+                self.check_counters(player)
+
+    def test_rent(self):
+        player = self.players[0]
+        stations = [a for a in self.board.get_ownable_squares()
+                    if isinstance(a, StationSquare)]
+
+        stations[0].owner = player
+        assert self.board.get_rent(stations[0]) == stations[0].rent_base
+
+        stations[1].owner = player
+        assert self.board.get_rent(stations[0]) == 2 * stations[0].rent_base
+
+        stations[1].mortgaged = True
+        assert self.board.get_rent(stations[0]) == stations[0].rent_base
+
+        # Bankruptcy: squares go back to the bank
+        for square in self.board.get_owned_squares(player):
+            square.owner = None
+        assert self.board.ownership.get(player).squares == 0
@@ -8,6 +8,7 @@ from server.game_handler.data.packets import PacketUtils, ActionBuyHouse, \
     PlayerReconnect, GameStartDice, GameStartDiceThrow, RoundStart, \
     RoundDiceChoice, RoundDiceResults, PlayerMove, RoundRandomCard, \
     PlayerUpdateBalance, PlayerEnterPrison, PlayerExitPrison
+from server.game_handler.data.exceptions import PacketException
 
 
 class TestPacket(TestCase):
@@ -412,3 +413,44 @@ class TestPacket(TestCase):
         assert isinstance(packet, PlayerExitPrison)
         assert packet.name == 'PlayerExitPrison'
         assert packet.player_token == '23b3a6c7-6990-44b1-b466-8f8c3da5ec7d'
+
+    def test_compact_format(self):
+        packet = PlayerMove(player_token="token", destination=12,
+                            instant=True)
+        frame = PacketUtils.to_compact(json.loads(packet.serialize()))
+
+        # [id, destination, instant, player_token]
+        assert frame == [PacketUtils.packet_ids["PlayerMove"], 12, True,
+                         "token"]
+
+        obj = PacketUtils.from_compact(frame)
+        assert obj == json.loads(packet.serialize())
+
+        # ids are positions in packets dict
+        assert PacketUtils.packet_ids["Exception"] == 0
+        assert PacketUtils.from_compact([0, 4100]) == {
+            "name": "Exception",
+            "code": 4100
+        }
+
+    def test_frame(self):
+        class Piece:
+            def __init__(self):
+                self.id = 3
+                self.color = "red"
+
+        packets = [packet_class() for packet_class
+                   in PacketUtils.packets.values()]
+        packets.append(GameStart(game_name="game", options={"a": 1},
+                                 players=[{"piece": Piece()}],
+                                 timeouts={"b": (1, 2)}))
+
+        # same frame as the JSON round trip, without decoding
+        for packet in packets:
+            assert PacketUtils.to_frame(packet) == PacketUtils.to_compact(
+                json.loads(packet.serialize())), packet.name
+
+    def test_compact_format_invalid(self):
+        for frame in ([], {}, [-1], [len(PacketUtils.packets)], ["Ping"]):
+            with self.assertRaises(PacketException):
+                PacketUtils.from_compact(frame)
@@ -0,0 +1,125 @@
+import copy
+import random
+from unittest import TestCase
+
+from server.game_handler.data import Board, Player
+from server.game_handler.data.ownership import OwnershipIndex
+from server.game_handler.data.squares import PropertySquare
+from server.game_handler.data.state import BoardState
+from server.game_handler.engine import Engine
+from server.game_handler.models import User
+
+
+class TestBoardState(TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        self.board = Board()
+        self.board.load_data(
+            squares=[copy.copy(square) for square in self.engine.squares],
+            chance_deck=[],
+            community_deck=[]
+        )
+        self.players = [
+            Player(bot=False, user=User(id="283e1f5e-3411-44c5-9bc5-"
+                                           "037358c47100")),
+            Player(bot=False, user=User(id="153e1f5e-3411-32c5-9bc5-"
+                                           "037358c47100")),
+            Player(bot=True, bot_name="bot"),
+        ]
+        for player in self.players:
+            self.board.add_player(player)
+            player.money = 1000
+
+    def mutate(self, rng: random.Random):
+        board = self.board
+
+        for i in board.topology.ownable_indexes:
+            square = board.squares[i]
+            square.owner = rng.choice(self.players + [None])
+            square.mortgaged = rng.random() < 0.3
+            if isinstance(square, PropertySquare):
+                square.nb_house = rng.randint(0, 5)
+
+        for player in self.players:
+            player.money = rng.randint(-500, 5000)
+            player.position = rng.randrange(len(board.squares))
+            player.in_jail = rng.random() < 0.5
+            player.jail_turns = rng.randint(0, 3)
+            player.doubles = rng.randint(0, 2)
+            player.bankrupt = rng.random() < 0.2
+            player.jail_cards['chance'] = rng.random() < 0.5
+            player.jail_cards['community'] = rng.random() < 0.5
+            for _ in range(rng.randint(0, 2)):
+                player.add_debt(creditor=rng.choice(self.players + [None]),
+                                amount=rng.randint(1, 300), reason="test")
+
+        board.board_money = rng.randint(0, 1000)
+        board.current_player_index = rng.randrange(len(self.players))
+        board.current_round = rng.randint(0, 20)
+        board.bank.nb_house = rng.randint(0, 32)
+
+    def test_round_trip(self):
+        rng = random.Random(1)
+
+        for _ in range(20):
+            self.mutate(rng)
+            state = BoardState.from_board(self.board)
+            snapshot = state.copy()
+            assert snapshot == state
+
+            self.mutate(rng)
+            assert BoardState.from_board(self.board) != state
+
+            # Board is restored to the snapshot
+            snapshot.apply_to_board(self.board)
+            assert BoardState.from_board(self.board) == state
+            # snapshot was not modified by apply_to_board
+            assert snapshot == state
+
+    def test_restore(self):
+        square = self.board.squares[1]
+        square.owner = self.players[0]
+        self.players[1].add_debt(creditor=self.players[0], amount=50)
+        state = BoardState.from_board(self.board)
+
+        square.owner = self.players[2]
+        square.nb_house = 3
+        self.players[0].money = 0
+        self.players[0].jail_cards['chance'] = True
+        self.players[1].debts.clear()
+
+        state.apply_to_board(self.board)
+
+        assert square.owner is self.players[0]
+        assert square.nb_house == 0
+        assert self.players[0].money == 1000
+        assert not self.players[0].jail_cards['chance']
+        assert self.players[1].get_total_debts() == 50
+        assert self.players[1].debts[0].creditor is self.players[0]
+
+    def test_ownership_index(self):
+        rng = random.Random(2)
+        state = BoardState.from_board(self.board)
+
+        for _ in range(10):
+            self.mutate(rng)
+            state.apply_to_board(self.board)
+            state = BoardState.from_board(self.board)
+
+            # Incremental updates equal a rebuilt index
+            index = OwnershipIndex()
+            for i in self.board.topology.ownable_indexes:
+                index.add(self.board.squares[i])
+
+            for player in self.players:
+                expected = index.get(player)
+                ownership = self.board.ownership.get(player)
+                assert vars(ownership) == vars(expected)
+
+    def test_other_board(self):
+        state = BoardState.from_board(self.board)
+        self.board.remove_player(self.players[2])
+
+        with self.assertRaises(ValueError):
+            state.apply_to_board(self.board)
@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from server.game_handler.data import Board
+from server.game_handler.data.squares import StationSquare, CompanySquare, \
+    PropertySquare, GoSquare
+from server.game_handler.data.topology import get_topology
+from server.game_handler.engine import Engine
+
+
+class TestTopology(TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+
+    def create_board(self) -> Board:
+        board = Board()
+        board.load_data(
+            squares=[square for square in self.engine.squares],
+            chance_deck=self.engine.chance_deck.copy(),
+            community_deck=self.engine.community_deck.copy()
+        )
+        return board
+
+    def test_shared(self):
+        board1 = self.create_board()
+        board2 = self.create_board()
+
+        assert board1.topology is board2.topology
+        assert board1.topology is get_topology(self.engine.squares)
+
+    def test_indexes(self):
+        topology = self.create_board().topology
+        squares = self.engine.squares
+
+        assert topology.size == 40
+        assert topology.prison_square_index == 10
+        assert topology.station_indexes == (5, 15, 25, 35)
+        assert topology.company_indexes == (12, 28)
+        assert all(isinstance(squares[i], PropertySquare)
+                   for i in topology.property_indexes)
+        assert sum(len(group) for group in topology.color_groups.values()) \
+            == len(topology.property_indexes)
+
+        for color, group in topology.color_groups.items():
+            assert all(squares[i].color == color for i in group)
+
+    def test_next_tables(self):
+        topology = self.create_board().topology
+
+        assert topology.next_station[0] == 5
+        assert topology.next_station[5] == 15
+        assert topology.next_station[36] == 5
+        assert topology.next_company[12] == 28
+        assert topology.next_company[30] == 12
+
+    def test_layouts(self):
+        # Only one station: the next station of its square is itself
+        topology = get_topology([GoSquare(), StationSquare(), GoSquare()])
+
+        assert topology.next_station == (1, 1, 1)
+        assert topology.next_company == (-1, -1, -1)
+        assert topology is not get_topology([GoSquare(), CompanySquare()])
+        assert get_topology([]).size == 0
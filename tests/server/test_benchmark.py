@@ -0,0 +1,220 @@
+import os
+import time
+import timeit
+import unittest
+from typing import List, Dict
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from server.game_handler.clock import SimulatedClock
+from server.game_handler.data import Player, codec
+from server.game_handler.data.packets import LaunchGame, AppletReady, \
+    PacketUtils
+from server.game_handler.engine import Engine, Game, GameState
+from server.game_handler.models import User
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Scale with BENCHMARK_GAMES=500 (python -m pytest test_benchmark.py -s)
+NB_GAMES = int(os.getenv('BENCHMARK_GAMES', 10))
+NB_BOTS = 3
+MAX_ROUNDS = 13
+# Wall time limit of a benchmark run (seconds)
+MAX_DURATION = 120
+# Encodings of every packet by the codec benchmark
+CODEC_ITERATIONS = 200
+
+# Real waits (simulated clock), heartbeat never expires
+BENCHMARK_CONFIG = {
+    **settings.ENGINE_CONFIG,
+    # Bots decide in the game thread (pool results would come too late)
+    'BOT_WORKERS': 0,
+    'METRICS_PUBLISH_INTERVAL': 0,
+    'PING_HEARTBEAT_TIMEOUT': 7 * 24 * 3600,
+}
+
+
+class FakeChannelLayer:
+    """
+    In-memory channel layer stand-in: messages are counted, then dropped
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.packets = 0
+
+    def count(self, message: Dict):
+        self.messages += 1
+        if message.get('type') == 'send.bundle':
+            self.packets += len(message['messages'])
+        else:
+            self.packets += 1
+
+    async def send(self, channel: str, message: Dict):
+        self.count(message)
+
+    async def group_send(self, group: str, message: Dict):
+        self.count(message)
+
+    async def group_add(self, group: str, channel: str):
+        pass
+
+    async def group_discard(self, group: str, channel: str):
+        pass
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class GameSimulator:
+    """
+    Headless games: one real host (always online, never playing, timeouts
+    play for him) and bots, driven by the engine scheduler without thread.
+    The clock is simulated: waits and timeouts do not take any time.
+    """
+
+    def __init__(self, nb_games: int, nb_bots: int = NB_BOTS,
+                 max_rounds: int = MAX_ROUNDS):
+        self.clock = SimulatedClock()
+        self.engine = Engine(clock=self.clock)
+        self.channel_layer = FakeChannelLayer()
+        self.nb_games = nb_games
+        self.nb_bots = nb_bots
+        self.max_rounds = max_rounds
+        # Duration of each tick (seconds)
+        self.ticks: List[float] = []
+
+    def create_game(self, host: User) -> Game:
+        game = Game(clock=self.clock)
+        game.channel_layer = self.channel_layer
+        game.public_name = "benchmark %s" % host.name
+        self.engine.add_game(game)
+
+        board = game.board
+        player = Player(user=host, channel_name="channel.%s" % host.id,
+                        bot=False)
+        board.add_player(player)
+        game.host_player = player
+        board.set_nb_players(self.nb_bots + 1)
+
+        for _ in range(self.nb_bots):
+            board.add_player(Player(bot=True,
+                                    bot_name=board.get_random_bot_name()))
+
+        board.set_option_start_balance(
+            BENCHMARK_CONFIG['MONEY_START_DEFAULT'])
+        board.option_max_time = BENCHMARK_CONFIG['TIME_ROUNDS_DEFAULT']
+        board.option_max_rounds = self.max_rounds
+
+        self.engine.send_packet(
+            game_uid=game.uid, packet=LaunchGame(player_token=str(host.id)),
+            channel_name=player.channel_name)
+        self.engine.send_packet(
+            game_uid=game.uid, packet=AppletReady(player_token=str(host.id)),
+            channel_name=player.channel_name)
+
+        return game
+
+    def run(self) -> Dict:
+        hosts = [User.objects.create(login="host%d" % i, name="host%d" % i)
+                 for i in range(self.nb_games)]
+
+        start = time.perf_counter()
+        simulated_start = self.clock.now()
+
+        for host in hosts:
+            self.create_game(host)
+
+        scheduler = self.engine.scheduler
+
+        while len(self.engine.games) > 0:
+            if time.perf_counter() - start > MAX_DURATION:
+                break
+
+            wait = scheduler.get_wait_seconds()
+
+            # Nothing planned (games waiting for packets)
+            if wait is None:
+                break
+
+            # Straight to the next deadline
+            self.clock.advance(wait)
+
+            for game in scheduler.pop_due_games(self.clock.now()):
+                tick_start = time.perf_counter()
+                scheduler.run_game(game)
+                self.ticks.append(time.perf_counter() - tick_start)
+
+            scheduler.run_jobs(self.clock.now())
+
+        duration = time.perf_counter() - start
+        finished = self.nb_games - len(self.engine.games)
+
+        return {
+            'games': finished,
+            'duration': duration,
+            'games_per_sec': finished / duration,
+            'packets_per_sec': self.channel_layer.packets / duration,
+            'messages_per_sec': self.channel_layer.messages / duration,
+            'ticks': len(self.ticks),
+            'simulated_sec': (self.clock.now() - simulated_start)
+            .total_seconds(),
+            'tick_p50_ms': percentile(self.ticks, 50) * 1000,
+            'tick_p99_ms': percentile(self.ticks, 99) * 1000,
+            # KB on Linux
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        }
+
+
+@override_settings(ENGINE_CONFIG=BENCHMARK_CONFIG)
+class TestBenchmark(TestCase):
+
+    def test_full_games(self):
+        simulator = GameSimulator(nb_games=NB_GAMES)
+        results = simulator.run()
+
+        print("\n[benchmark] %d games, %d bots, %d rounds" % (
+            NB_GAMES, NB_BOTS, MAX_ROUNDS))
+        for key, value in results.items():
+            print("[benchmark] %s: %s" % (key, value))
+
+        # Every game went from LaunchGame to GameEnd
+        assert results['games'] == NB_GAMES
+        assert simulator.channel_layer.packets > 0
+        assert all(game.state is GameState.STOP_THREAD
+                   for game in simulator.engine.scheduler.games.values())
+
+
+class TestCodecBenchmark(unittest.TestCase):
+
+    def test_codec(self):
+        """
+        Generated encoders against json.dumps(__dict__), timings are only
+        reported (correctness is checked by data/test_codec.py)
+        """
+        total_legacy = 0
+        total_codec = 0
+
+        for name, packet_class in PacketUtils.packets.items():
+            packet = packet_class()
+            legacy = timeit.timeit(lambda: codec.legacy_serialize(packet),
+                                   number=CODEC_ITERATIONS)
+            compiled = timeit.timeit(packet.serialize,
+                                     number=CODEC_ITERATIONS)
+            total_legacy += legacy
+            total_codec += compiled
+            print("[benchmark] %-30s legacy=%.2fus codec=%.2fus x%.1f" % (
+                name, legacy / CODEC_ITERATIONS * 1e6,
+                compiled / CODEC_ITERATIONS * 1e6, legacy / compiled))
+
+        speedup = total_legacy / total_codec
+        print("[benchmark] codec speedup: x%.1f" % speedup)
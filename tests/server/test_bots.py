@@ -0,0 +1,208 @@
+import copy
+import pickle
+from datetime import datetime, timedelta
+from typing import List
+from unittest import TestCase
+
+from django.conf import settings
+from django.test import override_settings
+
+from server.game_handler.bots import Decision, MonteCarlo, BotEngine, \
+    decide, get_build_options, get_mortgage_options
+from server.game_handler.data import Board, Player
+from server.game_handler.data.auction import Auction
+from server.game_handler.data.exchange import Exchange, ExchangeState
+from server.game_handler.data.packets import Packet, ActionEnd, \
+    ActionBuyProperty, ActionBuyHouse, ActionMortgageProperty, AuctionBid, \
+    ActionExchangeAccept, ActionExchangeDecline, ActionTimeout
+from server.game_handler.engine import Engine
+from server.game_handler.game import Game, GameState
+from server.game_handler.models import User
+
+LEVEL = {'budget': 5.0, 'rollouts': 32, 'rounds': 8}
+SEED = 42
+
+
+class TestBots(TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        self.board = Board()
+        self.board.load_data(
+            squares=[copy.copy(square) for square in self.engine.squares],
+            chance_deck=[],
+            community_deck=[]
+        )
+        self.board.option_first_round_buy = True
+        self.bot = Player(bot=True, bot_name="bot")
+        self.human = Player(bot=False, user=User(
+            id="283e1f5e-3411-44c5-9bc5-037358c47100"))
+        self.board.add_player(self.bot)
+        self.board.add_player(self.human)
+        self.bot.money = 1500
+        self.human.money = 1500
+
+    def decide(self, decision: Decision, level=None) -> List[Packet]:
+        return decide(decision, self.bot.get_id(),
+                      pickle.dumps(self.board), level or LEVEL, SEED)
+
+    def test_board_pickle(self):
+        self.board.squares[1].owner = self.bot
+        clone = pickle.loads(pickle.dumps(self.board))
+
+        assert clone.topology is self.board.topology
+        assert clone.squares[1].owner is clone.get_player(self.bot.get_id())
+        # squares of the copy update the index of the copy
+        clone.squares[3].owner = clone.squares[1].owner
+        assert clone.ownership.get(self.bot).squares == 2
+        assert self.board.ownership.get(self.bot).squares == 1
+
+    def test_tour_buy(self):
+        self.bot.position = 39
+        packets = self.decide(Decision.TOUR_ACTIONS)
+
+        assert isinstance(packets[0], ActionBuyProperty)
+        assert packets[0].property_id == 39
+        assert isinstance(packets[-1], ActionEnd)
+        # Decision is computed on a copy
+        assert self.board.squares[39].owner is None
+
+    def test_tour_build(self):
+        self.board.squares[1].owner = self.bot
+        self.board.squares[3].owner = self.bot
+
+        options = get_build_options(self.board, self.bot)
+        assert [square.id_ for square in options] == [1]
+
+        packets = self.decide(Decision.TOUR_ACTIONS)
+        builds = [p for p in packets if isinstance(p, ActionBuyHouse)]
+        assert len(builds) > 0
+        assert isinstance(packets[-1], ActionEnd)
+
+        # No houses in the group => mortgage possible
+        assert len(get_mortgage_options(self.board, self.bot)) == 2
+        self.board.squares[1].nb_house = 1
+        assert len(get_mortgage_options(self.board, self.bot)) == 0
+
+    def test_tour_debts(self):
+        self.board.squares[5].owner = self.bot
+        self.bot.position = 39
+        self.bot.money = 0
+        self.bot.add_debt(creditor=self.human, amount=50)
+
+        packets = self.decide(Decision.TOUR_ACTIONS)
+
+        assert isinstance(packets[0], ActionMortgageProperty)
+        assert packets[0].property_id == 5
+        # Nothing bought with a mortgage
+        assert not any(isinstance(p, ActionBuyProperty) for p in packets)
+        assert isinstance(packets[-1], ActionEnd)
+
+    def test_budget(self):
+        self.bot.position = 39
+        search = MonteCarlo(self.bot.get_id(),
+                            {**LEVEL, 'budget': 0}, SEED)
+
+        assert search.budget_expired()
+        assert search.evaluate(self.board, [lambda b, p: None]) == [None]
+
+        # Nothing evaluated => default choice (do nothing)
+        packets = self.decide(Decision.TOUR_ACTIONS,
+                              level={**LEVEL, 'budget': 0})
+        assert len(packets) == 1
+        assert isinstance(packets[0], ActionEnd)
+
+    def test_auction_bid(self):
+        auction = Auction(player=self.human, square=self.board.squares[39])
+        auction.bid(self.human, 10)
+        self.board.current_auction = auction
+
+        packets = self.decide(Decision.AUCTION_BID)
+        assert len(packets) == 1
+        assert isinstance(packets[0], AuctionBid)
+        assert 10 < packets[0].bid <= self.bot.money
+
+        auction.bid(self.human, 1400)
+        assert self.decide(Decision.AUCTION_BID) == []
+
+    def test_exchange_response(self):
+        exchange = Exchange(player=self.human, selected_player=self.bot)
+        exchange.state = ExchangeState.WAITING_RESPONSE
+        self.board.current_exchange = exchange
+
+        self.board.squares[39].owner = self.human
+        exchange.add_or_remove_square(self.board.squares[39])
+        packets = self.decide(Decision.EXCHANGE_RESPONSE)
+        assert isinstance(packets[0], ActionExchangeAccept)
+
+        # The bot gives its property for nothing
+        self.board.squares[39].owner = self.bot
+        exchange.player_squares = []
+        exchange.add_or_remove_square(self.board.squares[39],
+                                      recipient=True)
+        packets = self.decide(Decision.EXCHANGE_RESPONSE)
+        assert isinstance(packets[0], ActionExchangeDecline)
+
+    def test_pool(self):
+        self.bot.position = 39
+        bots = BotEngine(workers=1, levels=[LEVEL])
+
+        try:
+            future = bots.submit(Decision.TOUR_ACTIONS, self.bot, self.board)
+            packets = future.result(timeout=120)
+        finally:
+            bots.shutdown()
+
+        assert isinstance(packets[0], ActionBuyProperty)
+        assert isinstance(packets[-1], ActionEnd)
+
+
+class TestGameBots(TestCase):
+
+    def setUp(self):
+        # Decisions computed in the game thread
+        with override_settings(ENGINE_CONFIG={
+            **settings.ENGINE_CONFIG, 'BOT_WORKERS': 0,
+            'METRICS_PUBLISH_INTERVAL': 0
+        }):
+            self.engine = Engine()
+            self.game = Game()
+        self.game.public_name = "bots"
+        self.engine.add_game(self.game)
+        self.packets = []
+        self.game.broadcast_packet = self.packets.append
+
+        self.bot = Player(bot=True, bot_name="bot")
+        self.human = Player(bot=False, user=User(
+            id="283e1f5e-3411-44c5-9bc5-037358c47100"))
+        self.human.connect()
+        self.human.ping_timeout = datetime.now() + timedelta(hours=1)
+        self.game.add_player(self.bot)
+        self.game.add_player(self.human)
+
+        board = self.game.board
+        board.option_max_time = 60
+        board.set_current_player(self.bot)
+        self.game.state = GameState.ACTION_START_WAIT
+        self.game.timeout = datetime.now()
+
+    def test_tour_end(self):
+        # ActionStart => decision requested
+        self.game.tick()
+        assert self.game.state is GameState.ACTION_TIMEOUT_WAIT
+        assert self.bot.get_id() in self.game.bot_decisions
+
+        # Decision packets (ActionEnd) processed without waiting timeout
+        self.game.tick()
+        assert self.game.state is GameState.ROUND_START_WAIT
+        assert any(isinstance(p, ActionTimeout) for p in self.packets)
+        assert len(self.game.bot_decisions) == 0
+
+    def test_stale_decision(self):
+        self.game.tick()
+        # Another tour started before the decision was processed
+        self.game.turn_counter += 1
+        self.game.tick()
+
+        assert self.game.state is GameState.ACTION_TIMEOUT_WAIT
+        assert len(self.game.bot_decisions) == 0
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from django.conf import settings
+from django.test import override_settings
+
+from server.game_handler.clock import Clock, ManualClock, SimulatedClock
+from server.game_handler.data import Player
+from server.game_handler.engine import Engine
+from server.game_handler.game import Game, GameState
+from server.game_handler.models import User
+from server.game_handler.scheduler import GameScheduler
+
+
+class TestClock(TestCase):
+
+    def test_monotonic(self):
+        clock = Clock()
+        first = clock.now()
+        assert clock.now() >= first
+        assert abs((first - datetime.now()).total_seconds()) < 60
+
+    def test_freeze(self):
+        clock = Clock()
+        clock.freeze()
+        frozen = clock.now()
+        assert clock.now() == frozen
+
+        clock.unfreeze()
+        assert clock.now() >= frozen
+
+    def test_simulated(self):
+        date = datetime(2022, 3, 1, 12)
+        clock = SimulatedClock(date)
+        clock.advance(90)
+        # Deadlines in the past do not move the clock back
+        clock.advance(-10)
+        assert clock.now() == date + timedelta(seconds=90)
+
+    def test_real_clock_simulation(self):
+        with self.assertRaises(ValueError):
+            GameScheduler().run_simulation(datetime.now())
+
+        with self.assertRaises(ValueError):
+            GameScheduler(clock=ManualClock()).run_simulation(datetime.now())
+
+
+class TestSimulation(TestCase):
+
+    def setUp(self):
+        self.date = datetime(2022, 3, 1, 12)
+
+        with override_settings(
+                ENGINE_CONFIG={**settings.ENGINE_CONFIG, 'BOT_WORKERS': 0,
+                               'METRICS_PUBLISH_INTERVAL': 0}):
+            self.clock = SimulatedClock(self.date)
+            self.engine = Engine(clock=self.clock)
+            self.game = Game(clock=self.clock)
+            self.engine.add_game(self.game)
+
+        self.game.add_player(Player(bot=False, user=User(
+            id="283e1f5e-3411-44c5-9bc5-037358c47100")))
+        self.game.state = GameState.WAITING_PLAYERS
+        self.game.set_timeout(seconds=60)
+
+    def test_timeout(self):
+        scheduler = self.engine.scheduler
+        ticks = scheduler.run_simulation(
+            until=self.date + timedelta(seconds=59))
+
+        # Ticked once, then waiting for its deadline
+        assert ticks == 1
+        assert self.clock.now() == self.date
+        assert self.game.state is GameState.WAITING_PLAYERS
+
+        scheduler.run_simulation(until=self.date + timedelta(hours=1))
+
+        # Stopped exactly at its deadline, nobody connected
+        assert self.game.state is GameState.STOP_THREAD
+        assert self.game.uid not in scheduler.games
+        assert self.clock.now() == self.date + timedelta(seconds=60)
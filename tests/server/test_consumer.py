@@ -1,6 +1,64 @@
+import asyncio
+import json
 from unittest import TestCase
 
-from server.game_handler.consumers import PlayerConsumer, GameEngineConsumer
+import msgpack
+from asgiref.sync import async_to_sync
+
+from server.game_handler.consumers import PlayerConsumer, \
+    GameEngineConsumer, LobbyConsumer
+from server.game_handler.data.packets import PlayerMove, \
+    InternalCheckPlayerValidity, CreateGameSucceed, PacketUtils, PingPacket, \
+    CreateGame, LeaveRoom
+from server.game_handler.ratelimit import TokenBucket
+
+
+async def fake_send(self, text_data=None, *args, **kwargs):
+    self.sent.append(text_data)
+
+
+async def fake_send_bytes(self, text_data=None, bytes_data=None):
+    self.sent.append(bytes_data)
+
+
+async def fake_receive_json(self, content, **kwargs):
+    self.received.append(content)
+
+
+class FakeChannelLayer:
+
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, channel, message):
+        self.messages.append(message)
+
+
+class FakeDatabase:
+
+    def __init__(self):
+        self.released = asyncio.Event()
+
+    async def run(self, function, *args):
+        await self.released.wait()
+        return function(*args)
+
+
+def lobby_message(packet, game_token: str = ""):
+    return {
+        'type': 'process.lobby.packets',
+        'content': json.loads(packet.serialize()),
+        'channel_name': 'lobby.0',
+        'game_token': game_token
+    }
+
+
+def message(packet, message_type: str):
+    return {
+        'type': message_type,
+        'name': packet.name,
+        'packet': packet.serialize()
+    }
 
 
 class TestMiddlewares(TestCase):
@@ -15,3 +73,181 @@ class TestMiddlewares(TestCase):
     def test_game_engine_consumer(self):
         cons = GameEngineConsumer()
         assert cons is not None
+
+    def test_lobby_packets_tasks(self):
+        cons = GameEngineConsumer()
+        engine = cons.engine
+        handled = []
+        engine.load_creator = lambda token: "user %s" % token
+        engine.create_game = \
+            lambda packet, channel_name, user: handled.append(user)
+        engine.leave_game = \
+            lambda packet, game_token, channel_name: handled.append("left")
+
+        async def process():
+            engine.scheduler.loop = asyncio.get_running_loop()
+            engine.database = FakeDatabase()
+            await cons.process_lobby_packets(
+                lobby_message(CreateGame(player_token="a")))
+            await cons.process_lobby_packets(
+                lobby_message(LeaveRoom(player_token="a"), "game"))
+            await asyncio.sleep(0)
+
+            # messages do not wait for the database, the next lobby
+            # packets do
+            assert handled == []
+            engine.database.released.set()
+            await asyncio.gather(*engine.tasks)
+
+        async_to_sync(process)()
+        assert handled == ["user a", "left"]
+
+    def test_lobby_task_failure(self):
+        cons = GameEngineConsumer()
+        engine = cons.engine
+
+        def leave_game(packet, game_token, channel_name):
+            raise ValueError()
+
+        engine.leave_game = leave_game
+
+        async def process():
+            engine.scheduler.loop = asyncio.get_running_loop()
+            await cons.process_lobby_packets(
+                lobby_message(LeaveRoom(player_token="a"), "game"))
+            await asyncio.gather(*engine.tasks, return_exceptions=True)
+            # done callbacks
+            await asyncio.sleep(0)
+
+        with self.assertLogs('server.game_handler.engine', 'ERROR') as logs:
+            async_to_sync(process)()
+
+        assert 'handle_lobby_packet' in logs.output[0]
+        assert len(engine.tasks) == 0
+
+    def test_player_callback_forward(self):
+        cons = PlayerConsumer()
+        cons.sent = []
+        cons.send = fake_send.__get__(cons, PlayerConsumer)
+
+        packet = PlayerMove(player_token="a", destination=3)
+        content = message(packet, 'player.callback')
+
+        async_to_sync(cons.player_callback)(content)
+
+        # packet is not decoded, sent as is
+        assert cons.sent == [content['packet']]
+
+    def test_player_callback_control(self):
+        cons = PlayerConsumer()
+        cons.sent = []
+        cons.send = fake_send.__get__(cons, PlayerConsumer)
+
+        packet = InternalCheckPlayerValidity(player_token="a", valid=True)
+
+        async_to_sync(cons.player_callback)(
+            message(packet, 'player.callback'))
+
+        assert cons.valid
+        assert cons.sent == ['{"name": "PlayerValid"}']
+
+    def test_lobby_callback_control(self):
+        cons = LobbyConsumer()
+        cons.sent = []
+        cons.send = fake_send.__get__(cons, LobbyConsumer)
+
+        packet = CreateGameSucceed(game_token="abc")
+        content = message(packet, 'lobby.callback')
+
+        async_to_sync(cons.lobby_callback)(content)
+
+        assert cons.game_token == "abc"
+        assert cons.sent == [content['packet']]
+
+    def test_send_bundle(self):
+        cons = PlayerConsumer()
+        cons.sent = []
+        cons.send = fake_send.__get__(cons, PlayerConsumer)
+
+        packet = PlayerMove(player_token="a", destination=3)
+
+        async_to_sync(cons.send_bundle)({
+            'type': 'send.bundle',
+            'messages': [
+                message(packet, 'send.packet'),
+                # not handled by PlayerConsumer
+                message(packet, 'send.lobby.packet'),
+                message(packet, 'player.callback')
+            ]
+        })
+
+        assert len(cons.sent) == 2
+
+    def test_msgpack_format(self):
+        cons = PlayerConsumer()
+        cons.wire_format = "msgpack"
+        cons.sent = []
+        cons.send = fake_send_bytes.__get__(cons, PlayerConsumer)
+
+        packet = PlayerMove(player_token="a", destination=3)
+
+        async_to_sync(cons.player_callback)(
+            message(packet, 'player.callback'))
+
+        frame = msgpack.unpackb(cons.sent[0])
+        assert frame == PacketUtils.to_compact(
+            json.loads(packet.serialize()))
+
+        # engine messages only carry JSON, converted by msgpack sockets
+        engine_message = PacketUtils.to_message('send.packet', packet)
+        assert 'frame' not in engine_message
+        async_to_sync(cons.send_packet)(engine_message)
+        assert msgpack.unpackb(cons.sent[1]) == frame
+
+    def test_msgpack_receive(self):
+        cons = PlayerConsumer()
+        cons.wire_format = "msgpack"
+        cons.received = []
+        cons.receive_json = fake_receive_json.__get__(cons, PlayerConsumer)
+
+        frame = [PacketUtils.packet_ids["AuctionBid"], 150, "a"]
+
+        async_to_sync(cons.receive)(bytes_data=msgpack.packb(frame))
+        # invalid frames are ignored
+        async_to_sync(cons.receive)(bytes_data=b"\xc1")
+
+        assert cons.received == [{
+            "name": "AuctionBid",
+            "bid": 150,
+            "player_token": "a"
+        }]
+
+    def test_rate_limit(self):
+        cons = PlayerConsumer()
+        cons.valid = True
+        cons.game_token = "game"
+        cons.channel_name = "channel"
+        cons.channel_layer = FakeChannelLayer()
+        cons.bucket = TokenBucket(rate=0, burst=2)
+        cons.sent = []
+        cons.send = fake_send.__get__(cons, PlayerConsumer)
+        closed = []
+
+        async def fake_close(code=None):
+            closed.append(code)
+
+        cons.close = fake_close
+        content = json.loads(PingPacket().serialize())
+
+        for _ in range(4):
+            async_to_sync(cons.receive_json)(dict(content))
+
+        # Burst forwarded, then dropped
+        assert len(cons.channel_layer.messages) == 2
+        assert closed == []
+
+        # Still flooding: disconnected
+        async_to_sync(cons.receive_json)(dict(content))
+        assert closed == [4002]
+        assert not cons.valid
+        assert json.loads(cons.sent[0])['code'] == 4002
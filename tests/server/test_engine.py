@@ -1,5 +1,14 @@
+from concurrent.futures import Future
 from unittest import TestCase
+
+from django.conf import settings
+from django.test import override_settings
+
+from server.game_handler.data import Player
+from server.game_handler.data.packets import PingPacket, AuctionBid, \
+    InternalPlayerDisconnect, ActionEnd
 from server.game_handler.engine import Engine, Game, GameState
+from server.game_handler.models import User
 
 
 class TestPacket(TestCase):
@@ -22,3 +31,69 @@ class TestPacket(TestCase):
 
         assert len(self.engine.games) == 0
         assert game.state == GameState.STOP_THREAD
+
+    def test_player_index(self):
+        game = Game()
+        player = Player(bot=False,
+                        user=User(id="283e1f5e-3411-44c5-9bc5-037358c47100"))
+        # players added before add_game are indexed too
+        game.board.add_player(player)
+        self.engine.add_game(game)
+
+        bot = Player(bot=True, bot_name="bot")
+        game.add_player(bot)
+
+        assert self.engine.player_exists(player.get_id())
+        assert self.engine.get_player_game(bot.get_id()) is game
+
+        game.remove_player(bot)
+        assert not self.engine.player_exists(bot.get_id())
+
+        self.engine.remove_game(game.uid)
+        assert not self.engine.player_exists(player.get_id())
+        assert self.engine.get_player_game(player.get_id()) is None
+
+    def test_packets_queue(self):
+        with override_settings(ENGINE_CONFIG={**settings.ENGINE_CONFIG,
+                                              'PACKETS_QUEUE_SIZE': 3}):
+            game = Game()
+        self.engine.add_game(game)
+        uid = game.uid
+
+        assert self.engine.send_packet(uid, PingPacket(player_token="a"))
+        assert self.engine.send_packet(uid, AuctionBid("a", bid=10))
+        # Coalesced: one pending Ping and AuctionBid per player
+        assert self.engine.send_packet(uid, PingPacket(player_token="a"))
+        assert self.engine.send_packet(uid, AuctionBid("a", bid=20))
+        assert game.packets_queue.qsize() == 2
+
+        assert self.engine.send_packet(uid, ActionEnd(player_token="a"))
+        # Full: dropped, except internal packets
+        assert not self.engine.send_packet(uid, ActionEnd(player_token="b"))
+        assert self.engine.send_packet(
+            uid, InternalPlayerDisconnect(player_token="a"))
+        assert self.engine.metrics.packets_dropped['ActionEnd'] == 1
+
+        packets = [p.packet for p in game.packets_queue.drain()]
+        assert [p.name for p in packets] == [
+            'Ping', 'AuctionBid', 'ActionEnd', 'InternalPlayerDisconnect']
+        # Last bid kept at the place of the first one
+        assert packets[1].bid == 20
+        assert game.packets_queue.empty()
+
+    def test_bot_packets_not_dropped(self):
+        with override_settings(ENGINE_CONFIG={**settings.ENGINE_CONFIG,
+                                              'PACKETS_QUEUE_SIZE': 1}):
+            game = Game()
+        self.engine.add_game(game)
+        assert self.engine.send_packet(game.uid, ActionEnd(player_token="a"))
+
+        # finished decision of a bot, queue full
+        future = Future()
+        future.set_result([ActionEnd(player_token="bot")])
+        game.bot_decisions["bot"] = (game.get_bot_context(), future)
+        game.collect_bot_decisions()
+
+        packets = game.packets_queue.drain()
+        assert [p.packet.player_token for p in packets] == ["a", "bot"]
+        assert packets[1].internal
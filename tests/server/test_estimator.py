@@ -0,0 +1,93 @@
+import copy
+from unittest import TestCase, skipIf
+
+from server.game_handler.data import Board, Player
+from server.game_handler.data.state import BoardState
+from server.game_handler.engine import Engine
+from server.game_handler.estimator import estimate, np
+from server.game_handler.models import User
+
+
+@skipIf(np is None, "numpy is not installed")
+class TestEstimator(TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        self.board = Board()
+        self.board.load_data(
+            squares=[copy.copy(square) for square in self.engine.squares],
+            chance_deck=[copy.copy(card) for card in self.engine.chance_deck],
+            community_deck=[copy.copy(card)
+                            for card in self.engine.community_deck]
+        )
+        self.players = [
+            Player(bot=False, user=User(id="283e1f5e-3411-44c5-9bc5-"
+                                           "037358c47100")),
+            Player(bot=True, bot_name="bot1"),
+            Player(bot=True, bot_name="bot2"),
+        ]
+        for player in self.players:
+            self.board.add_player(player)
+            player.money = 1000
+
+    def test_estimate(self):
+        rich, poor = self.players[0], self.players[1]
+
+        # rich owns every property with hotels, poor has nothing
+        for i in self.board.topology.ownable_indexes:
+            self.board.squares[i].owner = rich
+        for i in self.board.topology.property_indexes:
+            self.board.squares[i].nb_house = 5
+        poor.money = 10
+
+        state = BoardState.from_board(self.board)
+        result = estimate(self.board, samples=500, rounds=10, budget=10,
+                          seed=1)
+
+        assert result.samples == 500
+        assert result.rounds == 10
+        assert abs(sum(result.win_probabilities.values()) - 1) < 1e-9
+        assert result.win_probabilities[rich.get_id()] > 0.99
+        assert result.bankruptcy_risks[poor.get_id()] > 0.9
+        assert result.bankruptcy_risks[rich.get_id()] == 0
+        # Only squares of rich exist, every one gets a rent
+        assert len(result.rent_incomes) == len(
+            self.board.topology.ownable_indexes)
+        assert all(income >= 0 for income in result.rent_incomes.values())
+        assert sum(result.rent_incomes.values()) > 0
+
+        # Board is not modified
+        assert BoardState.from_board(self.board) == state
+
+    def test_no_owner(self):
+        result = estimate(self.board, samples=200, rounds=5, budget=10,
+                          seed=2)
+
+        assert all(income == 0 for income in result.rent_incomes.values())
+        for player in self.players:
+            assert 0 <= result.win_probabilities[player.get_id()] <= 1
+            assert 0 <= result.bankruptcy_risks[player.get_id()] <= 1
+
+    def test_seed(self):
+        self.board.squares[39].owner = self.players[2]
+
+        first = estimate(self.board, samples=100, rounds=5, budget=10,
+                         seed=3)
+        second = estimate(self.board, samples=100, rounds=5, budget=10,
+                          seed=3)
+        assert first == second
+
+    def test_budget(self):
+        self.players[2].money = 2000
+
+        # Nothing simulated: highest score wins
+        result = estimate(self.board, samples=100, rounds=5, budget=0)
+        assert result.rounds == 0
+        assert result.win_probabilities[self.players[2].get_id()] == 1
+
+    def test_max_rounds(self):
+        self.board.option_max_rounds = 10
+        self.board.current_round = 7
+
+        result = estimate(self.board, samples=50, budget=10, seed=4)
+        assert result.rounds == 3
@@ -1,12 +1,16 @@
 from typing import List
 from unittest import TestCase
 
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+
 from server.game_handler.data import Player, Card
 from server.game_handler.data.cards import CardActionType, ChanceCard, \
     CommunityCard
 from server.game_handler.data.packets import Packet, PlayerPayDebt, \
     PlayerUpdateBalance
 from server.game_handler.engine import Game
+from server.game_handler.game import OutboundType, merge_outbound
 
 # overwrite broadcast_packet method
 from server.game_handler.models import User
@@ -332,3 +336,52 @@ class TestPacket(TestCase):
 
         assert maxime.get_money() == 10
         assert rayan.get_money() == 350
+
+
+class TestOutbound(TestCase):
+
+    def test_merge_outbound(self):
+        outbound = [
+            (OutboundType.GROUP_SEND, "game", {"type": "send.packet"}),
+            (OutboundType.GROUP_SEND, "game", {"type": "send.packet"}),
+            (OutboundType.SEND, "player", {"type": "player.callback"}),
+            (OutboundType.GROUP_ADD, "game", "player"),
+            (OutboundType.GROUP_SEND, "game", {"type": "send.packet"}),
+        ]
+
+        merged = merge_outbound(outbound)
+
+        assert len(merged) == 4
+        assert merged[0][2] == {
+            'type': 'send.bundle',
+            'messages': [{"type": "send.packet"}, {"type": "send.packet"}]
+        }
+        # single messages are not bundled
+        assert merged[1][2] == {"type": "player.callback"}
+        # order is kept (group add before the group send)
+        assert merged[2] == (OutboundType.GROUP_ADD, "game", "player")
+        assert merged[3][0] is OutboundType.GROUP_SEND
+
+    def test_flush_packets(self):
+        game = Game()
+        game.channel_layer = InMemoryChannelLayer()
+        channel = async_to_sync(game.channel_layer.new_channel)()
+
+        game.group_add(game.uid, channel)
+        game.broadcast_packet(PlayerUpdateBalance(player_token="a"))
+        game.broadcast_packet(PlayerUpdateBalance(player_token="b"))
+        game.send_packet(channel, PlayerPayDebt(player_from="c"))
+
+        # nothing sent before flush
+        assert len(game.outbound) == 4
+        game.flush_packets()
+        assert len(game.outbound) == 0
+
+        receive = async_to_sync(game.channel_layer.receive)
+
+        message = receive(channel)
+        assert message['type'] == 'send.bundle'
+        assert len(message['messages']) == 2
+
+        message = receive(channel)
+        assert message['type'] == 'player.callback'
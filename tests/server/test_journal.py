@@ -0,0 +1,134 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from server.game_handler.clock import ManualClock
+from server.game_handler.data import Player
+from server.game_handler.data.packets import LaunchGame, AppletReady, \
+    PingPacket
+from server.game_handler.data.state import BoardState
+from server.game_handler.engine import Engine
+from server.game_handler.game import Game, GameState
+from server.game_handler.journal import read_journal, replay, START, TICK
+from server.game_handler.models import User
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        with override_settings(
+                GAME_JOURNAL_DIR=self.directory.name,
+                ENGINE_CONFIG={**settings.ENGINE_CONFIG, 'BOT_WORKERS': 0,
+                               'BOT_LEVELS': [{'budget': 0.005,
+                                               'rollouts': 4,
+                                               'rounds': 2}],
+                               'METRICS_PUBLISH_INTERVAL': 0}):
+            self.clock = ManualClock(datetime(2022, 3, 1, 12))
+            self.engine = Engine(clock=self.clock)
+            self.game = Game()
+            self.engine.add_game(self.game)
+
+        self.host = Player(bot=False, user=User(
+            id="283e1f5e-3411-44c5-9bc5-037358c47100"))
+        self.game.add_player(self.host)
+        self.game.host_player = self.host
+        self.game.public_name = "journal"
+        self.game.add_player(Player(bot=True, bot_name="bot1"))
+        self.game.add_player(Player(bot=True, bot_name="bot2"))
+        board = self.game.board
+        board.set_option_start_balance(1000)
+        board.set_option_max_time(30)
+        board.set_option_max_rounds(20)
+        self.path = os.path.join(self.directory.name,
+                                 '%s.journal' % self.game.uid)
+
+    def tearDown(self):
+        if self.game.journal is not None:
+            self.game.journal.close()
+        self.directory.cleanup()
+
+    def send(self, packet):
+        self.engine.send_packet(self.game.uid, packet)
+
+    def play(self, ticks: int):
+        token = self.host.get_id()
+        self.send(LaunchGame(player_token=token))
+        self.game.tick()
+        self.send(AppletReady(player_token=token))
+
+        for _ in range(ticks):
+            self.game.tick()
+            self.send(PingPacket(player_token=token))
+
+            deadline = self.game.next_deadline()
+            # Bot decisions are collected by the next tick
+            if len(self.game.bot_decisions) > 0:
+                deadline = self.clock.now() + timedelta(milliseconds=50)
+            self.clock.set(max(deadline, self.clock.now()))
+
+    def test_replay(self):
+        self.play(ticks=300)
+        assert self.game.board.current_round > 0
+
+        records = list(read_journal(self.path))
+        assert records[0][0] == START
+        assert all(record[0] == TICK for record in records[1:])
+        # Lobby (LaunchGame) is not recorded
+        assert len(records) == 301
+
+        game = replay(records)
+        board = game.board
+
+        assert game.state is self.game.state
+        assert game.timeout == self.game.timeout
+        assert game.turn_counter == self.game.turn_counter
+        assert BoardState.from_board(board) == \
+            BoardState.from_board(self.game.board)
+        assert board.random.getstate() == \
+            self.game.board.random.getstate()
+
+    def test_until(self):
+        self.play(ticks=50)
+        game = replay(read_journal(self.path), until=0)
+
+        # Only the first tick (AppletReady)
+        assert game.state is GameState.STARTING
+        assert game.board.get_player(self.host.get_id()).online
+
+    def test_truncated(self):
+        self.play(ticks=20)
+        self.game.journal.close()
+
+        with open(self.path, 'rb+') as file:
+            file.truncate(os.path.getsize(self.path) - 3)
+
+        records = list(read_journal(self.path))
+        assert len(records) == 20
+        replay(records)
+
+    def test_write_error(self):
+        # journal file cannot be opened
+        os.mkdir(self.path)
+        self.play(ticks=20)
+
+        # game continues without journal
+        assert self.game.journal is None
+        assert self.game.board.get_player(self.host.get_id()).online
+
+    def test_directory(self):
+        directory = os.path.join(self.directory.name, 'journals')
+
+        with override_settings(GAME_JOURNAL_DIR=directory):
+            engine = Engine()
+
+        assert os.path.isdir(directory)
+        game = Game()
+        engine.add_game(game)
+        assert game.journal.path == os.path.join(directory,
+                                                 '%s.journal' % game.uid)
+        assert game.clock is engine.clock
@@ -0,0 +1,86 @@
+import asyncio
+from unittest import TestCase
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+
+from server.game_handler.layers import LocalChannelLayer
+
+
+def create_layers():
+    """
+    Two processes sharing a fallback layer (Redis)
+    """
+    fallback = InMemoryChannelLayer()
+    first, second = LocalChannelLayer(), LocalChannelLayer()
+    first.fallback = fallback
+    second.fallback = fallback
+    return first, second
+
+
+class TestLocalChannelLayer(TestCase):
+
+    def test_local(self):
+        layer = LocalChannelLayer()
+        message = {'type': 'process.packets', 'content': {}}
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add("lobby", channel)
+            await layer.send("game_engine", message)
+            await layer.group_send("lobby", message)
+
+            return (await layer.receive("game_engine"),
+                    await layer.receive(channel))
+
+        received = async_to_sync(run)()
+
+        # Not copied
+        assert received[0] is message
+        assert received[1] is message
+
+    def test_fallback_send(self):
+        first, second = create_layers()
+
+        async def run():
+            channel = await first.new_channel()
+            # Channel of another process
+            await second.send(channel, {'type': 'player.callback'})
+            # Worker of the first process
+            first.listen("game_engine")
+            await second.send("game_engine", {'type': 'process.packets'})
+
+            received = [await first.receive(channel),
+                        await first.receive("game_engine")]
+            await first.flush()
+            return received
+
+        assert async_to_sync(run)() == [{'type': 'player.callback'},
+                                        {'type': 'process.packets'}]
+
+    def test_fallback_group(self):
+        first, second = create_layers()
+
+        async def run():
+            local = await first.new_channel()
+            remote = await second.new_channel()
+            await first.group_add("game", local)
+            await second.group_add("game", remote)
+
+            await first.group_send("game", {'type': 'send.bundle'})
+
+            received = [await first.receive(local),
+                        await second.receive(remote)]
+
+            # Local member received it once
+            try:
+                await asyncio.wait_for(first.receive(local), timeout=0.05)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                received.append("duplicate")
+
+            return received
+
+        assert async_to_sync(run)() == [{'type': 'send.bundle'},
+                                        {'type': 'send.bundle'}]
@@ -0,0 +1,248 @@
+import json
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from django.conf import settings
+from django.test import override_settings
+
+from server.game_handler.clock import ManualClock
+from server.game_handler.data import Player
+from server.game_handler.data.packets import BroadcastUpdateLobby, \
+    BroadcastNewRoomToLobby, CreateGame, LeaveRoom, StatusRoom, \
+    UpdateReason
+from server.game_handler.engine import Engine, Game, GameState
+from server.game_handler.game import OutboundType, QueuePacket
+from server.game_handler.models import User
+
+
+class TestLobbyIndex(TestCase):
+    engine: Engine
+
+    def setUp(self):
+        with override_settings(ENGINE_CONFIG={
+            **settings.ENGINE_CONFIG, 'LOBBY_BROADCAST_INTERVAL': 0
+        }):
+            self.engine = Engine()
+        self.sent = []
+        self.engine.send_to_channel = \
+            lambda channel, message: self.sent.append((channel, message))
+
+    def add_room(self, name: str) -> Game:
+        game = Game(clock=self.engine.clock)
+        self.engine.add_game(game)
+        game.public_name = name
+        game.add_player(Player(bot=False, user=User(id=game.uid)))
+        game.send_lobby_update(BroadcastNewRoomToLobby(
+            **game.get_lobby_room()))
+        return game
+
+    def test_snapshot(self):
+        self.engine.send_all_lobby_status("lobby.0")
+        # no room => nothing sent
+        assert len(self.sent) == 0
+
+        first = self.add_room("first")
+        second = self.add_room("second")
+        assert self.engine.lobby.version == 2
+
+        self.engine.send_all_lobby_status("lobby.0")
+        self.engine.send_all_lobby_status("lobby.1")
+        assert [channel for channel, _ in self.sent] == ["lobby.0", "lobby.1"]
+        # serialized once for every client
+        assert self.sent[0][1] is self.sent[1][1]
+
+        message = self.sent[0][1]
+        assert message['name'] == 'LobbySnapshot'
+        packet = json.loads(message['packet'])
+        assert packet['version'] == 2
+        assert [room['game_name'] for room in packet['rooms']] == \
+            ["first", "second"]
+        assert packet['rooms'][0]['game_token'] == first.uid
+        assert packet['rooms'][1]['nb_players'] == 1
+
+        second.state = GameState.WAITING_PLAYERS
+        update = BroadcastUpdateLobby(
+            game_token=second.uid, reason=UpdateReason.LAUNCHING_GAME.value)
+        second.send_lobby_update(update)
+        assert update.version == 3
+        assert update.shard == 0
+
+        self.engine.send_all_lobby_status("lobby.2")
+        packet = json.loads(self.sent[2][1]['packet'])
+        assert packet['version'] == 3
+        assert [room['game_token'] for room in packet['rooms']] == \
+            [first.uid]
+
+    def test_unchanged(self):
+        game = self.add_room("room")
+        update = BroadcastUpdateLobby(game_token=game.uid)
+        game.send_lobby_update(update)
+
+        # room did not change: same version, snapshot kept
+        assert update.version == 1
+        assert self.engine.lobby.message is None
+        message = self.engine.lobby.get_message()
+        game.send_lobby_update(BroadcastUpdateLobby(game_token=game.uid))
+        assert self.engine.lobby.get_message() is message
+
+        game.proceed_stop()
+        assert self.engine.lobby.version == 2
+        assert self.engine.lobby.get_message() is None
+
+    def test_shard(self):
+        with override_settings(ENGINE_CONFIG={
+            **settings.ENGINE_CONFIG, 'LOBBY_BROADCAST_INTERVAL': 0
+        }):
+            self.engine = Engine(shard=2)
+        self.engine.send_to_channel = \
+            lambda channel, message: self.sent.append((channel, message))
+        game = self.add_room("room")
+
+        # versions are per shard
+        update = BroadcastUpdateLobby(game_token=game.uid)
+        game.send_lobby_update(update)
+        assert update.shard == 2
+
+        self.engine.send_all_lobby_status("lobby.0")
+        packet = json.loads(self.sent[0][1]['packet'])
+        assert packet['shard'] == 2
+        assert packet['version'] == self.engine.lobby.version
+
+    def test_room_options(self):
+        game = self.add_room("room")
+        game.host_player = game.board.players[0]
+        game.host_player.channel_name = "host"
+        max_players = 3 if game.board.players_nb != 3 else 4
+        version = self.engine.lobby.version
+        game.outbound.clear()
+
+        game.process_packet(QueuePacket(packet=StatusRoom(
+            game_token=game.uid, game_name="room",
+            max_nb_players=max_players), channel_name="host"))
+
+        # no gap in the versions: the change is sent
+        assert self.engine.lobby.version == version + 1
+        sent = [json.loads(content['packet']) for outbound_type, group,
+                content in game.outbound
+                if outbound_type is OutboundType.GROUP_SEND and
+                group == "lobby"]
+
+        if self.engine.lobby.coalesce:
+            assert sent == []
+            return
+
+        assert sent[0]['name'] == 'BroadcastLobbyChanges'
+        assert sent[0]['version'] == version + 1
+        assert sent[0]['rooms'][0]['max_nb_players'] == max_players
+
+    def test_leave_room(self):
+        self.add_room("first")
+        second = self.add_room("second")
+        second.host_player = second.board.players[0]
+        second.outbound.clear()
+
+        self.engine.leave_game(LeaveRoom(player_token=second.uid),
+                               second.uid, "channel")
+
+        # sent by the next tick of the game, after LeaveRoomSucceed
+        assert len(self.sent) == 0
+        assert second.uid in self.engine.scheduler.deadlines
+        sent = [content['name'] for outbound_type, channel, content
+                in second.outbound
+                if outbound_type is OutboundType.SEND and
+                channel == "channel"]
+        assert sent == ['LeaveRoomSucceed', 'LobbySnapshot']
+
+    def test_create_game(self):
+        user = User(id="283e1f5e-3411-44c5-9bc5-037358c47100")
+        self.engine.create_game(CreateGame(player_token=str(user.id),
+                                           game_name="room",
+                                           max_nb_players=3),
+                                "lobby.0", user)
+
+        game = self.engine.get_player_game(str(user.id))
+        # listed and ticked once configured
+        assert game.host_player.get_id() == str(user.id)
+        assert game.uid in self.engine.scheduler.deadlines
+        room = self.engine.lobby.rooms[game.uid]
+        assert room['game_name'] == "room"
+        assert room['max_nb_players'] == 3
+        assert room['nb_players'] == 1
+
+        # already in a game
+        self.engine.create_game(CreateGame(player_token=str(user.id)),
+                                "lobby.0", user)
+        assert len(self.engine.games) == 1
+
+
+class FakeChannelLayer:
+
+    def __init__(self):
+        self.groups = []
+
+    async def group_send(self, group: str, message):
+        self.groups.append((group, message))
+
+
+class TestLobbyBroadcast(TestLobbyIndex):
+
+    def setUp(self):
+        with override_settings(ENGINE_CONFIG={
+            **settings.ENGINE_CONFIG, 'LOBBY_BROADCAST_INTERVAL': 0.25,
+            'METRICS_PUBLISH_INTERVAL': 0
+        }):
+            self.clock = ManualClock(datetime(2022, 3, 1, 12))
+            self.engine = Engine(clock=self.clock)
+        self.engine.channel_layer = FakeChannelLayer()
+        self.sent = []
+        self.engine.send_to_channel = \
+            lambda channel, message: self.sent.append((channel, message))
+
+    def flush(self):
+        self.clock.set(self.clock.now() + timedelta(seconds=0.25))
+        self.engine.scheduler.run_jobs(self.clock.now())
+
+    def test_coalesced(self):
+        first = self.add_room("first")
+        second = self.add_room("second")
+        third = self.add_room("third")
+        self.flush()
+
+        layer = self.engine.channel_layer
+        assert len(layer.groups) == 1
+        packet = json.loads(layer.groups[0][1]['packet'])
+        assert {room['game_name'] for room in packet['rooms']} == \
+            {"first", "second", "third"}
+
+        # games do not broadcast their updates
+        for game in (first, second, third):
+            assert all(message[0] != OutboundType.GROUP_SEND
+                       for message in game.outbound)
+
+        first.public_name = "renamed"
+        first.send_lobby_update(BroadcastUpdateLobby(game_token=first.uid))
+        first.add_player(Player(bot=True, bot_name="bot"))
+        first.send_lobby_update(BroadcastUpdateLobby(game_token=first.uid))
+        second.state = GameState.WAITING_PLAYERS
+        second.send_lobby_update(BroadcastUpdateLobby(game_token=second.uid))
+        # one flush planned for all the changes
+        assert len(self.engine.scheduler.jobs) == 1
+        self.flush()
+
+        assert len(layer.groups) == 2
+        group, message = layer.groups[1]
+        assert group == "lobby"
+        assert message['name'] == 'BroadcastLobbyChanges'
+        packet = json.loads(message['packet'])
+        assert packet['version'] == 6
+        assert packet['shard'] == 0
+        # latest values only
+        assert packet['rooms'] == [first.get_lobby_room()]
+        assert packet['rooms'][0]['game_name'] == "renamed"
+        assert packet['rooms'][0]['nb_players'] == 2
+        assert packet['removed'] == [second.uid]
+
+        # nothing changed: nothing planned
+        self.flush()
+        assert len(layer.groups) == 2
+        assert len(self.engine.scheduler.jobs) == 0
@@ -0,0 +1,58 @@
+import json
+import logging
+from unittest import TestCase
+
+from server.game_handler.logs import Lazy, SamplingFilter, JsonFormatter
+
+
+def make_record(msg: str, level: int = logging.DEBUG, args=(), **extra):
+    record = logging.LogRecord('server.test', level, __file__, 1, msg, args,
+                               None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestLogs(TestCase):
+
+    def test_lazy(self):
+        calls = []
+
+        def serialize():
+            calls.append(1)
+            return "packet"
+
+        log = logging.getLogger('server.test.lazy')
+        log.setLevel(logging.INFO)
+        log.debug("process_packet(%s)", Lazy(serialize))
+
+        # Disabled level: never evaluated
+        assert len(calls) == 0
+
+        record = make_record("process_packet(%s)", args=(Lazy(serialize),))
+        assert record.getMessage() == "process_packet(packet)"
+        assert len(calls) == 1
+
+    def test_sampling(self):
+        sampling = SamplingFilter(rate=3)
+
+        kept = [sampling.filter(make_record("move_player(%s)"))
+                for _ in range(6)]
+        assert kept == [True, False, False, True, False, False]
+
+        # Events are sampled independently
+        assert sampling.filter(make_record("process_packet(%s)"))
+
+        # Higher levels are never sampled
+        assert all(sampling.filter(make_record("error", logging.WARNING))
+                   for _ in range(3))
+
+    def test_json(self):
+        record = make_record("move_player(%s)", logging.INFO,
+                             args=(Lazy(str, "Bot"),), game="uid")
+        data = json.loads(JsonFormatter().format(record))
+
+        assert data['level'] == 'INFO'
+        assert data['logger'] == 'server.test'
+        assert data['message'] == 'move_player(Bot)'
+        assert data['game'] == 'uid'
+        assert 'args' not in data
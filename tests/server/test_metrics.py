@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from server.game_handler.data.packets import PingPacket
+from server.game_handler.engine import Engine, Game
+from server.game_handler.metrics import Histogram, Metrics, \
+    render_metrics, get_published_metrics
+
+LOCAL_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+def get_family(families, name):
+    return next(family for family in families if family['name'] == name)
+
+
+class TestMetrics(TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(3)
+
+        samples = histogram.samples('tick', {'game': 'a'})
+
+        assert samples == [
+            ('tick_bucket', {'game': 'a', 'le': '0.1'}, 2),
+            ('tick_bucket', {'game': 'a', 'le': '1.0'}, 3),
+            ('tick_bucket', {'game': 'a', 'le': '+Inf'}, 4),
+            ('tick_sum', {'game': 'a'}, 3.65),
+            ('tick_count', {'game': 'a'}, 4),
+        ]
+
+    def test_game_metrics(self):
+        engine = Engine()
+        game = Game()
+        engine.add_game(game)
+        engine.scheduler.run_pending()
+
+        engine.send_packet(game_uid=game.uid,
+                           packet=PingPacket(player_token="a"))
+        engine.send_packet(game_uid=game.uid,
+                           packet=PingPacket(player_token="b"))
+        engine.scheduler.run_pending()
+
+        metrics = engine.metrics
+        assert metrics.tick_duration[game.uid].count == 2
+        assert metrics.queue_depth[game.uid] == 2
+        assert metrics.packets_processed['Ping'] == 2
+
+        families = metrics.collect(
+            [g.state.name for g in engine.games.values()])
+        assert get_family(families, 'engine_games')['samples'] == [
+            ('engine_games', {'state': 'LOBBY'}, 1)
+        ]
+
+        engine.remove_game(game.uid)
+        engine.scheduler.run_pending()
+
+        assert game.uid not in metrics.tick_duration
+
+    def test_packets_sent(self):
+        metrics = Metrics()
+        metrics.count_packets_sent([
+            {'type': 'lobby.callback', 'name': 'StatusRoom'},
+            {'type': 'send.bundle', 'messages': [
+                {'type': 'player.callback', 'name': 'PlayerMove'},
+                {'type': 'player.callback', 'name': 'PlayerMove'},
+            ]}
+        ])
+
+        assert metrics.packets_sent == {'StatusRoom': 1, 'PlayerMove': 2}
+
+    def test_render(self):
+        metrics = Metrics()
+        metrics.observe_channel('send', 0.002)
+        metrics.count_packet_processed('Ping"Packet')
+
+        text = render_metrics({
+            0: metrics.collect(['LOBBY']),
+            1: metrics.collect(['LOBBY', 'ACTION_AUCTION'])
+        })
+
+        # One HELP/TYPE per metric, even with several shards
+        assert text.count('# TYPE engine_games gauge') == 1
+        assert 'engine_games{shard="1",state="ACTION_AUCTION"} 1.0' in text
+        assert 'engine_packets_processed_total{shard="0",' \
+               'packet="Ping\\"Packet"} 1.0' in text
+        assert 'engine_channel_layer_duration_seconds_bucket{shard="0",' \
+               'operation="send",le="0.0025"} 1.0' in text
+
+    @override_settings(CACHES=LOCAL_CACHE, ENGINE_SHARDS=2)
+    def test_metrics_view(self):
+        engine = Engine(shard=1)
+        engine.add_game(Game())
+        engine.publish_metrics()
+
+        assert list(get_published_metrics().keys()) == [1]
+
+        response = self.client.get('/metrics')
+
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain')
+        assert 'engine_games{shard="1",state="LOBBY"} 1.0' in \
+               response.content.decode()
+
+    @override_settings(CACHES=LOCAL_CACHE, METRICS_TOKEN="secret")
+    def test_metrics_view_restricted(self):
+        remote = {'REMOTE_ADDR': '10.0.0.8'}
+
+        assert self.client.get('/metrics', **remote).status_code == 403
+        assert self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer no',
+                               **remote).status_code == 403
+        assert self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret',
+                               **remote).status_code == 200
+
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.8']):
+            assert self.client.get('/metrics', **remote).status_code == 200
+
+    @override_settings(ENGINE_CONFIG={**settings.ENGINE_CONFIG,
+                                      'METRICS_PUBLISH_INTERVAL': 0})
+    def test_publish_disabled(self):
+        engine = Engine()
+        assert len(engine.scheduler.jobs) == 0
@@ -1,5 +1,14 @@
+import time
 from unittest import TestCase
-from server.game_handler.middlewares import is_valid_uuid
+
+import jwt
+from asgiref.sync import async_to_sync
+from django.test import TestCase as DatabaseTestCase
+
+from server.game_handler.middlewares import is_valid_uuid, \
+    get_wire_format, AuthMiddleware, claims_cache, users_cache
+from server.game_handler.models import User
+from server.game_handler.ttlcache import TTLCache
 
 
 class TestMiddlewares(TestCase):
@@ -10,3 +19,72 @@ class TestMiddlewares(TestCase):
     def test_is_uuid(self):
         assert is_valid_uuid("283e1f5e-3411-44c5-9bc5-037358c47100")
         assert not is_valid_uuid("283e1f5e-341144c5-9bc5-037358c47100")
+
+    def test_wire_format(self):
+        assert get_wire_format({}) == "json"
+        assert get_wire_format({'format': ['msgpack']}) == "msgpack"
+        assert get_wire_format({'format': ['xml']}) == "json"
+
+    def test_ttl_cache(self):
+        cache = TTLCache(size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+
+        # "b" is the least recently used
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+
+        cache.set("d", 4, ttl=-1)
+        assert cache.get("d") is None
+
+        cache.set("e", 5, ttl=0.01)
+        time.sleep(0.02)
+        assert cache.get("e", "expired") == "expired"
+
+
+class TestAuthCache(DatabaseTestCase):
+
+    def setUp(self):
+        claims_cache.clear()
+        users_cache.clear()
+        self.user = User.objects.create(login="cached", name="cached")
+        self.middleware = AuthMiddleware(app=None)
+
+    def tearDown(self):
+        users_cache.clear()
+
+    def test_cached_user(self):
+        get_cached_user = async_to_sync(self.middleware.get_cached_user)
+        user = get_cached_user(self.user.id)
+        assert user.name == "cached"
+        assert str(self.user.id) in users_cache.entries
+
+        # Not shared between connections
+        assert get_cached_user(self.user.id) is not user
+
+        # Saved => read again from the database
+        self.user.name = "renamed"
+        self.user.save()
+        assert str(self.user.id) not in users_cache.entries
+        assert get_cached_user(self.user.id).name == "renamed"
+
+        self.user.delete()
+        assert len(users_cache) == 0
+
+    def test_cached_claims(self):
+        token = jwt.encode({'userId': str(self.user.id),
+                            'exp': int(time.time()) + 3600},
+                           self.middleware.key, algorithm="HS256")
+
+        assert self.middleware.decode_token(token) == str(self.user.id)
+        assert claims_cache.get(token) == str(self.user.id)
+
+        # Expired tokens are not cached
+        expired = jwt.encode({'userId': str(self.user.id),
+                              'exp': int(time.time()) - 10},
+                             self.middleware.key, algorithm="HS256")
+        with self.assertRaises(jwt.InvalidTokenError):
+            self.middleware.decode_token(expired)
+        assert claims_cache.get(expired) is None
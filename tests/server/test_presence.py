@@ -0,0 +1,125 @@
+import json
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from server.game_handler.engine import Engine
+from server.game_handler.game import OutboundType
+from server.game_handler.models import User, UserFriend
+from server.game_handler.presence import friends_cache, profiles_cache, \
+    get_cached_presence, load_presence, get_presence_messages
+
+
+class FakeChannelLayer:
+
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, channel, message):
+        self.messages.append((channel, message))
+
+
+class FakeDatabase:
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    async def run(self, function, *args, **kwargs):
+        self.calls.append(function)
+        return self.result
+
+
+def get_packets(message):
+    messages = message['messages'] if message['type'] == 'send.bundle' \
+        else [message]
+    return [json.loads(m['packet']) for m in messages]
+
+
+class TestPresence(TestCase):
+
+    def setUp(self):
+        friends_cache.clear()
+        profiles_cache.clear()
+        self.player = User.objects.create(login="player", name="player",
+                                          avatar="http://a/player.png")
+        self.friends = [User.objects.create(login="friend%d" % i,
+                                            name="friend%d" % i)
+                        for i in range(3)]
+        for friend in self.friends:
+            UserFriend.objects.create(user=self.player, friend=friend)
+
+        self.token = str(self.player.id)
+        # friend0 and friend1 are in the lobby
+        self.connected = {str(friend.id): "channel.%d" % i
+                          for i, friend in enumerate(self.friends[:2])}
+
+    def test_load(self):
+        with self.assertNumQueries(1):
+            friends, profiles = load_presence(self.token)
+
+        assert friends == [str(friend.id) for friend in self.friends]
+        assert profiles[self.token].avatar == "http://a/player.png"
+
+        # Cached
+        with self.assertNumQueries(0):
+            assert get_cached_presence(self.token) == (friends, profiles)
+
+        # Invalidated
+        UserFriend.objects.filter(friend=self.friends[2]).delete()
+        assert get_cached_presence(self.token) is None
+        load_presence(self.token)
+
+        self.friends[0].name = "renamed"
+        self.friends[0].save()
+        assert get_cached_presence(self.token) is None
+
+    def test_messages(self):
+        outbound = get_presence_messages(
+            self.token, "channel.player", load_presence(self.token),
+            connected=self.connected, online=True)
+
+        # One bundle for the player, one message per connected friend
+        assert [(t, c) for t, c, _ in outbound] == [
+            (OutboundType.SEND, "channel.player"),
+            (OutboundType.SEND, "channel.0"),
+            (OutboundType.SEND, "channel.1"),
+        ]
+        assert [p['friend_token'] for p in get_packets(outbound[0][2])] == \
+            [str(friend.id) for friend in self.friends[:2]]
+        assert get_packets(outbound[1][2])[0] == {
+            'name': 'FriendConnected',
+            'friend_token': self.token,
+            'username': 'player',
+            'avatar_url': 'http://a/player.png'
+        }
+
+        outbound = get_presence_messages(
+            self.token, "channel.player", get_cached_presence(self.token),
+            connected=self.connected, online=False)
+        assert [c for _, c, _ in outbound] == ["channel.0", "channel.1"]
+        assert get_packets(outbound[0][2])[0]['name'] == 'FriendDisconnected'
+
+    def test_send_presence(self):
+        engine = Engine()
+        engine.channel_layer = FakeChannelLayer()
+        engine.database = FakeDatabase(load_presence(self.token))
+        engine.connected_players = dict(self.connected)
+
+        # Connection: loaded again by the pool (external API writes)
+        async_to_sync(engine.send_presence)(
+            player_token=self.token, channel_name="channel.player",
+            online=True)
+
+        assert engine.database.calls == [load_presence]
+        assert [c for c, _ in engine.channel_layer.messages] == [
+            "channel.player", "channel.0", "channel.1"]
+
+        # Disconnection: cached, the database is not used
+        with self.assertNumQueries(0):
+            async_to_sync(engine.send_presence)(
+                player_token=self.token, channel_name="channel.player",
+                online=False)
+
+        assert engine.database.calls == [load_presence]
+        assert len(engine.channel_layer.messages) == 5
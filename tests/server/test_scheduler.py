@@ -0,0 +1,203 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import override_settings
+
+from server.game_handler.data.packets import PingPacket
+from server.game_handler.engine import Engine, Game, GameState
+from server.game_handler.game import QueuePacket
+
+
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        # No periodic job (metrics publication)
+        with override_settings(ENGINE_CONFIG={
+            **settings.ENGINE_CONFIG, 'METRICS_PUBLISH_INTERVAL': 0
+        }):
+            self.engine = Engine()
+        # Scheduler thread is not started, ticks are run manually
+        self.scheduler = self.engine.scheduler
+
+    def test_idle_game_not_scheduled(self):
+        game = Game()
+        self.engine.add_game(game)
+
+        assert game.uid in self.scheduler.deadlines
+        assert self.scheduler.run_pending() == 1
+
+        # Lobby has no deadline, game sleeps until a packet is received
+        assert game.next_deadline() is None
+        assert game.uid not in self.scheduler.deadlines
+        assert self.scheduler.get_wait_seconds() is None
+
+    def test_packet_wakes_game(self):
+        game = Game()
+        self.engine.add_game(game)
+        self.scheduler.run_pending()
+
+        self.engine.send_packet(game_uid=game.uid, packet=PingPacket())
+
+        assert game.uid in self.scheduler.deadlines
+        assert self.scheduler.run_pending() == 1
+        assert game.packets_queue.empty()
+
+    def test_timeout_deadline(self):
+        game = Game()
+        self.engine.add_game(game)
+        self.scheduler.run_pending()
+
+        game.state = GameState.ROUND_START_WAIT
+        game.set_timeout(seconds=3)
+        assert game.next_deadline() == game.timeout
+
+        self.scheduler.schedule(game, game.next_deadline())
+
+        # Not expired yet
+        assert self.scheduler.run_pending() == 0
+        assert self.scheduler.run_pending(
+            now=datetime.now() + timedelta(seconds=4)) == 1
+
+    def test_earlier_tick_not_postponed(self):
+        game = Game()
+        self.engine.add_game(game)
+        self.scheduler.run_pending()
+
+        later = datetime.now() + timedelta(seconds=10)
+        self.scheduler.schedule(game, later)
+        self.scheduler.wake(game)
+        self.scheduler.schedule(game, later)
+
+        assert self.scheduler.deadlines[game.uid] < later
+        assert self.scheduler.run_pending() == 1
+        # Stale entry is ignored
+        assert self.scheduler.run_pending(
+            now=later + timedelta(seconds=1)) == 0
+
+    def test_stop_game(self):
+        game = Game()
+        self.engine.add_game(game)
+        self.scheduler.run_pending()
+
+        game.packets_queue.put(QueuePacket(packet=PingPacket(),
+                                           channel_name=""))
+        self.engine.remove_game(game.uid)
+        self.scheduler.run_pending()
+
+        assert game.state == GameState.STOP_THREAD
+        assert game.uid not in self.scheduler.games
+        assert len(self.engine.games) == 0
+
+    def test_periodic_job(self):
+        calls = []
+        self.scheduler.add_job(5, lambda: calls.append(1))
+
+        assert 4 < self.scheduler.get_wait_seconds() <= 5
+        self.scheduler.run_pending()
+        assert len(calls) == 0
+
+        now = datetime.now() + timedelta(seconds=6)
+        self.scheduler.run_pending(now=now)
+        assert len(calls) == 1
+        # Next execution is planned interval seconds later
+        assert self.scheduler.jobs[0][0] == now + timedelta(seconds=5)
+
+    def test_failing_job(self):
+        def fail():
+            raise ValueError()
+
+        self.scheduler.add_job(1, fail)
+
+        with self.assertLogs('server.game_handler.scheduler', 'ERROR'):
+            self.scheduler.run_pending(
+                now=datetime.now() + timedelta(seconds=2))
+
+        assert len(self.scheduler.jobs) == 1
+
+    def test_failing_tick(self):
+        game = Game()
+        self.engine.add_game(game)
+
+        def fail():
+            raise ValueError()
+
+        game.tick = fail
+
+        with self.assertLogs('server.game_handler.scheduler',
+                             'ERROR') as logs:
+            self.scheduler.run_pending()
+
+        # logged with the game, not printed
+        assert logs.records[0].game == game.uid
+        assert logs.records[0].exc_info is not None
+
+    def test_call_later(self):
+        calls = []
+        self.scheduler.call_later(0.25, lambda: calls.append(1))
+
+        assert 0 < self.scheduler.get_wait_seconds() <= 0.25
+        self.scheduler.run_pending(now=datetime.now() + timedelta(seconds=1))
+        assert len(calls) == 1
+        # Executed once
+        assert len(self.scheduler.jobs) == 0
+        assert self.scheduler.get_wait_seconds() is None
+
+
+class TestAsyncScheduler(TestCase):
+
+    def setUp(self):
+        with override_settings(ENGINE_CONFIG={
+            **settings.ENGINE_CONFIG, 'METRICS_PUBLISH_INTERVAL': 0,
+            'DATABASE_WORKERS': 2
+        }):
+            self.engine = Engine()
+
+    def tearDown(self):
+        if self.engine.database is not None:
+            self.engine.database.shutdown()
+
+    def test_packet_wakes_game(self):
+        game = Game()
+        self.engine.add_game(game)
+
+        async def run():
+            task = self.engine.start_async()
+            await asyncio.sleep(0.05)
+            assert game.database is self.engine.database
+
+            # Woken up from another thread
+            thread = threading.Thread(target=self.engine.send_packet,
+                                      args=(game.uid, PingPacket()))
+            thread.start()
+            thread.join()
+            await asyncio.sleep(0.05)
+
+            task.cancel()
+
+        async_to_sync(run)()
+        assert game.packets_queue.empty()
+        assert game.uid not in self.engine.scheduler.deadlines
+
+    def test_database_pool(self):
+        game = Game()
+        self.engine.add_game(game)
+        names = []
+
+        async def run():
+            self.engine.start_async().cancel()
+
+            # Engine handlers (consumer) and tick code (event loop)
+            names.append(await self.engine.database.run(
+                lambda: threading.current_thread().name))
+            game.save_database(
+                lambda: names.append(threading.current_thread().name))
+
+        async_to_sync(run)()
+        self.engine.database.shutdown()
+
+        assert len(names) == 2
+        assert all(name.startswith("Database") for name in names)
@@ -0,0 +1,140 @@
+from unittest import TestCase
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from server.game_handler.data import Player
+from server.game_handler.database import DatabasePool
+from server.game_handler.engine import Engine, Game
+from server.game_handler.models import User
+from server.game_handler.sharding import get_shard_channel, \
+    get_all_channels, get_game_shard, get_game_channel, generate_game_uid, \
+    publish_shard_load, get_least_loaded_shard, get_player_game
+
+LOCAL_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class TestSharding(TestCase):
+
+    def test_single_shard(self):
+        game = Game()
+
+        assert get_all_channels() == ['game_engine']
+        assert get_game_channel(game.uid) == 'game_engine'
+        assert get_least_loaded_shard() == 0
+
+    @override_settings(ENGINE_SHARDS=4)
+    def test_channels(self):
+        assert get_all_channels() == ['game_engine_0', 'game_engine_1',
+                                      'game_engine_2', 'game_engine_3']
+        assert get_shard_channel(2) == 'game_engine_2'
+
+        # invalid or empty token
+        assert get_game_shard("") == 0
+        assert get_game_shard("invalid") == 0
+
+    @override_settings(ENGINE_SHARDS=4)
+    def test_generate_game_uid(self):
+        for shard in range(4):
+            uid = generate_game_uid(shard)
+            assert get_game_shard(uid) == shard
+            assert get_game_channel(uid) == 'game_engine_%d' % shard
+
+    @override_settings(ENGINE_SHARDS=3, CACHES=LOCAL_CACHE)
+    def test_least_loaded_shard(self):
+        publish_shard_load(0, 4)
+        publish_shard_load(1, 2)
+        publish_shard_load(2, 7)
+
+        assert get_least_loaded_shard() == 1
+
+        publish_shard_load(1, 9)
+
+        assert get_least_loaded_shard() == 0
+
+    @override_settings(ENGINE_SHARDS=3, CACHES=LOCAL_CACHE)
+    def test_expired_load(self):
+        cache.clear()
+        # nothing published
+        assert get_least_loaded_shard() == 0
+
+        publish_shard_load(1, 5)
+        publish_shard_load(2, 8)
+
+        # shard 0 stopped publishing: not considered empty
+        assert get_least_loaded_shard() == 1
+
+    @override_settings(ENGINE_SHARDS=2, CACHES=LOCAL_CACHE)
+    def test_engine_load(self):
+        engine = Engine(shard=1)
+        game = Game(uid=generate_game_uid(1))
+        engine.add_game(game)
+
+        publish_shard_load(0, 3)
+        assert get_least_loaded_shard() == 1
+
+        engine.add_game(Game(uid=generate_game_uid(1)))
+        engine.add_game(Game(uid=generate_game_uid(1)))
+        engine.add_game(Game(uid=generate_game_uid(1)))
+        assert get_least_loaded_shard() == 0
+
+        engine.remove_game(game.uid)
+        engine.scheduler.run_pending()
+        assert get_least_loaded_shard() == 0
+
+        # stopped by its tick
+        for game in list(engine.games.values()):
+            game.proceed_stop()
+        assert get_least_loaded_shard() == 1
+        # load republished before it expires
+        assert any(job[2] == engine.publish_load
+                   for job in engine.scheduler.jobs)
+
+    @override_settings(ENGINE_SHARDS=2, CACHES=LOCAL_CACHE)
+    def test_load_published_by_pool(self):
+        cache.clear()
+        engine = Engine(shard=1)
+        engine.database = DatabasePool(workers=1)
+        engine.add_game(Game(uid=generate_game_uid(1)))
+        # cache is written by the pool, not by the event loop
+        engine.database.shutdown()
+        # only published shard
+        assert get_least_loaded_shard() == 1
+
+    @override_settings(ENGINE_SHARDS=2, CACHES=LOCAL_CACHE)
+    def test_player_in_other_shard(self):
+        cache.clear()
+        first = Engine(shard=0)
+        second = Engine(shard=1)
+        game = Game(uid=generate_game_uid(0))
+        first.add_game(game)
+
+        player = Player(bot=False, user=User(
+            id="283e1f5e-3411-44c5-9bc5-037358c47100"))
+        bot = Player(bot=True, bot_name="bot")
+        game.add_player(player)
+        game.add_player(bot)
+        first.players.wait()
+
+        token = player.get_id()
+        assert get_player_game(token) == game.uid
+        # bots are not published
+        assert get_player_game(bot.get_id()) is None
+
+        # player can not create a game on the other shard
+        assert second.load_creator(token) is None
+
+        game.remove_player(player)
+        first.players.wait()
+        assert get_player_game(token) is None
+
+        # republished before expiration
+        game.add_player(player)
+        cache.clear()
+        first.publish_players()
+        first.players.wait()
+        assert get_player_game(token) == game.uid
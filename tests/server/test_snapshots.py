@@ -0,0 +1,225 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from server.game_handler.data import Player
+from server.game_handler.data.auction import Auction
+from server.game_handler.data.exchange import Exchange, ExchangeState
+from server.game_handler.data.packets import AppletReady, \
+    InternalCheckPlayerValidity, PlayerReconnect
+from server.game_handler.data.state import BoardState
+from server.game_handler.engine import Engine
+from server.game_handler.game import Game, GameState, QueuePacket
+from server.game_handler.models import User
+from server.game_handler.snapshots import get_base_key, get_delta_key, \
+    get_index_key
+
+LOCAL_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCAL_CACHE, GAME_SNAPSHOTS=True,
+                   ENGINE_CONFIG={**settings.ENGINE_CONFIG,
+                                  'BOT_WORKERS': 0,
+                                  'METRICS_PUBLISH_INTERVAL': 0})
+class TestSnapshots(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.engine = Engine()
+        self.engine.restore_games()
+        self.game = Game()
+        self.engine.add_game(self.game)
+
+        self.human = Player(bot=False, user=User(
+            id="283e1f5e-3411-44c5-9bc5-037358c47100"))
+        self.human.connect()
+        self.bot = Player(bot=True, bot_name="bot")
+        self.game.add_player(self.human)
+        self.game.add_player(self.bot)
+        self.game.host_player = self.human
+
+        board = self.game.board
+        for player in board.players:
+            player.money = 1000
+        board.squares[1].owner = self.human
+        board.squares[5].owner = self.bot
+        board.squares[5].mortgaged = True
+        self.bot.jail_cards['chance'] = True
+        board.chance_deck[board.chance_card_indexes['leave_jail']] \
+            .available = False
+
+        self.game.state = GameState.ACTION_TIMEOUT_WAIT
+        self.game.set_timeout(seconds=60)
+
+    def save(self) -> int:
+        queued = self.engine.snapshots.capture(
+            list(self.engine.games.values()))
+        self.engine.snapshots.wait()
+        return queued
+
+    def restore(self) -> Game:
+        engine = Engine()
+        engine.restore_games()
+        game = engine.games[self.game.uid]
+        assert game.clock is engine.clock
+        return game
+
+    def test_restore(self):
+        assert self.save() == 1
+        assert cache.get(get_index_key(0)) == [self.game.uid]
+
+        game = self.restore()
+        board = game.board
+
+        assert game.state is GameState.ACTION_TIMEOUT_WAIT
+        assert BoardState.from_board(board) == \
+            BoardState.from_board(self.game.board)
+        assert board.squares[1].owner is board.get_player(
+            self.human.get_id())
+        assert not board.chance_deck[
+            board.chance_card_indexes['leave_jail']].available
+        assert game.host_player is board.get_player(self.human.get_id())
+        assert 50 < game.get_remaining_timeout_seconds() <= 60
+
+        # Players reconnect, bots are still playing
+        assert not board.get_player(self.human.get_id()).online
+        assert board.get_player(self.bot.get_id()).online
+        assert game.board.get_online_real_players_count() == 0
+
+    def test_delta(self):
+        self.save()
+        base = cache.get(get_base_key(self.game.uid))
+
+        # Nothing changed => nothing saved
+        assert self.save() == 0
+        assert cache.get(get_delta_key(self.game.uid)) is None
+
+        self.human.money = 1234
+        self.game.board.squares[3].owner = self.human
+        self.game.state = GameState.ROUND_START_WAIT
+        assert self.save() == 1
+
+        # Only a delta was written
+        assert cache.get(get_base_key(self.game.uid)) == base
+        assert cache.get(get_delta_key(self.game.uid)) is not None
+
+        game = self.restore()
+        assert game.state is GameState.ROUND_START_WAIT
+        assert game.board.get_player(self.human.get_id()).money == 1234
+        assert game.board.squares[3].owner is \
+            game.board.get_player(self.human.get_id())
+
+    def test_auction(self):
+        self.save()
+        base = cache.get(get_base_key(self.game.uid))
+        auction = Auction(player=self.human, tour_duration=10,
+                          square=self.game.board.squares[39])
+        auction.bid(self.human, 100)
+        self.game.board.current_auction = auction
+        self.game.state = GameState.ACTION_AUCTION
+        assert self.save() == 1
+
+        # Auctions are saved in deltas, the board is not pickled again
+        assert cache.get(get_base_key(self.game.uid)) == base
+        assert self.save() == 0
+        game = self.restore()
+        restored = game.board.current_auction
+        assert restored.highest_bid == 100
+        assert restored.highest_bidder is \
+            game.board.get_player(self.human.get_id())
+        assert restored.square is game.board.squares[39]
+        assert 0 < (restored.timeout - datetime.now()).total_seconds() <= 10
+
+        # Auction ended => next delta removes it
+        self.game.board.current_auction = None
+        self.game.state = GameState.ACTION_TIMEOUT_WAIT
+        self.save()
+        assert self.restore().board.current_auction is None
+
+    def test_exchange(self):
+        self.save()
+        board = self.game.board
+        exchange = Exchange(self.human, selected_player=self.bot)
+        exchange.add_or_remove_square(board.squares[1])
+        exchange.add_or_remove_card(
+            board.chance_deck[board.chance_card_indexes['leave_jail']],
+            recipient=True)
+        exchange.selected_player_money = 50
+        exchange.state = ExchangeState.WAITING_RESPONSE
+        board.current_exchange = exchange
+        self.save()
+
+        game = self.restore()
+        board = game.board
+        restored = board.current_exchange
+        assert restored.player is board.get_player(self.human.get_id())
+        assert restored.selected_player is board.get_player(self.bot.get_id())
+        assert restored.player_squares == [board.squares[1]]
+        assert restored.selected_player_cards == [
+            board.chance_deck[board.chance_card_indexes['leave_jail']]]
+        assert restored.selected_player_money == 50
+        assert restored.state is ExchangeState.WAITING_RESPONSE
+
+    def test_journal(self):
+        self.save()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(GAME_JOURNAL_DIR=directory):
+                engine = Engine()
+            engine.restore_games()
+
+            # restored games are recorded like new games
+            journal = engine.games[self.game.uid].journal
+            assert journal.path == os.path.join(
+                directory, '%s.journal' % self.game.uid)
+
+    def test_stopped(self):
+        self.save()
+        self.engine.remove_game(self.game.uid)
+        self.save()
+
+        assert cache.get(get_index_key(0)) == []
+        assert cache.get(get_base_key(self.game.uid)) is None
+
+        engine = Engine()
+        engine.restore_games()
+        assert len(engine.games) == 0
+
+    def test_reconnect(self):
+        self.save()
+        game = self.restore()
+        packets = []
+        game.broadcast_packet = packets.append
+        token = self.human.get_id()
+
+        game.process_packet(QueuePacket(
+            packet=InternalCheckPlayerValidity(player_token=token),
+            channel_name="channel"))
+        game.process_packet(QueuePacket(
+            packet=AppletReady(player_token=token), channel_name="channel"))
+
+        player = game.board.get_player(token)
+        assert player.online and not player.bot
+        assert player.channel_name == "channel"
+        assert isinstance(packets[0], PlayerReconnect)
+
+        # A player reconnected => game continues
+        game.reconnect_timeout = datetime.now() - timedelta(seconds=1)
+        game.process_logic()
+        assert game.state is not GameState.STOP_THREAD
+
+    def test_no_reconnection(self):
+        self.save()
+        game = self.restore()
+
+        game.reconnect_timeout = datetime.now() - timedelta(seconds=1)
+        game.process_logic()
+        assert game.state is GameState.STOP_THREAD